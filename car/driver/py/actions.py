@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Driving actions compiled from command messages. Each action is validated and
+its value converted once, when the Pub/Sub callback receives the command, so
+the main loop only hands ready-made Action tuples to their handlers.
+
+New action types are added by registering a value parser and a handler:
+
+    @registry.register("honk", parse_int)
+    def honk(driver, action):
+        ...
+"""
+
+import collections
+import time
+
+from histogram import LatencyHistogram
+
+# One action of a driving command: cloudTimestampMs of the command, action name and the parsed value
+Action = collections.namedtuple('Action', ['timestamp_ms', 'name', 'value'])
+
+# How an action type is compiled and executed, see ActionRegistry.register()
+ActionType = collections.namedtuple('ActionType', ['name', 'parse', 'handler', 'additive'])
+
+
+class InvalidAction(ValueError):
+    """An action that is unknown or has an invalid value."""
+    pass
+
+
+def parse_int(value):
+    return int(value)
+
+
+def parse_text(value):
+    return str(value)
+
+
+def parse_choice(*choices):
+    """Returns a parser accepting only the given string values."""
+    def parse(value):
+        if value not in choices:
+            raise ValueError("expected one of {}".format(", ".join(choices)))
+        return value
+    return parse
+
+
+def parse_true(value):
+    """Accepts only "true" (or True) - the value the controller sends for one-shot requests."""
+    if value not in ("true", True):
+        raise ValueError("expected 'true'")
+    return True
+
+
+class ActionRegistry(object):
+    """Parsers and handlers of the action types the car understands, with the time spent in each type."""
+
+    def __init__(self):
+        self._types = {}
+        self.timings = {}
+
+    def register(self, name, parse, additive=False):
+        """
+        Decorator registering handler(driver, action) for actions called name.
+        : parse: converts the value from the command message; raises ValueError (or TypeError) if it is invalid
+        : additive: values of consecutive actions of this type add up, e.g. two right turns make one longer turn
+        """
+        def decorator(handler):
+            self._types[name] = ActionType(name, parse, handler, additive)
+            self.timings[name] = LatencyHistogram("{} action".format(name))
+            return handler
+        return decorator
+
+    def additive_names(self):
+        return tuple(name for name, action_type in self._types.items() if action_type.additive)
+
+    def compile(self, timestamp_ms, name, value):
+        """Returns the Action for one entry of a command's actions list. Raises InvalidAction."""
+        action_type = self._types.get(name)
+        if action_type is None:
+            raise InvalidAction("unknown action '{}'".format(name))
+        try:
+            return Action(timestamp_ms, name, action_type.parse(value))
+        except (TypeError, ValueError) as e:
+            raise InvalidAction("invalid value {!r} for action '{}': {}".format(value, name, e))
+
+    def run(self, action, driver):
+        """Executes a compiled action and records how long it took."""
+        start = time.time()
+        try:
+            self._types[action.name].handler(driver, action)
+        finally:
+            self.timings[action.name].record((time.time() - start) * 1000)
+
+    def timing_summary(self):
+        return "; ".join(histogram.summary() for name, histogram in sorted(self.timings.items()) if histogram.count)
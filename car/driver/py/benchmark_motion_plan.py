@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Runs typical navigation plans on the simulated car, once action by action the
+way the car used to - every move to a full stop, fixed pauses after turns and
+gripper closes - and once as a motion plan (see motion_plan.py). Prints the
+sum of the individual action times against the plan time, and how far apart
+the two runs end up. Times are in simulated seconds:
+
+    python benchmark_motion_plan.py --speedup 10
+    python benchmark_motion_plan.py --speedup 10 --blend-degrees 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+
+from hardware import Arena
+from hardware import ScaledClock
+from hardware import SimulatedGoPiGo
+from motion_plan import Drive
+from motion_plan import Gripper
+from motion_plan import MotionPlanExecutor
+from motion_plan import Speed
+from motion_plan import Turn
+from robotderbycar import RobotDerbyCar
+
+# Plans the controller sends while looking for, approaching and bringing home a ball
+PLANS = (
+    ("search", [Turn(45)]),
+    ("approach", [Speed(300), Turn(22), Drive(450), Turn(-8), Drive(200)]),
+    ("grab", [Drive(120), Gripper("close")]),
+    ("go home", [Turn(-90), Drive(600), Turn(30), Drive(400), Gripper("open"), Drive(-150)]),
+)
+
+# Obstacle checks only start beyond this distance, see RobotDerbyCar.start_drive()
+DIST_LIMIT = 250
+
+
+def run(steps, speedup, blend_degrees, one_at_a_time):
+    """Returns (seconds, (x, y, heading)) of executing the steps on a fresh simulated car in an empty arena."""
+    backend = SimulatedGoPiGo(arena=Arena(6000, 6000), x=3000, y=3000, clock=ScaledClock(speedup))
+    car = RobotDerbyCar(backend)
+    try:
+        if one_at_a_time:
+            executor = MotionPlanExecutor(car, DIST_LIMIT, blend_degrees=0, legacy_pauses=True)
+            seconds = sum(executor.execute([step]).seconds for step in steps)
+        else:
+            executor = MotionPlanExecutor(car, DIST_LIMIT, blend_degrees=blend_degrees)
+            seconds = executor.execute(steps).seconds
+        # Let the wheels come to rest before reading the pose
+        car.clock.sleep(0.2)
+        return seconds, backend.pose()
+    finally:
+        car.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--speedup', type=float, default=10.0, help='how much faster than real time to simulate')
+    parser.add_argument('--blend-degrees', type=int, default=MotionPlanExecutor.BLEND_DEGREES,
+                        help='encoder degrees before the end of a move at which the next one takes over, 0 to not blend')
+    args = parser.parse_args()
+
+    print("{:>10} {:>6} {:>14} {:>10} {:>8} {:>14} {:>12}".format(
+        "plan", "steps", "sum of steps s", "plan s", "saved", "end offset mm", "heading deg"))
+    total_sequential = total_plan = 0
+    for name, steps in PLANS:
+        sequential, sequential_pose = run(steps, args.speedup, args.blend_degrees, one_at_a_time=True)
+        plan, plan_pose = run(steps, args.speedup, args.blend_degrees, one_at_a_time=False)
+        total_sequential += sequential
+        total_plan += plan
+        heading_offset = (plan_pose[2] - sequential_pose[2] + 180) % 360 - 180
+        print("{:>10} {:>6} {:>14.2f} {:>10.2f} {:>7.0f}% {:>14.1f} {:>12.1f}".format(
+            name, len(steps), sequential, plan, 100 * (1 - plan / sequential),
+            math.hypot(plan_pose[0] - sequential_pose[0], plan_pose[1] - sequential_pose[1]), heading_offset))
+    print("{:>10} {:>6} {:>14.2f} {:>10.2f} {:>7.0f}%".format(
+        "total", "", total_sequential, total_plan, 100 * (1 - total_plan / total_sequential)))
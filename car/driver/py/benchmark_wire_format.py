@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the wire formats in wire_format.py: bytes per message and the time to
+encode and decode a typical sensor message and driving command. Run it on the
+car to get numbers for its CPU:
+
+    python benchmark_wire_format.py --iterations 20000
+"""
+
+from __future__ import print_function
+
+import argparse
+import platform
+import timeit
+
+from wire_format import WIRE_VERSIONS
+from wire_format import decode_command
+from wire_format import decode_sensor_message
+from wire_format import encode_command
+from wire_format import encode_sensor_message
+
+# A sensor message as drive.py sends it while streaming
+SENSOR_MESSAGE = {
+    "timestampMs": 1519509836918,
+    "carId": "1",
+    "carState": {"color": "Red", "batteryLeft": 9.61, "ballsCollected": 2},
+    "sensors": {
+        "frontLaserDistanceMm": 1243,
+        "frontCameraImagePath": "https://storage.googleapis.com/robot-derby-camera-1/image-2018-02-24-21-43-56-918.jpg",
+        "frontCameraImagePathGCS": "gs://robot-derby-camera-1/image-2018-02-24-21-43-56-918.jpg",
+    },
+    "streamStats": {"targetFps": 2.0, "fps": 1.75, "inFlight": 1, "dropped": 0},
+}
+
+# A typical navigation command from the controller
+COMMAND = {
+    "cloudTimestampMs": 1519592078172,
+    "carTimestampMs": 1519592078100,
+    "mode": "automatic",
+    "sensorRate": "onDemand",
+    "goal": "go2ball",
+    "actions": [{"setSpeed": 300}, {"turnRight": 22}, {"driveForwardMm": 450}, {"gripperPosition": "close"},
+                {"sendSensorMessage": "true"}],
+}
+
+
+def microseconds(function, iterations):
+    return timeit.timeit(function, number=iterations) * 1e6 / iterations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10000, help='encodes and decodes to time per measurement')
+    args = parser.parse_args()
+
+    print("Python {} on {}".format(platform.python_version(), platform.machine()))
+    print("{:>8} {:>8} {:>6} {:>10} {:>10}".format("message", "version", "bytes", "encode us", "decode us"))
+    for name, message, encode, decode in (("sensor", SENSOR_MESSAGE, encode_sensor_message, decode_sensor_message),
+                                          ("command", COMMAND, encode_command, decode_command)):
+        for version in WIRE_VERSIONS:
+            payload = encode(message, version)
+            assert decode(payload) == (version, message)
+            print("{:>8} {:>8} {:>6} {:>10.1f} {:>10.1f}".format(
+                name, version, len(payload),
+                microseconds(lambda: encode(message, version), args.iterations),
+                microseconds(lambda: decode(payload), args.iterations)))
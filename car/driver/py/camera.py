@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Camera access for the car. The camera is opened once and frames are captured
+as JPEG bytes in memory instead of being written to the SD card.
+
+ContinuousCamera keeps capturing from a camera backend into a small ring
+buffer, so a sensor message can use a recent frame without waiting for the
+camera. A backend is any object with capture() returning JPEG bytes and
+close(), which allows the camera to be replaced when testing without a Pi.
+"""
+
+import collections
+import io
+import threading
+import time
+
+# A captured frame: time.time() when the capture started, sequence number and JPEG bytes
+Frame = collections.namedtuple('Frame', ['timestamp', 'sequence', 'jpeg_bytes'])
+
+
+class PiCameraSource(object):
+    """Long-lived Raspberry Pi camera that captures JPEG frames into memory."""
+
+    def __init__(self, width, height, flip=False, use_video_port=False):
+        # Imported here so the rest of the driver can be loaded on machines without a Pi camera
+        import picamera
+        self.camera = picamera.PiCamera()
+        self.camera.resolution = (int(width), int(height))
+
+        # box = (0.0, 0.0, 1.0, 1.9)
+        # camera.zoom = box
+        # camera.iso = 100
+        # camera.sharpness = 100
+
+        if flip:
+            self.camera.vflip = True
+            self.camera.hflip = True
+
+        # The video port avoids switching the sensor mode on every capture, which continuous capture needs
+        self.use_video_port = use_video_port
+
+    def capture(self):
+        """Returns a single frame as JPEG bytes."""
+        stream = io.BytesIO()
+        self.camera.capture(stream, format='jpeg', use_video_port=self.use_video_port)
+        return stream.getvalue()
+
+    def close(self):
+        self.camera.close()
+
+
+class StaticImageSource(object):
+    """Camera stand-in that returns the same JPEG bytes on every capture - for testing without a Pi."""
+
+    def __init__(self, jpeg_bytes):
+        self.jpeg_bytes = jpeg_bytes
+        self.captures = 0
+
+    def capture(self):
+        self.captures += 1
+        return self.jpeg_bytes
+
+    def close(self):
+        pass
+
+
+class ContinuousCamera(object):
+    """
+    Captures frames from a camera backend on a background thread into a ring buffer.
+    : backend: object with capture() returning JPEG bytes, e.g. PiCameraSource or StaticImageSource
+    : buffer_size: how many of the most recent frames to keep
+    : max_fps: upper bound on the capture rate, to leave CPU for the rest of the driver
+    """
+
+    def __init__(self, backend, buffer_size=3, max_fps=10):
+        self.backend = backend
+        self.min_interval = 1.0 / max_fps
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._new_frame = threading.Condition()
+        self._sequence = 0
+        self._running = False
+        self._thread = None
+
+        # Frame age statistics - how old frames are when they are handed out
+        self.frames_captured = 0
+        self.frames_served = 0
+        self.capture_errors = 0
+        self._age_total = 0.0
+        self.last_frame_age = None
+        self.max_frame_age = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='camera-capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2)
+        self.backend.close()
+
+    def _run(self):
+        while self._running:
+            started = time.time()
+            try:
+                jpeg_bytes = self.backend.capture()
+            except Exception as e:
+                self.capture_errors += 1
+                print("ContinuousCamera: capture failed: {}".format(e))
+                time.sleep(self.min_interval)
+                continue
+            with self._new_frame:
+                self._sequence += 1
+                self.frames_captured += 1
+                self._frames.append(Frame(started, self._sequence, jpeg_bytes))
+                self._new_frame.notify_all()
+            elapsed = time.time() - started
+            if elapsed < self.min_interval:
+                time.sleep(self.min_interval - elapsed)
+
+    def latest_frame(self, not_before=0, timeout=1.0):
+        """
+        Returns the newest buffered Frame whose capture started at or after not_before.
+        Passing the time the car stopped moving as not_before avoids motion blurred frames.
+        Waits up to timeout seconds for such a frame and returns None if there is none.
+        """
+        deadline = time.time() + timeout
+        with self._new_frame:
+            while not self._frames or self._frames[-1].timestamp < not_before:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._new_frame.wait(remaining)
+            frame = self._frames[-1]
+
+            age = time.time() - frame.timestamp
+            self.frames_served += 1
+            self._age_total += age
+            self.last_frame_age = age
+            self.max_frame_age = age if self.max_frame_age is None else max(self.max_frame_age, age)
+        return frame
+
+    def stats(self):
+        """Returns frame counters and ages (in seconds) of the frames handed out so far."""
+        with self._new_frame:
+            return {
+                "framesCaptured": self.frames_captured,
+                "framesServed": self.frames_served,
+                "captureErrors": self.capture_errors,
+                "lastFrameAge": self.last_frame_age,
+                "meanFrameAge": self._age_total / self.frames_served if self.frames_served else None,
+                "maxFrameAge": self.max_frame_age,
+            }
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Queue of driving actions shared between the Pub/Sub callback thread and the
+main loop. The main loop blocks on it while idle, so a new command wakes it up
+immediately instead of after a polling sleep.
+
+The queue also owns the state that driving commands change (mode, sensor
+rate, balls collected), so the callback and the main loop only ever touch it
+under the same lock. A newer command batch replaces whatever is still queued
+from an older one - the car never works through an outdated plan while fresh
+commands wait behind it.
+"""
+
+import collections
+import threading
+import time
+
+# Actions whose values add up when they follow each other, e.g. two right turns make one longer turn
+# (by default - drive.py takes them from its ActionRegistry)
+ADDITIVE_ACTIONS = ('driveForwardMm', 'driveBackwardMm', 'turnRight', 'turnLeft')
+
+# Snapshot of the command driven state of the car, see CommandQueue.snapshot()
+CarCommandState = collections.namedtuple('CarCommandState', ['mode', 'sensor_rate', 'stream_messages', 'balls_collected'])
+
+
+def coalesce_actions(actions, additive_actions=ADDITIVE_ACTIONS):
+    """
+    Merges consecutive actions of the same type.
+    : actions: list of actions.Action in execution order, with parsed values
+    : additive_actions: names of the actions whose values are summed
+    Any other action repeated with the same value is only kept once.
+    """
+    merged = []
+    for action in actions:
+        if merged and merged[-1].name == action.name:
+            if action.name in additive_actions:
+                merged[-1] = merged[-1]._replace(value=merged[-1].value + action.value)
+                continue
+            elif merged[-1].value == action.value:
+                continue
+        merged.append(action)
+    return merged
+
+
+class CommandQueue(object):
+    """
+    Thread-safe queue of actions.Action tuples plus the car's command state.
+    : additive_actions: names of the actions whose values add up when they follow each other
+    """
+
+    def __init__(self, additive_actions=ADDITIVE_ACTIONS):
+        self.additive_actions = additive_actions
+        self._actions = collections.deque()
+        self._changed = threading.Condition()
+        self._woken = False
+
+        self.last_command_timestamp = 0
+        # assigned mode from the most recent processed driving command - see drive-message.js for details
+        self.mode = "undefined"
+        self.sensor_rate = "undefined"
+        # If this is true, the car will be streaming sensor messages non stop, otherwise it will only send messages when asked to do so
+        self.stream_messages = False
+        # How many balls have been collected so far
+        self.balls_collected = 0
+
+        self.batches_accepted = 0
+        self.batches_rejected = 0
+        self.actions_preempted = 0
+        self.actions_coalesced = 0
+
+    def submit(self, cloud_timestamp_ms, actions, mode, sensor_rate, ball_captured=False):
+        """
+        Applies a driving command batch.
+        : actions: list of actions.Action compiled from the command, in execution order
+        Returns False, changing nothing, if the batch is not newer than the last accepted one.
+        Otherwise any actions still queued from older batches are dropped in favor of the new ones.
+        """
+        merged = coalesce_actions(actions, self.additive_actions)
+        with self._changed:
+            if cloud_timestamp_ms <= self.last_command_timestamp:
+                self.batches_rejected += 1
+                return False
+
+            self.last_command_timestamp = cloud_timestamp_ms
+            self.mode = mode
+            self.sensor_rate = sensor_rate
+            if sensor_rate == 'onDemand':
+                self.stream_messages = False
+            if sensor_rate == 'continuous':
+                self.stream_messages = True
+            if ball_captured:
+                self.balls_collected += 1
+
+            preempted = len(self._actions)
+            self._actions.clear()
+            self._actions.extend(merged)
+
+            self.batches_accepted += 1
+            self.actions_preempted += preempted
+            self.actions_coalesced += len(actions) - len(merged)
+            self._changed.notify_all()
+
+        if preempted:
+            print("CommandQueue: dropped {} stale queued actions in favor of command {}".format(preempted, cloud_timestamp_ms))
+        return True
+
+    def popleft(self):
+        """Returns the oldest queued action, or None if the queue is empty."""
+        with self._changed:
+            if not self._actions:
+                return None
+            return self._actions.popleft()
+
+    def popleft_while(self, predicate):
+        """Removes and returns the oldest queued actions for as long as predicate(action) is true for them."""
+        popped = []
+        with self._changed:
+            while self._actions and predicate(self._actions[0]):
+                popped.append(self._actions.popleft())
+        return popped
+
+    def snapshot(self):
+        """Returns the current CarCommandState."""
+        with self._changed:
+            return CarCommandState(self.mode, self.sensor_rate, self.stream_messages, self.balls_collected)
+
+    def reset_balls_collected(self):
+        with self._changed:
+            self.balls_collected = 0
+
+    def wake(self):
+        """Wakes up the main loop, e.g. after the sensor rate changed or <ESC> was pressed."""
+        with self._changed:
+            self._woken = True
+            self._changed.notify_all()
+
+    def wait(self, timeout):
+        """
+        Blocks until an action is queued, wake() is called or timeout seconds pass.
+        Returns True if there are actions waiting.
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while not self._actions and not self._woken:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            self._woken = False
+            return len(self._actions) > 0
+
+    def __len__(self):
+        with self._changed:
+            return len(self._actions)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tests for CommandQueue, with a fake Pub/Sub subscriber delivering bursts of
+driving commands from its own thread while the test plays the main loop.
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import threading
+import time
+import unittest
+
+from actions import Action
+from command_queue import CommandQueue
+from command_queue import coalesce_actions
+
+
+class FakeSubscriber(object):
+    """
+    Delivers driving commands to a CommandQueue from a background thread, like the Pub/Sub
+    callback does. Each command is (cloud_timestamp_ms, [(action name, value), ...]).
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.accepted = []
+
+    def deliver(self, commands, mode="automatic", sensor_rate="onDemand"):
+        thread = threading.Thread(target=self._run, args=(commands, mode, sensor_rate))
+        thread.start()
+        return thread
+
+    def _run(self, commands, mode, sensor_rate):
+        for timestamp_ms, actions in commands:
+            compiled = [Action(timestamp_ms, name, value) for name, value in actions]
+            self.accepted.append(self.queue.submit(timestamp_ms, compiled, mode, sensor_rate))
+
+
+def drain(queue):
+    actions = []
+    action = queue.popleft()
+    while action is not None:
+        actions.append(action)
+        action = queue.popleft()
+    return actions
+
+
+class CommandQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = CommandQueue()
+        self.subscriber = FakeSubscriber(self.queue)
+
+    def test_newer_batch_preempts_queued_actions(self):
+        self.subscriber.deliver([(1000, [("turnRight", 45), ("driveForwardMm", 300), ("gripperPosition", "close")])]).join()
+        self.assertEqual(self.queue.popleft(), Action(1000, "turnRight", 45))
+
+        # The rest of the first command is still queued when the next one arrives
+        self.subscriber.deliver([(2000, [("turnLeft", 10)])]).join()
+        self.assertEqual(drain(self.queue), [Action(2000, "turnLeft", 10)])
+        self.assertEqual(self.queue.actions_preempted, 2)
+        self.assertEqual(self.queue.last_command_timestamp, 2000)
+
+    def test_burst_leaves_only_the_newest_batch(self):
+        burst = [(timestamp_ms, [("driveForwardMm", 100), ("turnRight", timestamp_ms // 1000)]) for timestamp_ms in range(1000, 11000, 1000)]
+        self.subscriber.deliver(burst).join()
+        self.assertEqual(self.subscriber.accepted, [True] * 10)
+        self.assertEqual(drain(self.queue), [Action(10000, "driveForwardMm", 100), Action(10000, "turnRight", 10)])
+        self.assertEqual(self.queue.actions_preempted, 18)
+
+    def test_consecutive_actions_are_merged(self):
+        self.subscriber.deliver([(1000, [("turnRight", 20), ("turnRight", 25), ("driveForwardMm", 100), ("driveForwardMm", 50),
+                                         ("gripperPosition", "open"), ("gripperPosition", "open"), ("turnRight", 5)])]).join()
+        self.assertEqual(drain(self.queue), [Action(1000, "turnRight", 45), Action(1000, "driveForwardMm", 150),
+                                             Action(1000, "gripperPosition", "open"), Action(1000, "turnRight", 5)])
+        self.assertEqual(self.queue.actions_coalesced, 3)
+
+    def test_different_values_of_non_additive_actions_are_kept(self):
+        actions = [Action(1, "gripperPosition", "open"), Action(1, "gripperPosition", "close")]
+        self.assertEqual(coalesce_actions(actions), actions)
+
+    def test_stale_and_repeated_commands_are_rejected(self):
+        self.subscriber.deliver([(2000, [("turnRight", 45)]), (1000, [("turnLeft", 90)]), (2000, [("turnLeft", 90)])]).join()
+        self.assertEqual(self.subscriber.accepted, [True, False, False])
+        self.assertEqual(drain(self.queue), [Action(2000, "turnRight", 45)])
+        self.assertEqual(self.queue.batches_rejected, 2)
+        self.assertEqual(self.queue.last_command_timestamp, 2000)
+
+    def test_rejected_command_changes_no_state(self):
+        self.subscriber.deliver([(2000, [])], sensor_rate="continuous").join()
+        self.subscriber.deliver([(1000, [])], mode="debug", sensor_rate="onDemand").join()
+        state = self.queue.snapshot()
+        self.assertEqual((state.mode, state.sensor_rate, state.stream_messages), ("automatic", "continuous", True))
+
+    def test_command_wakes_waiting_main_loop(self):
+        woken = []
+
+        def main_loop():
+            started = time.time()
+            woken.append((self.queue.wait(10), time.time() - started))
+
+        thread = threading.Thread(target=main_loop)
+        thread.start()
+        time.sleep(0.1)
+        self.subscriber.deliver([(1000, [("turnRight", 45)])]).join()
+        thread.join(5)
+
+        self.assertEqual(len(woken), 1)
+        has_actions, waited = woken[0]
+        self.assertTrue(has_actions)
+        self.assertLess(waited, 5)
+
+    def test_wake_without_actions(self):
+        threading.Timer(0.1, self.queue.wake).start()
+        started = time.time()
+        self.assertFalse(self.queue.wait(10))
+        self.assertLess(time.time() - started, 5)
+
+    def test_wait_times_out_when_idle(self):
+        started = time.time()
+        self.assertFalse(self.queue.wait(0.1))
+        self.assertGreaterEqual(time.time() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,132 +26,202 @@ import time
 import json
 import os
 import datetime
-import picamera
-from collections import deque
+import threading
 from google.cloud import pubsub_v1
 from google.cloud import storage
-import six
 import jwt
 import ssl
 import paho.mqtt.client as mqtt
 from curtsies import Input
 from robotderbycar import RobotDerbyCar
-
-### for image processing
-from PIL import Image
-
-action_queue = deque([])
-previous_command_timestamp = 0
-# assigned mode from the most recent processed driving command - see drive-message.js for details
-mode = "undefined"
-sensor_rate = "undefined"
-# If this is true, the car will be streaming sensor messages non stop, otherwise it will only send messages when asked to do so
-stream_messages = False
+from actions import ActionRegistry
+from actions import InvalidAction
+from actions import parse_choice
+from actions import parse_int
+from actions import parse_text
+from actions import parse_true
+from camera import ContinuousCamera
+from command_queue import CommandQueue
+from histogram import LatencyHistogram
+from motion_plan import Drive
+from motion_plan import Gripper
+from motion_plan import MotionPlanExecutor
+from motion_plan import Speed
+from motion_plan import Turn
+from camera import PiCameraSource
+from camera import StaticImageSource
+from hardware import ScaledClock
+from hardware import SimulatedGoPiGo
+from streaming import StreamRateController
+from telemetry import TelemetryPublisher
+from tracing import Tracer
+from uploader import ImageUploader
+from wire_format import decode_command
+
+# Action types the car understands - the handlers are registered below
+action_registry = ActionRegistry()
 print("*****************************************************")
 print("*** Starting the car in NO message streaming mode ***")
 print("*****************************************************")
-# If this is true, then the car needs to send one sensor message to the server
-# only used when stream_messages = False
-send_next_message = False
-obstacle_found = False
 
-# How many balls have been collected so far
-balls_collected = 0
+# Frames captured sooner than this after the car stops moving may be blurred
+CAMERA_SETTLE_SECONDS = 0.1
+
+# While idle the main loop sleeps until a command arrives, but wakes up at least this often
+IDLE_WAKEUP_SECONDS = 2
+
+# Time from the cloud sending a command (cloudTimestampMs) to the car starting to execute it
+command_latency = LatencyHistogram("command-to-motion latency")
+
+# How many command messages the Pub/Sub subscriber may deliver at once - a newer batch replaces older queued actions
+COMMAND_MAX_MESSAGES_IN_FLIGHT = 10
+
+# How often the continuous stream statistics are printed
+STREAM_STATS_INTERVAL_SECONDS = 10
+
+# How often the stage latency histograms are written to TRACE_METRICS_FILE
+METRICS_EXPORT_INTERVAL_SECONDS = 10
+
+# On exit, how long to wait for queued sensor messages to be uploaded and published
+TELEMETRY_FLUSH_SECONDS = 5
+
+# Time to execute the motion plans - consecutive motion actions of a command - from start to standstill
+motion_plan_time = LatencyHistogram("motion plan time")
+
+# Motion plan step for each motion action, created from the action's value. Plans start with a drive or turn,
+# gripper and speed actions right after one are part of its plan
+MOTION_STEPS = {"driveForwardMm": Drive, "driveBackwardMm": Drive, "turnRight": Turn, "turnLeft": Turn,
+                "gripperPosition": Gripper, "setSpeed": Speed}
+
+# RobotDerbyCar LED color attributes of the ball colors the car can hunt for
+BALL_COLOR_LEDS = {"Red": "RED", "Yellow": "YELLOW", "Green": "GREEN", "Blue": "BLUE"}
+
+
+class DriverState(object):
+    """The car and the state of the main loop that action handlers read and change."""
+
+    def __init__(self, car, motion, stop_event, ball_color):
+        self.car = car
+        # MotionPlanExecutor moving the car
+        self.motion = motion
+        self.stop_event = stop_event
+        self.ball_color = ball_color
+        # If this is true, then the car needs to send one sensor message to the server
+        # only used when stream_messages = False
+        self.send_next_message = False
+        self.obstacle_found = False
+
+
+def run_motion_plan(driver, action):
+    """
+    Executes a drive or turn action together with the motion actions queued right after it, as one motion
+    plan the car drives through without stopping in between.
+    """
+    actions = [action] + action_queue.popleft_while(
+        lambda queued: queued.name in MOTION_STEPS and queued.timestamp_ms == action.timestamp_ms)
+    print("main(): motion plan: " + ", ".join("{} {}".format(a.name, a.value) for a in actions))
+    result = driver.motion.execute([MOTION_STEPS[a.name](a.value) for a in actions],
+                                   superseded=lambda: driver.stop_event.is_set() or action_queue.last_command_timestamp > action.timestamp_ms)
+    motion_plan_time.record(result.seconds * 1000)
+    print("main(): motion plan of {} actions took {:.0f} ms, steps: {}".format(
+        len(actions), result.seconds * 1000, ", ".join("{:.0f}".format(s * 1000) for s in result.step_seconds)))
+    if result.cancelled:
+        print("main(): motion plan superseded by a newer command after {} of {} actions".format(len(result.step_seconds), len(actions)))
+    # Only a forward drive reports the obstacle to the cloud, as when actions ran one at a time
+    if result.obstacle_found and actions[len(result.step_seconds) - 1].name == "driveForwardMm":
+        driver.send_next_message = True
+        driver.obstacle_found = True
+
+
+def change_setting(driver, action):
+    """Moves the gripper or changes the speed when that is not part of a motion plan."""
+    print("main(): {} {}".format(action.name, action.value))
+    driver.motion.apply_setting(MOTION_STEPS[action.name](action.value))
+
+
+action_registry.register("driveForwardMm", parse_int, additive=True)(run_motion_plan)
+action_registry.register("driveBackwardMm", parse_int, additive=True)(run_motion_plan)
+action_registry.register("turnRight", parse_int, additive=True)(run_motion_plan)
+action_registry.register("turnLeft", parse_int, additive=True)(run_motion_plan)
+action_registry.register("setSpeed", parse_int)(change_setting)
+action_registry.register("gripperPosition", parse_choice("open", "close"))(change_setting)
+
+
+@action_registry.register("setColor", parse_text)
+def set_color(driver, action):
+    print("main(): set color to " + action.value)
+    driver.ball_color = action.value
+    if driver.ball_color in BALL_COLOR_LEDS:
+        driver.car.SetBallModeLED(getattr(driver.car, BALL_COLOR_LEDS[driver.ball_color]))
+    else:
+        print("main(): Invalid ball color received")
 
-def callback(message):
-        global previous_command_timestamp
-        global action_queue
-        global mode
-        global sensor_rate
-        global stream_messages
-        global balls_collected
-        envelope = json.loads(message.data.decode('utf-8'))
-        output = json.dumps(envelope)
+    print("main(): After changing the color of the ball, # of collected balls reset to 0")
+    action_queue.reset_balls_collected()
 
-        print("callback()<---------------- received msg: {}".format(output))
 
-        #### process the data
-        dict_data = json.loads(envelope)  # convert json to type dict
+@action_registry.register("sendSensorMessage", parse_true)
+def send_sensor_message(driver, action):
+    driver.send_next_message = True
 
-        if 'cloudTimestampMs' in dict_data and 'actions' in dict_data and 'mode' in dict_data and 'sensorRate' in dict_data:
-            mode = dict_data['mode']
-            sensor_rate = dict_data['sensorRate']
-            print("callback(): command sensorRate: {}".format(sensor_rate))
-            print("callback(): command mode: {}".format(mode))
 
-            if sensor_rate == 'onDemand':
-                stream_messages = False
+# Driving actions plus the mode, sensor rate and ball count set by driving commands - shared with the Pub/Sub callback thread
+action_queue = CommandQueue(additive_actions=action_registry.additive_names())
 
-            if sensor_rate == 'continuous':
-                stream_messages = True
 
-            if 'ballCaptured' in dict_data:
-                balls_collected += 1
+def callback(message):
+        try:
+            wire_version, dict_data = decode_command(message.data)
+        except ValueError as e:
+            print("callback(): message ignored, it is in no known wire format: {}".format(e))
+            message.ack()
+            return
 
-            ### process only new commads and disgregard old messages
-            if dict_data['cloudTimestampMs'] > previous_command_timestamp:
-                previous_command_timestamp = dict_data['cloudTimestampMs']
+        print("callback()<---------------- received msg (wire format {}): {}".format(wire_version, dict_data))
 
-                for i in range(len(dict_data['actions'])):
-                    for key in dict_data['actions'][i].keys():
-                        new_action = previous_command_timestamp, key, dict_data['actions'][i][key]
-                        print("callback(): new_action: {}".format(new_action))
-                        action_queue.append(new_action)
+        if 'cloudTimestampMs' in dict_data and 'actions' in dict_data and 'mode' in dict_data and 'sensorRate' in dict_data:
+            print("callback(): command sensorRate: {}".format(dict_data['sensorRate']))
+            print("callback(): command mode: {}".format(dict_data['mode']))
+
+            try:
+                cloud_timestamp_ms = int(dict_data['cloudTimestampMs'])
+            except (TypeError, ValueError):
+                print("callback(): message ignored, invalid cloudTimestampMs: {}".format(dict_data['cloudTimestampMs']))
+                message.ack()
+                return
+
+            # Actions are validated and their values converted here, once, so the main loop only dispatches them
+            new_actions = []
+            for i in range(len(dict_data['actions'])):
+                for key in dict_data['actions'][i].keys():
+                    try:
+                        new_actions.append(action_registry.compile(cloud_timestamp_ms, key, dict_data['actions'][i][key]))
+                    except InvalidAction as e:
+                        print("callback(): action skipped: {}".format(e))
 
+            ### process only new commads and disgregard old messages
+            if action_queue.submit(cloud_timestamp_ms, new_actions, dict_data['mode'], dict_data['sensorRate'],
+                                   ball_captured=('ballCaptured' in dict_data)):
+                print("callback(): new actions: {}".format(new_actions))
             else:
-                print('callback(): message received out of order. previous_command_timestamp: {}'.format(previous_command_timestamp) + '. Message ignored')
+                print('callback(): message received out of order. previous_command_timestamp: {}'.format(action_queue.last_command_timestamp) + '. Message ignored')
 
         else:
             print('callback(): message ignored. Missing necessary tokens: "cloudTimestampMs" or "actions" or "mode" or "sensorRate')
 
         message.ack()
+        # Mode or sensor rate may have changed even if no actions were queued
+        action_queue.wake()
 
 
-def takephoto(project_id,bucket_id,cam_pos):
-    image_file_name = str(datetime.datetime.now())
-    camera = picamera.PiCamera()
-
-    camera.resolution = (int(camera_horizontal_pixels), int(camera_vertical_pixels))
-
-    # box = (0.0, 0.0, 1.0, 1.9)
-    # camera.zoom = box
-    # camera.iso = 100
-    # camera.sharpness = 100
-
-    if cam_pos != "1":
-      camera.vflip = True
-      camera.hflip = True
-
-    image_file_name = 'image' + image_file_name + '.jpg'
-    image_file_name = image_file_name.replace(":", "")  # Strip out the colon from date time.
-    image_file_name = image_file_name.replace(" ", "")  # Strip out the space from date time.
-    print("takephoto(): image " + image_file_name)
-    camera.capture(image_file_name)
-    camera.close()  # We need to close off the resources or we'll get an error.
-
-    client = storage.Client(project=project_id)
-    mybucket = client.bucket(bucket_id)
-    myblob = mybucket.blob(image_file_name)
-    print("takephoto(): uploading...")
-    start_time = time.time()
-    # See docs: http://google-cloud-python.readthedocs.io/en/latest/storage/blobs.html
-    myblob.upload_from_filename(image_file_name, content_type='image/jpeg')
-    print("takephoto(): completed upload in %s seconds" % (time.time() - start_time))
-
-    # Remove file from local directory to avoid overflow
-    os.remove(image_file_name)
-
-    # Process GCS URL
-    url = myblob.public_url
-    gcs_url = str(myblob.path).replace("/b/","gs://")
-    gcs_url = gcs_url.replace("/o/","/")
-    if isinstance(url, six.binary_type):
-        url = url.decode('utf-8')
-
-    if isinstance(gcs_url, six.binary_type):
-        gcs_url = gcs_url.decode('utf-8')
-
-    return gcs_url, url
+def watch_keyboard(input_generator, stop_event):
+    """Runs on its own thread in interactive mode and stops the main loop when <ESC> is pressed."""
+    while not stop_event.is_set():
+        key = input_generator.send(0.5)
+        if ((key is not None) and (key == '<ESC>')):
+            print("watch_keyboard(): <ESC> pressed, stopping the car")
+            stop_event.set()
+            action_queue.wake()
 
 
 def verifyEnv(var):
@@ -185,8 +255,10 @@ def error_str(rc):
 class Device(object):
     """Represents the state of a single device."""
 
-    def __init__(self):
+    def __init__(self, stream=None):
         self.connected = False
+        # StreamRateController to pass PUBACKs to, if sensor messages are streamed
+        self.stream = stream
 
     def wait_for_connection(self, timeout):
         """Wait for the device to become connected."""
@@ -208,8 +280,10 @@ class Device(object):
         print('on_disconnect(): disconnected:', error_str(rc))
         self.connected = False
 
-    def on_publish(self, unused_client, unused_userdata, unused_mid):
+    def on_publish(self, unused_client, unused_userdata, mid):
         """Callback when the device receives a PUBACK from the MQTT bridge."""
+        if self.stream is not None and self.stream.message_acked(mid):
+            return
         print('on_publish(): msg sent.')
 
     def on_subscribe(self, unused_client, unused_userdata, unused_mid,
@@ -258,6 +332,23 @@ if __name__ == '__main__':
     camera_horizontal_pixels = verifyEnv("HORIZONTAL_RESOLUTION_PIXELS")
     camera_vertical_pixels = verifyEnv("VERTICAL_RESOLUTION_PIXELS")
     dist_limit = verifyEnv("BARRIER_DAMPENING")
+    # Optional on-device shrinking of frames before upload, to keep payloads small over venue Wi-Fi
+    upload_quality = int(os.environ.get("IMAGE_UPLOAD_QUALITY", "0"))
+    upload_scale = float(os.environ.get("IMAGE_UPLOAD_SCALE", "1.0"))
+    # Continuous streaming (sensorRate == 'continuous') adapts its frame rate between these limits
+    stream_target_fps = float(os.environ.get("STREAM_TARGET_FPS", "2"))
+    stream_min_fps = float(os.environ.get("STREAM_MIN_FPS", "0.2"))
+    stream_max_in_flight = int(os.environ.get("STREAM_MAX_IN_FLIGHT", "2"))
+    # "gopigo3" drives the real car; "simulated" runs the driver headless against a simulated car and a fixed camera image
+    car_hardware = os.environ.get("CAR_HARDWARE", "gopigo3")
+    simulation_speedup = float(os.environ.get("CAR_SIMULATION_SPEEDUP", "1.0"))
+    simulated_camera_image = os.environ.get("CAR_SIMULATION_IMAGE", "../../simulator/js/simulation-images/image1.jpg")
+    # Encoder degrees before the end of a move at which the next move of a motion plan takes over, 0 to stop after every move
+    motion_blend_degrees = int(os.environ.get("MOTION_BLEND_DEGREES", str(MotionPlanExecutor.BLEND_DEGREES)))
+    # Wire format of sensor messages, see wire_format.py; commands are understood in any format
+    wire_version = int(os.environ.get("WIRE_FORMAT_VERSION", "1"))
+    # File the per-stage latency histograms are written to in the Prometheus text format, empty to not write them
+    trace_metrics_file = os.environ.get("TRACE_METRICS_FILE", "")
     counter = 1
 
     print("Project ID: " + project_var)
@@ -269,9 +360,30 @@ if __name__ == '__main__':
 
     # Initialize Cloud Derby Car System and Sensors
     print("Initializing Cloud Derby Car...")
-    myCar = RobotDerbyCar()
+    if car_hardware == "simulated":
+        print("Simulating the car {}x faster than real time, camera image: {}".format(simulation_speedup, simulated_camera_image))
+        myCar = RobotDerbyCar(SimulatedGoPiGo(clock=ScaledClock(simulation_speedup)))
+        with open(simulated_camera_image, 'rb') as image_file:
+            camera_source = StaticImageSource(image_file.read())
+    else:
+        myCar = RobotDerbyCar()
+        camera_source = PiCameraSource(camera_horizontal_pixels, camera_vertical_pixels,
+                                       flip=(camera_position != "1"), use_video_port=True)
     print("Car Initialized.")
 
+    # Every sensor message gets a trace id, passed on by the controller to the inference VM
+    tracer = Tracer(logical_car_id)
+    tracer.add_histogram("command_to_motion", command_latency)
+    tracer.add_histogram("motion_plan", motion_plan_time)
+    if trace_metrics_file:
+        print("Writing stage latency histograms to " + trace_metrics_file)
+        tracer.export_periodically(trace_metrics_file, METRICS_EXPORT_INTERVAL_SECONDS)
+
+    # The camera stays open for the whole run and keeps the most recent frames in memory -
+    # powering it up for every photo costs about a second
+    camera = ContinuousCamera(camera_source)
+    camera.start()
+
     # Create the MQTT client and connect to Cloud IoT.
     client = mqtt.Client(client_id=(
         'projects/{}/locations/{}/registries/{}/devices/{}'.format(project_var, region_var, registry_id, device_id)))
@@ -283,7 +395,8 @@ if __name__ == '__main__':
     # Enable SSL/TLS support.
     client.tls_set(ca_certs="../roots.pem", tls_version=ssl.PROTOCOL_TLSv1_2)
 
-    device = Device()
+    stream_rate = StreamRateController(target_fps=stream_target_fps, min_fps=stream_min_fps, max_in_flight=stream_max_in_flight)
+    device = Device(stream=stream_rate)
 
     client.on_connect = device.on_connect
     client.on_publish = device.on_publish
@@ -298,13 +411,21 @@ if __name__ == '__main__':
 
     mqtt_telemetry_topic = '/devices/{}/events/{}'.format(device_id,sensor_topic)
 
+    # Images are uploaded and sensor messages published in the background, reusing one storage client
+    upload_max_size = None
+    if upload_scale < 1.0:
+        upload_max_size = (int(int(camera_horizontal_pixels) * upload_scale), int(int(camera_vertical_pixels) * upload_scale))
+    uploader = ImageUploader(storage.Client(project=project_var).bucket(bucket_var), max_size=upload_max_size, quality=upload_quality)
+    telemetry = TelemetryPublisher(uploader, lambda payload: client.publish(mqtt_telemetry_topic, payload, qos=1), stream=stream_rate,
+                                   wire_version=wire_version)
+
     # Wait up to 5 seconds for the device to connect.
     device.wait_for_connection(5)
 
     # Subscribe to the command topic.
     subscriber = pubsub_v1.SubscriberClient()
     subscription_path = subscriber.subscription_path(args.project, args.topic)
-    flow_control = pubsub_v1.types.FlowControl(max_messages=1)
+    flow_control = pubsub_v1.types.FlowControl(max_messages=COMMAND_MAX_MESSAGES_IN_FLIGHT)
     subscription = subscriber.subscribe(subscription_path, callback=callback, flow_control=flow_control)
 
     startup_time = int(time.time() * 1000)
@@ -312,149 +433,145 @@ if __name__ == '__main__':
     # Flag that indicates we are processing a series of actions recieved from the cloud - will not be sending any messages until all actions are executed
     action_sequence_complete = True
 
+    # When the car last finished a movement - frames taken before that are blurred
+    last_motion_time = 0
+
+    # Capture time of the last streamed frame, so the stream never sends the same frame twice
+    last_streamed_frame_time = 0
+    last_stream_stats_time = time.time()
+
+    # Set by the keyboard thread when <ESC> is pressed
+    stop_event = threading.Event()
+
+    driver = DriverState(myCar, MotionPlanExecutor(myCar, dist_limit, blend_degrees=motion_blend_degrees), stop_event, ball_color)
+
     # Main Loop
     try:
         
         if (args.nonInteractive is False):
           print("Initiating the GoPiGo processing logic in interactive mode. Press <ESC> at anytime to exit.\n")
           input_generator = Input(keynames="curtsies", sigint_event=True)
+          keyboard_thread = threading.Thread(target=watch_keyboard, args=(input_generator, stop_event), name='keyboard')
+          keyboard_thread.daemon = True
+          keyboard_thread.start()
         else:
           print("Initiating the GoPiGo processing logic in non-interactive mode.\n")
 
-        while True:
-                # End loop on <ESC> key
-                print("main(" + str(counter) + ")---> carId='" + carId + "' balls_collected='"+ str(balls_collected) +"' ball_color='" + ball_color + "' mode='" + mode + "' sensorRate='" + sensor_rate + "'")
+        # End loop on <ESC> key
+        while not stop_event.is_set():
+                state = action_queue.snapshot()
+                print("main(" + str(counter) + ")---> carId='" + carId + "' balls_collected='"+ str(state.balls_collected) +"' ball_color='" + driver.ball_color + "' mode='" + state.mode + "' sensorRate='" + state.sensor_rate + "'")
                 counter += 1
 
-                if (args.nonInteractive is False):
-                    key = input_generator.send(1 / 20)
-                    if ((key is not None) and (key == '<ESC>')):
-                        break
-
-                if (mode=="automatic"):
+                if (state.mode=="automatic"):
                     myCar.SetCarModeLED(myCar.GREEN)
-                elif (mode=="manual"):
+                elif (state.mode=="manual"):
                     myCar.SetCarModeLED(myCar.BLUE)
-                elif (mode=="debug"):
+                elif (state.mode=="debug"):
                     myCar.SetCarModeLED(myCar.RED)
 
 
                 # process any new commands in the queue
-                if (len(action_queue) > 0):
+                action = action_queue.popleft()
+                if (action is not None):
                     action_sequence_complete = False
                     # Processing older action first
-                    action = action_queue.popleft()
-                    # action_queue.clear()
-
-                    command_timestamp = str(action[0])
 
                     # Only process commands that were received after time of startup.
                     # We should only be processing commands when we haven't sent any data
-                    if(command_timestamp>=startup_time):
-                        action_type = str(action[1])
-                        action_value = action[2]
-                        if (action_type == "driveForwardMm"):
-                            print("main(): drive forward " + str(action_value) + " mm")
-                            if (myCar.drive(int(action_value),dist_limit)):
-                                send_next_message = True
-                                obstacle_found = True
-                        elif (action_type == "driveBackwardMm"):
-                            print("main(): drive backward " + str(action_value) + " mm")
-                            myCar.drive(int(action_value),dist_limit)
-                        elif (action_type == "turnRight"):
-                            print("main(): turn right by " + str(action_value) + " degrees")
-                            myCar.turn_degrees(int(action_value))
-                            time.sleep(0.5)     # Short delay to prevent overlapping commands and car confusion
-                        elif (action_type == "turnLeft"):
-                            print("main(): turn left by " + str(action_value) + " degrees")
-                            myCar.turn_degrees(int(action_value))
-                            time.sleep(0.5)     # Short delay to prevent overlapping commands and car confusion
-                        elif (action_type == "setColor"):
-                            print("main(): set color to " + str(action_value))
-                            ball_color = str(action_value)
-
-                            if (ball_color=="Red"):
-                                myCar.SetBallModeLED(myCar.RED)
-                            elif (ball_color=="Yellow"):
-                                myCar.SetBallModeLED(myCar.YELLOW)
-                            elif (ball_color=="Green"):
-                                myCar.SetBallModeLED(myCar.GREEN)
-                            elif (ball_color=="Blue"):
-                                myCar.SetBallModeLED(myCar.BLUE)
-                            else:
-                                print("main(): Invalid ball color received")
-
-
-                            print("main(): After changing the color of the ball, # of collected balls reset to 0")
-                            balls_collected = 0
-                        elif (action_type == "setSpeed"):
-                            print("main(): set speed to " + str(action_value))
-                            myCar.set_speed(int(action_value))
-                        elif (action_type == "gripperPosition" and action_value == "open"):
-                            print("main(): open gripper")
-                            myCar.GripperOpen()
-                        elif (action_type == "gripperPosition" and action_value == "close"):
-                            print("main(): close gripper")
-                            myCar.GripperClose()
-                            time.sleep(0.3)     # Short delay to prevent overlapping commands and car confusion
-                        elif (action_type == "sendSensorMessage" and action_value == "true"):
-                            send_next_message = True
-                        else:
-                            print("main(): received invalid action: " + str(action_type))
+                    if (action.timestamp_ms >= startup_time):
+                        command_latency.record(time.time() * 1000 - action.timestamp_ms)
+                        action_registry.run(action, driver)
                     else:
                         print("main(): stale messages received from before startup. Ignoring and only processing new commands")
 
-                    print("main()<--- completed action: '" + action[1] + " " + str(action[2]))
+                    print("main()<--- completed action: '" + action.name + " " + str(action.value))
+                    last_motion_time = time.time()
 
                     if len(action_queue) == 0:
                         action_sequence_complete = True
-                        print("main(): no more actions in the queue")
+                        print("main(): no more actions in the queue. " + command_latency.summary())
+                        print("main(): " + motion_plan_time.summary())
+                        print("main(): time spent per action type (motion plans count for their first action): " + action_registry.timing_summary())
+                        print("main(): GoPiGo bus usage: {}".format(myCar.backend.stats()))
 
                 ######### Once commands are processed collect picture, distance, voltage
-                elif ((stream_messages or send_next_message) and action_sequence_complete):
-                    print("main(): stream_messages='" + str(stream_messages) + "' send_next_message='" + str(send_next_message) + "'")
+                elif ((state.stream_messages or driver.send_next_message) and action_sequence_complete):
+                    streaming = state.stream_messages and not driver.send_next_message
+                    if streaming:
+                        delay = stream_rate.seconds_until_next_frame()
+                        if delay > 0:
+                            # Not time for the next frame yet - wait for it, but wake up right away for new driving commands
+                            action_queue.wait(delay)
+                            continue
+                    else:
+                        print("main(): stream_messages='" + str(state.stream_messages) + "' send_next_message='" + str(driver.send_next_message) + "'")
                     # Start the network loop.
                     voltage = myCar.ReadBatteryVoltage()
                     distance = myCar.ReadDistanceMM()
-                    print("main(): distance Sensor (mm): " + str(distance))
-                    # Sleep briefly before taking a photo to prevent blurry images
+                    # Use the newest frame taken after the car settled, to prevent blurry images
                     myCar.SetCarStatusLED(myCar.YELLOW)
-                    time.sleep(0.1)
-                    gcs_image_url, public_image_url = takephoto(project_var,bucket_var, camera_position)
-                    print("main(): image URL: " + str(public_image_url))
-                    print("main(): publishing message")
+                    not_before = last_motion_time + CAMERA_SETTLE_SECONDS
+                    if streaming:
+                        not_before = max(not_before, last_streamed_frame_time + 0.001)
+                    trace = tracer.new_trace()
+                    with trace.span("capture"):
+                        frame = camera.latest_frame(not_before=not_before)
+                    if frame is None:
+                        print("main(): no camera frame available, will try again. Camera stats: {}".format(camera.stats()))
+                        continue
+                    if not streaming:
+                        print("main(): distance Sensor (mm): " + str(distance))
+                        print("main(): using frame #{} captured {:.3f} seconds ago".format(frame.sequence, time.time() - frame.timestamp))
                     timestampMs = int(time.time() * 1000)
                     carId = logical_car_id
                     carState = {}
-                    carState["color"] = ball_color
+                    carState["color"] = driver.ball_color
                     carState["batteryLeft"] = voltage
                     # Need to keep count of balls collected
-                    carState["ballsCollected"] = balls_collected
+                    carState["ballsCollected"] = action_queue.snapshot().balls_collected
 
-                    if (obstacle_found):
+                    if (driver.obstacle_found):
                         carState["obstacleFound"] = True
-                        obstacle_found = False
+                        driver.obstacle_found = False
 
                     sensors = {}
                     sensors["frontLaserDistanceMm"] = distance
-                    sensors["frontCameraImagePath"] = public_image_url
-                    sensors["frontCameraImagePathGCS"] = gcs_image_url
+                    sensors["traceId"] = trace.trace_id
                     data = {}
                     data["timestampMs"] = timestampMs
                     data["carId"] = carId
                     data["carState"] = carState
                     data["sensors"] = sensors
-                    envelope = json.dumps(data)
-                    payload = json.dumps(envelope).encode('utf8')
-                    client.publish(mqtt_telemetry_topic, payload, qos=1)
+                    if streaming:
+                        data["streamStats"] = stream_rate.stats()
+                    # Upload and publish happen on the telemetry thread, image paths are filled in there.
+                    # A streamed frame still waiting there is replaced by this fresher one.
+                    telemetry.submit(frame.jpeg_bytes, data, droppable=streaming, frame_timestamp=frame.timestamp, trace=trace)
+                    if streaming:
+                        stream_rate.frame_started()
+                        last_streamed_frame_time = frame.timestamp
+                        if time.time() - last_stream_stats_time > STREAM_STATS_INTERVAL_SECONDS:
+                            last_stream_stats_time = time.time()
+                            print("main(): streaming stats: {}".format(stream_rate.stats()))
+                    else:
+                        print("main()----------------------> msg handed over for upload and publishing")
                     # In case we are in a single message sensorRate - mark this message as being sent to prevent more messages
-                    send_next_message = False
-                    print("main()----------------------> msg published to the cloud")
+                    driver.send_next_message = False
                     myCar.SetCarStatusLED(myCar.GREEN)
                 else:
-                    time.sleep(2)
+                    # Nothing to do - sleep until the Pub/Sub callback queues a command or <ESC> is pressed
+                    action_queue.wait(IDLE_WAKEUP_SECONDS)
 
     except Exception as e:
         print(
             'Exception(): listening for messages on {} threw an Exception: {}.'.format(subscription, e))
         raise
+    finally:
+        camera.close()
+        myCar.close()
+        # The last sensor message may still be on the telemetry thread, which would die with the process
+        if not telemetry.wait_until_idle(TELEMETRY_FLUSH_SECONDS):
+            print("main(): sensor messages still unsent after {} seconds, exiting anyway".format(TELEMETRY_FLUSH_SECONDS))
+        if trace_metrics_file:
+            tracer.write_metrics(trace_metrics_file)
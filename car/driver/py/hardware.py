@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Hardware backends for RobotDerbyCar. GoPiGoBackend lists everything the car
+needs from the robot: motors and encoders, gripper servos, LEDs, the distance
+sensor, the battery and a clock. EasyGoPiGo3Backend drives a real GoPiGo3;
+SimulatedGoPiGo models the car driving around an arena, so the driver can run
+headless, and faster than real time with a ScaledClock.
+
+CachingBackend wraps a backend, skips LED and servo writes that would not
+change anything, and counts the bus transactions of the writes the car makes.
+"""
+
+import collections
+import contextlib
+import math
+import threading
+import time
+
+# LED names used by GoPiGoBackend.set_leds()
+LEDS = ("left_eye", "right_eye", "wifi")
+
+
+class ScaledClock(object):
+    """Clock running speedup times faster than real time, for simulations."""
+
+    def __init__(self, speedup=1.0):
+        self.speedup = float(speedup)
+        self._start_real = time.time()
+        self._start = self._start_real
+
+    def time(self):
+        return self._start + (time.time() - self._start_real) * self.speedup
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds) / self.speedup)
+
+
+class ManualClock(object):
+    """Clock that only moves when told to - sleep() advances it instantly. For single threaded, repeatable runs."""
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self._now += max(0, seconds)
+
+    advance = sleep
+
+
+class GoPiGoBackend(object):
+    """
+    Interface of the robot hardware used by RobotDerbyCar. Encoder positions and motor targets are in
+    degrees of wheel rotation, speeds in degrees per second, distances in mm, colors are (r, g, b).
+    Backends also provide WHEEL_CIRCUMFERENCE and WHEEL_BASE_CIRCUMFERENCE in mm.
+    Every other call is one bus transaction; set_leds() and set_servos() return how many they used.
+    """
+
+    MOTOR_LEFT = 0x01
+    MOTOR_RIGHT = 0x02
+    # The time module already has the time() and sleep() a clock needs
+    clock = time
+
+    def set_speed(self, dps):
+        raise NotImplementedError()
+
+    def set_motor_position(self, motor, position):
+        raise NotImplementedError()
+
+    def get_motor_encoder(self, motor):
+        raise NotImplementedError()
+
+    def drive_cm(self, distance, blocking=True):
+        raise NotImplementedError()
+
+    def turn_degrees(self, degrees, blocking=True):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def set_servos(self, positions):
+        """
+        : positions: dict of "SERVO1" / "SERVO2" -> position in degrees
+        Returns the number of bus transactions used.
+        """
+        raise NotImplementedError()
+
+    def set_leds(self, colors):
+        """
+        : colors: dict of LED name (see LEDS) -> color
+        Returns the number of bus transactions used.
+        """
+        raise NotImplementedError()
+
+    def read_distance_mm(self):
+        raise NotImplementedError()
+
+    def get_voltage_battery(self):
+        raise NotImplementedError()
+
+
+class EasyGoPiGo3Backend(GoPiGoBackend):
+    """A real GoPiGo3 with a distance sensor on I2C and the gripper servos on SERVO1 and SERVO2."""
+
+    def __init__(self):
+        # Imported here so the driver can be loaded on machines without the GoPiGo3 libraries
+        import easygopigo3
+        # The sensor sampler thread reads the encoders and the distance sensor while the main loop drives,
+        # so every bus access has to go through the library's mutex
+        self.gpg = easygopigo3.EasyGoPiGo3(use_mutex=True)
+        self.WHEEL_CIRCUMFERENCE = self.gpg.WHEEL_CIRCUMFERENCE
+        self.WHEEL_BASE_CIRCUMFERENCE = self.gpg.WHEEL_BASE_CIRCUMFERENCE
+        self.MOTOR_LEFT = self.gpg.MOTOR_LEFT
+        self.MOTOR_RIGHT = self.gpg.MOTOR_RIGHT
+        self.servos = {
+            "SERVO1": easygopigo3.Servo("SERVO1", self.gpg),
+            "SERVO2": easygopigo3.Servo("SERVO2", self.gpg),
+        }
+        # The firmware moves every servo in the port mask in one transaction; Servo only does the degrees to pulse math
+        self.both_servos = easygopigo3.Servo("SERVO1", self.gpg)
+        self.both_servos.portID = self.gpg.SERVO_1 + self.gpg.SERVO_2
+        self.led_masks = {"left_eye": self.gpg.LED_EYE_LEFT, "right_eye": self.gpg.LED_EYE_RIGHT, "wifi": self.gpg.LED_WIFI}
+        self.distance_sensor = self.gpg.init_distance_sensor()
+
+    def set_speed(self, dps):
+        self.gpg.set_speed(dps)
+
+    def set_motor_position(self, motor, position):
+        self.gpg.set_motor_position(motor, position)
+
+    def get_motor_encoder(self, motor):
+        return self.gpg.get_motor_encoder(motor)
+
+    def drive_cm(self, distance, blocking=True):
+        self.gpg.drive_cm(distance, blocking)
+
+    def turn_degrees(self, degrees, blocking=True):
+        self.gpg.turn_degrees(degrees, blocking)
+
+    def stop(self):
+        self.gpg.stop()
+
+    def set_servos(self, positions):
+        if len(positions) == 2 and len(set(positions.values())) == 1:
+            self.both_servos.rotate_servo(list(positions.values())[0])
+            return 1
+        for servo, position in positions.items():
+            self.servos[servo].rotate_servo(position)
+        return len(positions)
+
+    def set_leds(self, colors):
+        # LEDs that get the same color share one transaction
+        masks = collections.OrderedDict()
+        for led, color in colors.items():
+            color = tuple(color)
+            masks[color] = masks.get(color, 0) | self.led_masks[led]
+        for color, mask in masks.items():
+            self.gpg.set_led(mask, color[0], color[1], color[2])
+        return len(masks)
+
+    def read_distance_mm(self):
+        return self.distance_sensor.read_mm()
+
+    def get_voltage_battery(self):
+        return self.gpg.get_voltage_battery()
+
+
+# Round obstacle in the arena, e.g. a ball - center and radius in mm
+Obstacle = collections.namedtuple('Obstacle', ['x', 'y', 'radius'])
+
+
+class Arena(object):
+    """
+    Rectangular arena with walls on all sides and round obstacles, coordinates in mm.
+    : width, height: size of the arena; (0, 0) is the bottom left corner
+    : obstacles: list of Obstacle
+    """
+
+    def __init__(self, width=3000, height=3000, obstacles=()):
+        self.width = width
+        self.height = height
+        self.obstacles = list(obstacles)
+
+    @staticmethod
+    def default():
+        """3 x 3 meter arena with a few balls spread around."""
+        return Arena(3000, 3000, [Obstacle(1500, 2400, 35), Obstacle(600, 900, 35), Obstacle(2400, 1200, 35)])
+
+    def distance_to_hit(self, x, y, heading):
+        """Distance from (x, y) along heading (radians) to the nearest wall or obstacle."""
+        dx = math.cos(heading)
+        dy = math.sin(heading)
+        distances = []
+        if dx > 1e-9:
+            distances.append((self.width - x) / dx)
+        elif dx < -1e-9:
+            distances.append(-x / dx)
+        if dy > 1e-9:
+            distances.append((self.height - y) / dy)
+        elif dy < -1e-9:
+            distances.append(-y / dy)
+        for obstacle in self.obstacles:
+            # Ray-circle intersection
+            ox = obstacle.x - x
+            oy = obstacle.y - y
+            along = ox * dx + oy * dy
+            if along <= 0:
+                continue
+            off_axis_squared = ox * ox + oy * oy - along * along
+            if off_axis_squared <= obstacle.radius * obstacle.radius:
+                distances.append(along - math.sqrt(obstacle.radius * obstacle.radius - off_axis_squared))
+        return max(0.0, min(distances)) if distances else float('inf')
+
+    def is_free(self, x, y, radius):
+        """True if a circle of the given radius at (x, y) is inside the walls and clear of obstacles."""
+        if x < radius or y < radius or x > self.width - radius or y > self.height - radius:
+            return False
+        for obstacle in self.obstacles:
+            if math.hypot(obstacle.x - x, obstacle.y - y) < obstacle.radius + radius:
+                return False
+        return True
+
+
+class SimulatedGoPiGo(GoPiGoBackend):
+    """
+    Differential drive GoPiGo3 in an Arena. Both motors turn towards their target position at the set
+    speed, the pose follows from the wheel travel, and the distance sensor measures along the heading
+    from the front of the car. The car stops when its body would hit a wall or an obstacle.
+    : arena: Arena to drive in, Arena.default() if None
+    : x, y, heading: start position in mm and heading in degrees (0 faces +x, 90 faces +y)
+    : clock: object with time() and sleep(), e.g. ScaledClock to run faster than real time
+    """
+
+    WHEEL_DIAMETER = 66.5
+    WHEEL_CIRCUMFERENCE = WHEEL_DIAMETER * math.pi
+    WHEEL_BASE_WIDTH = 117.0
+    WHEEL_BASE_CIRCUMFERENCE = WHEEL_BASE_WIDTH * math.pi
+    # Encoder resolution - 6 magnets x 2 edges x 120:1 gearbox per wheel revolution
+    ENCODER_TICKS_PER_DEGREE = 6 * 2 * 120 / 360.0
+    DEFAULT_SPEED = 300
+    # Distance sensor position ahead of the axle, and the range reported when nothing is in sight
+    SENSOR_OFFSET_MM = 80.0
+    SENSOR_MAX_RANGE_MM = 2000
+    SENSOR_OUT_OF_RANGE_MM = 3000
+    BODY_RADIUS_MM = 100.0
+    # Pose is integrated in steps of at most this many seconds of simulated time
+    STEP_SECONDS = 0.005
+    BATTERY_FULL_VOLTS = 9.6
+    BATTERY_VOLTS_PER_METER = 0.01
+
+    def __init__(self, arena=None, x=1500.0, y=300.0, heading=90.0, clock=None):
+        self.arena = arena if arena is not None else Arena.default()
+        self.clock = clock if clock is not None else ScaledClock(1.0)
+        self.x = float(x)
+        self.y = float(y)
+        self.heading = math.radians(heading)
+        self.speed = self.DEFAULT_SPEED
+        # Wheel positions and targets in degrees
+        self.position = {self.MOTOR_LEFT: 0.0, self.MOTOR_RIGHT: 0.0}
+        self.target = {self.MOTOR_LEFT: 0.0, self.MOTOR_RIGHT: 0.0}
+        self.servos = {"SERVO1": None, "SERVO2": None}
+        self.leds = dict((led, None) for led in LEDS)
+        self.distance_travelled = 0.0
+        self.collisions = 0
+        self._lock = threading.Lock()
+        self._last_update = self.clock.time()
+
+    def _update(self):
+        """Advances the simulation to the current clock time. Must be called with the lock held."""
+        now = self.clock.time()
+        remaining = now - self._last_update
+        self._last_update = now
+        while remaining > 0:
+            step = min(remaining, self.STEP_SECONDS)
+            remaining -= step
+            travel = {}
+            for motor in (self.MOTOR_LEFT, self.MOTOR_RIGHT):
+                delta = self.target[motor] - self.position[motor]
+                limit = self.speed * step
+                travel[motor] = max(-limit, min(limit, delta))
+            if travel[self.MOTOR_LEFT] == 0 and travel[self.MOTOR_RIGHT] == 0:
+                break
+
+            left_mm = travel[self.MOTOR_LEFT] * self.WHEEL_CIRCUMFERENCE / 360.0
+            right_mm = travel[self.MOTOR_RIGHT] * self.WHEEL_CIRCUMFERENCE / 360.0
+            heading = self.heading + (right_mm - left_mm) / self.WHEEL_BASE_WIDTH
+            forward = (left_mm + right_mm) / 2.0
+            mid_heading = (self.heading + heading) / 2.0
+            x = self.x + forward * math.cos(mid_heading)
+            y = self.y + forward * math.sin(mid_heading)
+
+            if forward != 0 and not self.arena.is_free(x, y, self.BODY_RADIUS_MM):
+                # Bumped into something - the wheels stall where they are
+                self.collisions += 1
+                self.target[self.MOTOR_LEFT] = self.position[self.MOTOR_LEFT]
+                self.target[self.MOTOR_RIGHT] = self.position[self.MOTOR_RIGHT]
+                print("SimulatedGoPiGo: collision at ({:.0f}, {:.0f})".format(self.x, self.y))
+                break
+
+            self.position[self.MOTOR_LEFT] += travel[self.MOTOR_LEFT]
+            self.position[self.MOTOR_RIGHT] += travel[self.MOTOR_RIGHT]
+            self.x, self.y, self.heading = x, y, heading
+            self.distance_travelled += abs(forward)
+
+    def _motors(self, motor):
+        return [m for m in (self.MOTOR_LEFT, self.MOTOR_RIGHT) if motor & m]
+
+    def _wait_until_stopped(self):
+        while True:
+            with self._lock:
+                self._update()
+                if all(self.position[m] == self.target[m] for m in self.position):
+                    return
+            self.clock.sleep(self.STEP_SECONDS)
+
+    def set_speed(self, dps):
+        with self._lock:
+            self._update()
+            self.speed = abs(dps)
+
+    def set_motor_position(self, motor, position):
+        with self._lock:
+            self._update()
+            for m in self._motors(motor):
+                self.target[m] = float(position)
+
+    def get_motor_encoder(self, motor):
+        with self._lock:
+            self._update()
+            # Whole encoder ticks, reported in whole degrees like the GoPiGo3 firmware
+            ticks = int(self.position[motor] * self.ENCODER_TICKS_PER_DEGREE)
+            return int(ticks / self.ENCODER_TICKS_PER_DEGREE)
+
+    def drive_cm(self, distance, blocking=True):
+        wheel_degrees = distance * 10.0 / self.WHEEL_CIRCUMFERENCE * 360
+        with self._lock:
+            self._update()
+            for m in self.target:
+                self.target[m] = self.position[m] + wheel_degrees
+        if blocking:
+            self._wait_until_stopped()
+
+    def turn_degrees(self, degrees, blocking=True):
+        """Turns in place, clockwise for positive degrees."""
+        wheel_degrees = self.WHEEL_BASE_CIRCUMFERENCE * degrees / 360.0 / self.WHEEL_CIRCUMFERENCE * 360
+        with self._lock:
+            self._update()
+            self.target[self.MOTOR_LEFT] = self.position[self.MOTOR_LEFT] + wheel_degrees
+            self.target[self.MOTOR_RIGHT] = self.position[self.MOTOR_RIGHT] - wheel_degrees
+        if blocking:
+            self._wait_until_stopped()
+
+    def stop(self):
+        with self._lock:
+            self._update()
+            for m in self.target:
+                self.target[m] = self.position[m]
+
+    def set_servos(self, positions):
+        self.servos.update(positions)
+        return len(positions)
+
+    def set_leds(self, colors):
+        self.leds.update(colors)
+        return len(colors)
+
+    def read_distance_mm(self):
+        with self._lock:
+            self._update()
+            sensor_x = self.x + self.SENSOR_OFFSET_MM * math.cos(self.heading)
+            sensor_y = self.y + self.SENSOR_OFFSET_MM * math.sin(self.heading)
+            distance = self.arena.distance_to_hit(sensor_x, sensor_y, self.heading)
+        if distance > self.SENSOR_MAX_RANGE_MM:
+            return self.SENSOR_OUT_OF_RANGE_MM
+        return int(distance)
+
+    def get_voltage_battery(self):
+        with self._lock:
+            return round(self.BATTERY_FULL_VOLTS - self.distance_travelled / 1000.0 * self.BATTERY_VOLTS_PER_METER, 2)
+
+    def pose(self):
+        """Returns (x, y, heading in degrees) at the current clock time."""
+        with self._lock:
+            self._update()
+            return self.x, self.y, math.degrees(self.heading) % 360
+
+
+class CachingBackend(object):
+    """
+    Wraps a GoPiGoBackend. LED and servo writes that would not change the hardware state are skipped,
+    and the updates made inside a batch() block are sent together when it ends. All other calls are
+    passed through. The bus transactions of output writes are counted, per method, in bus_transactions;
+    sensor and encoder reads are not, their rate is set by the sensor sampler.
+    : backend: the GoPiGoBackend to wrap
+    """
+
+    # Passed through calls that write to the GoPiGo3, one transaction each
+    OUTPUT_METHODS = ("set_speed", "set_motor_position", "drive_cm", "turn_degrees", "stop")
+
+    def __init__(self, backend):
+        self.backend = backend
+        # What the hardware was last set to - empty until the first write, so that one always goes out
+        self.leds = {}
+        self.servos = {}
+        self.bus_transactions = collections.Counter()
+        self.skipped_writes = collections.Counter()
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if name not in self.OUTPUT_METHODS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._count(self.bus_transactions, name, 1)
+            return attribute(*args, **kwargs)
+        return counted
+
+    def _count(self, counter, name, count):
+        if count:
+            with self._lock:
+                counter[name] += count
+
+    def _changed(self, cache, updates, name):
+        changed = dict((key, value) for key, value in updates.items() if cache.get(key) != value)
+        self._count(self.skipped_writes, name, len(updates) - len(changed))
+        return changed
+
+    def set_leds(self, colors):
+        colors = dict((led, tuple(color)) for led, color in colors.items())
+        if self._batch is not None:
+            self._batch[0].update(colors)
+            return 0
+        changed = self._changed(self.leds, colors, "set_leds")
+        if not changed:
+            return 0
+        transactions = self.backend.set_leds(changed)
+        self.leds.update(changed)
+        self._count(self.bus_transactions, "set_leds", transactions)
+        return transactions
+
+    def set_servos(self, positions):
+        if self._batch is not None:
+            self._batch[1].update(positions)
+            return 0
+        changed = self._changed(self.servos, positions, "set_servos")
+        if not changed:
+            return 0
+        transactions = self.backend.set_servos(changed)
+        self.servos.update(changed)
+        self._count(self.bus_transactions, "set_servos", transactions)
+        return transactions
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collects LED and servo updates and writes the ones that change anything when the block ends."""
+        if self._batch is not None:
+            # Already batching - the outer block writes everything
+            yield
+            return
+        self._batch = ({}, {})
+        try:
+            yield
+        finally:
+            leds, servos = self._batch
+            self._batch = None
+            if leds:
+                self.set_leds(leds)
+            if servos:
+                self.set_servos(servos)
+
+    def invalidate(self):
+        """Forgets the cached LED and servo state, e.g. after the GoPiGo3 was reset, so the next writes go out."""
+        self.leds = {}
+        self.servos = {}
+
+    def stats(self):
+        """Returns bus transactions and skipped writes, in total and per method."""
+        with self._lock:
+            return {
+                "busTransactions": sum(self.bus_transactions.values()),
+                "skippedWrites": sum(self.skipped_writes.values()),
+                "transactionsByMethod": dict(self.bus_transactions),
+                "skippedByMethod": dict(self.skipped_writes),
+            }
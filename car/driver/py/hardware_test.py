@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tests for the LED and servo caching of CachingBackend, on the simulated GoPiGo.
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import unittest
+
+from hardware import CachingBackend
+from hardware import SimulatedGoPiGo
+from robotderbycar import RobotDerbyCar
+
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
+
+class CachingBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = CachingBackend(SimulatedGoPiGo())
+
+    def transactions(self):
+        return self.backend.stats()["busTransactions"]
+
+    def test_unchanged_writes_are_skipped(self):
+        self.assertEqual(self.backend.set_leds({"right_eye": RED}), 1)
+        self.assertEqual(self.backend.set_leds({"right_eye": RED}), 0)
+        self.assertEqual(self.backend.set_servos({"SERVO1": 40, "SERVO2": 40}), 2)
+        self.assertEqual(self.backend.set_servos({"SERVO1": 40, "SERVO2": 40}), 0)
+        self.assertEqual(self.transactions(), 3)
+        self.assertEqual(self.backend.stats()["skippedWrites"], 3)
+
+    def test_batch_writes_only_the_last_values(self):
+        self.backend.set_leds({"right_eye": GREEN})
+        with self.backend.batch():
+            self.backend.set_leds({"right_eye": RED})
+            self.backend.set_servos({"SERVO1": 90})
+            self.backend.set_leds({"right_eye": GREEN, "left_eye": RED})
+        self.assertEqual(self.backend.backend.leds["right_eye"], GREEN)
+        self.assertEqual(self.backend.backend.leds["left_eye"], RED)
+        self.assertEqual(self.backend.backend.servos["SERVO1"], 90)
+        # The first green, then the left eye and the servo
+        self.assertEqual(self.transactions(), 3)
+
+    def test_only_output_writes_are_counted(self):
+        self.backend.get_motor_encoder(self.backend.MOTOR_LEFT)
+        self.backend.read_distance_mm()
+        self.backend.get_voltage_battery()
+        self.assertEqual(self.transactions(), 0)
+        self.backend.set_speed(300)
+        self.backend.set_motor_position(self.backend.MOTOR_LEFT, 10)
+        self.assertEqual(self.backend.stats()["transactionsByMethod"], {"set_speed": 1, "set_motor_position": 1})
+
+    def test_invalidate_sends_the_next_write(self):
+        self.backend.set_leds({"wifi": RED})
+        self.backend.invalidate()
+        self.assertEqual(self.backend.set_leds({"wifi": RED}), 1)
+
+
+class RobotDerbyCarOutputsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.car = RobotDerbyCar(SimulatedGoPiGo())
+
+    def tearDown(self):
+        self.car.close()
+
+    def test_gripper_and_speed_changes_do_not_flash_the_status_led(self):
+        # The constructor sets the status LED to green
+        before = self.car.backend.stats()["transactionsByMethod"].get("set_leds", 0)
+        self.car.GripperClose()
+        self.car.GripperOpen()
+        self.car.set_speed(200)
+        by_method = self.car.backend.stats()["transactionsByMethod"]
+        self.assertEqual(by_method.get("set_leds", 0), before)
+        # Both servos move together in one transaction each time on a GoPiGo3, the simulator counts one per servo
+        self.assertEqual(by_method["set_servos"], 4)
+        self.assertEqual(by_method["set_speed"], 1)
+        self.assertEqual(self.car.backend.backend.servos["SERVO1"], self.car.CONST_GRIPPER_FULL_OPEN)
+        self.assertEqual(self.car.backend.backend.leds["right_eye"], self.car.GREEN)
+
+    def test_sensor_sampler_reads_are_not_counted(self):
+        self.car.sensors.wait_for_sample(self.car.clock.time(), 1)
+        self.assertNotIn("get_motor_encoder", self.car.backend.stats()["transactionsByMethod"])
+        self.assertNotIn("read_distance_mm", self.car.backend.stats()["transactionsByMethod"])
+
+
+if __name__ == '__main__':
+    unittest.main()
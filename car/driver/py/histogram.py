@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import bisect
+import threading
+
+
+class LatencyHistogram(object):
+    """
+    Counts latencies in milliseconds into fixed buckets.
+    : name: printed in front of the summary
+    : buckets_ms: ascending upper bounds of the buckets; larger values go into an overflow bucket
+    """
+
+    DEFAULT_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, name, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = None
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+            self.count += 1
+            self.total_ms += latency_ms
+            self.max_ms = latency_ms if self.max_ms is None else max(self.max_ms, latency_ms)
+
+    def snapshot(self):
+        """Returns (buckets_ms, counts per bucket with the overflow bucket last, count, total_ms), consistent with each other."""
+        with self._lock:
+            return self.buckets_ms, list(self.counts), self.count, self.total_ms
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p-th percentile (0-100), None if empty."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = p / 100.0 * self.count
+            seen = 0
+            for i, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count > 0:
+                    return self.buckets_ms[i] if i < len(self.buckets_ms) else self.max_ms
+            return self.max_ms
+
+    def summary(self):
+        with self._lock:
+            if self.count == 0:
+                return "{}: no samples".format(self.name)
+            buckets = []
+            for i, bucket_count in enumerate(self.counts):
+                if bucket_count:
+                    label = "<={}ms".format(self.buckets_ms[i]) if i < len(self.buckets_ms) else ">{}ms".format(self.buckets_ms[-1])
+                    buckets.append("{}:{}".format(label, bucket_count))
+            return "{}: n={} mean={:.1f}ms max={:.1f}ms {}".format(
+                self.name, self.count, self.total_ms / self.count, self.max_ms, " ".join(buckets))
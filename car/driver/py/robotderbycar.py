@@ -19,29 +19,116 @@
 # Based on https://github.com/DexterInd/GoPiGo3/blob/master/Software/Python/easygopigo3.py
 #
 
-import easygopigo3
-import time
+import threading
 
-class RobotDerbyCar(easygopigo3.EasyGoPiGo3):
+from hardware import CachingBackend
+from sensors import SensorSampler
+
+
+class DriveOperation(object):
+    """
+    A drive or turn started with RobotDerbyCar.start_drive() or start_move(). The sensor sampler
+    thread watches the encoders and the distance sensor and finishes the operation when the target
+    is reached, an obstacle is found or it is cancelled. Stop decisions read the encoders directly,
+    since the sampled positions can be a sample period old by the time they are looked at.
+    The sampler thread and a cancelling thread race to finish the operation; exactly one of them
+    stops the car, sets the outcome and finishes it.
+    """
+
+    # Encoder degrees within which a wheel counts as being on target
+    TARGET_TOLERANCE_DEGREES = 5
+
+    def __init__(self, car, end_left, end_right, stop_distance, tolerance=TARGET_TOLERANCE_DEGREES):
+        self.car = car
+        self.end_left = end_left
+        self.end_right = end_right
+        # Obstacle checks only apply when driving further than the distance limit, None otherwise
+        self.stop_distance = stop_distance
+        # A larger tolerance finishes the operation while the wheels are still moving, e.g. to blend into the next move
+        self.tolerance = tolerance
+        self.obstacle_found = False
+        self.cancelled = False
+        self.obstacle_distance = None
+        self._done = threading.Event()
+        # Set by the first of on_sample() and cancel() to decide to finish, under _lock
+        self._finishing = False
+        self._lock = threading.Lock()
+
+    def _claim(self):
+        """Returns True for the one caller that gets to finish the operation."""
+        with self._lock:
+            if self._finishing:
+                return False
+            self._finishing = True
+            return True
+
+    def on_sample(self, sample):
+        if self._finishing:
+            return
+        left, right = self.car.ReadEncoders()
+        if abs(left - self.end_left) <= self.tolerance and abs(right - self.end_right) <= self.tolerance:
+            if self._claim():
+                self._finish()
+            return
+
+        if self.stop_distance is not None and sample.distance_mm is not None:
+            # Stop early enough to come to rest before the limit at the current speed
+            stop_at = self.stop_distance + self.car.braking_distance_mm(sample.speed_mm_s, self.car.clock.time() - sample.timestamp)
+            if sample.distance_mm <= stop_at and self._claim():
+                self.obstacle_found = True
+                self.obstacle_distance = sample.distance_mm
+                self.car.stop_at(*self.car.ReadEncoders())
+                print("RobotDerbyCar.drive(): Obstacle Found. Stopping Car before requested distance. Object distance: {} speed: {:.0f} mm/s".format(
+                    sample.distance_mm, sample.speed_mm_s))
+                self._finish()
+
+    def _finish(self):
+        self.car.sensors.remove_listener(self.on_sample)
+        self._done.set()
+
+    def cancel(self):
+        """Stops the car where it is and finishes the operation."""
+        if not self._claim():
+            return
+        self.cancelled = True
+        self.car.stop_at(*self.car.ReadEncoders())
+        self._finish()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the drive to finish. Returns True if it stopped because of an obstacle.
+        : timeout: seconds to wait, None to wait until the drive is finished
+        """
+        self._done.wait(timeout)
+        return self.obstacle_found
+
+
+class RobotDerbyCar(object):
     """
     This class is used for controlling a `RobotDerbyCar`_ robot.
     With this class you can do the following things with your `RobotDerbyCar`_:
      * Drive your robot while avoiding obstacles
-     * Inheriting all EasyGoPiGo3 functionality: https://github.com/DexterInd/GoPiGo3/blob/master/Software/Python/easygopigo3.py
-     * Inheriting all GoPiGo3 functionality: https://github.com/DexterInd/GoPiGo3/blob/master/Software/Python/gopigo3.py
      * Set the grippers of the robot to Open or Close positions
+    The robot itself is reached through a hardware backend (see hardware.py): a real GoPiGo3 through
+    EasyGoPiGo3 (https://github.com/DexterInd/GoPiGo3/blob/master/Software/Python/easygopigo3.py) or a simulated one.
     """
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """
+        : backend: hardware.GoPiGoBackend to drive, a real GoPiGo3 (hardware.EasyGoPiGo3Backend) if None
         This constructor sets the variables to the following values:
         : CONST_GRIPPER_FULL_OPEN : Position of gripper servo when open
         : CONST_GRIPPER_FULL_CLOSE: Position of gripper servo when closed
         : CONST_GRIPPER_FULL_OPEN : Position of gripper servo to grab ball
-        : easygopigo3.EasyGoPiGo3 Easy_GPG: Initialization of EasyGoPiGo3
-        : easygopigo3 Easy_GPG: Initialization of EasyGoPiGo3
-        : easygopigo3.Servo gpgGripper: Initialization of Gripper Servo on Servo Pin 1
-        : init_distance_sensor my_distance_sensor: Initialization of Distance Sensor
+        : CONST_BRAKE_REACTION_SECONDS: Time from an obstacle reading until the motors act on the stop
+        : CONST_BRAKE_DECELERATION_MM_S2: Deceleration of the car once the motors stop
+        : hardware.CachingBackend backend: The robot - motors, encoders, gripper servos on SERVO1 and SERVO2, LEDs, distance sensor and battery;
+          LED and servo writes that change nothing are skipped
+        : clock: The backend's clock, simulated backends may run faster than real time
+        : SensorSampler sensors: Background reader of the distance sensor and encoders
         : IOError: When the GoPiGo3 is not detected. It also debugs a message in the terminal.
         : gopigo3.FirmwareVersionError: If the GoPiGo3 firmware needs to be updated. It also debugs a message in the terminal.
         : Exception: For any other kind of exceptions.
@@ -62,97 +149,155 @@ class RobotDerbyCar(easygopigo3.EasyGoPiGo3):
         #self.CONST_GRIPPER_FULL_OPEN = 180
         #self.CONST_GRIPPER_FULL_CLOSE = 20
         #self.CONST_GRIPPER_GRAB_POSITION = 120
-        
-        self.Easy_GPG = easygopigo3.EasyGoPiGo3()  # Create an instance of the GoPiGo3 class. GPG will be the GoPiGo3 object.
-        self.gpgGripper1 = easygopigo3.Servo("SERVO1", self.Easy_GPG)
-        self.gpgGripper2 = easygopigo3.Servo("SERVO2", self.Easy_GPG)
-        self.my_distance_sensor = self.Easy_GPG.init_distance_sensor()
+
+        # Braking model used to stop in front of obstacles - the faster the car goes, the earlier it stops
+        self.CONST_BRAKE_REACTION_SECONDS = 0.05
+        self.CONST_BRAKE_DECELERATION_MM_S2 = 1000.0
+
+        # The gripper servos report no position - how long they take to move, about 0.3 seconds from open to grab
+        self.CONST_SERVO_SECONDS_PER_DEGREE = 0.006
+
+        if backend is None:
+            # Imported here so the car can be created with a simulated backend on machines without the GoPiGo3 libraries
+            from hardware import EasyGoPiGo3Backend
+            backend = EasyGoPiGo3Backend()
+        self.backend = CachingBackend(backend)
+        self.clock = backend.clock
+        self.sensors = SensorSampler(self.backend.read_distance_mm, self.ReadEncoders,
+                                     self.backend.WHEEL_CIRCUMFERENCE / 360.0, clock=self.clock)
+        self.sensors.start()
         self.SetCarStatusLED(self.GREEN)
 
+    def close(self):
+        self.sensors.close()
+
     def SetCarStatusLED(self,color):
-        self.Easy_GPG.set_right_eye_color(color)
-        self.Easy_GPG.open_right_eye()
+        self.backend.set_leds({"right_eye": color})
 
     def SetCarModeLED(self,color):
-        self.Easy_GPG.set_left_eye_color(color)
-        self.Easy_GPG.open_left_eye()
+        self.backend.set_leds({"left_eye": color})
 
     def SetBallModeLED(self,color):
-        self.Easy_GPG.set_led(self.Easy_GPG.LED_WIFI,color[0],color[1],color[2])
+        self.backend.set_leds({"wifi": color})
+
+    def batch_outputs(self):
+        """Context manager - LED and servo changes made inside it are written together at the end."""
+        return self.backend.batch()
+
+    # The helpers below return as soon as the command is sent, so the status LED would only be red for
+    # the microseconds that takes. Batched, the red and green writes net out and only the last color goes out
 
     def GripperClose(self):
-        self.SetCarStatusLED(self.RED)
-        self.gpgGripper1.rotate_servo(self.CONST_GRIPPER_GRAB_POSITION)
-        self.gpgGripper2.rotate_servo(self.CONST_GRIPPER_GRAB_POSITION)
-        self.SetCarStatusLED(self.GREEN)
+        with self.batch_outputs():
+            self.SetCarStatusLED(self.RED)
+            # Both servos go to the same position, which the GoPiGo3 can do in one transaction
+            self.backend.set_servos({"SERVO1": self.CONST_GRIPPER_GRAB_POSITION, "SERVO2": self.CONST_GRIPPER_GRAB_POSITION})
+            self.SetCarStatusLED(self.GREEN)
 
     def GripperOpen(self):
-        self.SetCarStatusLED(self.RED)
-        self.gpgGripper1.rotate_servo(self.CONST_GRIPPER_FULL_OPEN)
-        self.gpgGripper2.rotate_servo(self.CONST_GRIPPER_FULL_OPEN)
-        self.SetCarStatusLED(self.GREEN)
+        with self.batch_outputs():
+            self.SetCarStatusLED(self.RED)
+            self.backend.set_servos({"SERVO1": self.CONST_GRIPPER_FULL_OPEN, "SERVO2": self.CONST_GRIPPER_FULL_OPEN})
+            self.SetCarStatusLED(self.GREEN)
+
+    def gripper_travel_seconds(self, position):
+        """Time the gripper servos need to get to position from where they were last set, full travel if that is not known."""
+        current = self.backend.servos.get("SERVO1")
+        if current is None:
+            current = self.CONST_GRIPPER_FULL_CLOSE if position == self.CONST_GRIPPER_FULL_OPEN else self.CONST_GRIPPER_FULL_OPEN
+        return abs(position - current) * self.CONST_SERVO_SECONDS_PER_DEGREE
 
     def ReadDistanceMM(self):
-        return self.my_distance_sensor.read_mm()
+        # The sampler is the only reader of the sensor while it runs - use its newest reading
+        if self.sensors.is_running():
+            sample = self.sensors.wait_for_sample(self.clock.time() - 0.2, 0.5)
+            return sample.distance_mm if sample is not None else None
+        return self.backend.read_distance_mm()
+
+    def ReadEncoders(self):
+        return (self.backend.get_motor_encoder(self.backend.MOTOR_LEFT),
+                self.backend.get_motor_encoder(self.backend.MOTOR_RIGHT))
+
+    def braking_distance_mm(self, speed_mm_s, sample_age=0):
+        """Distance the car covers from a sensor reading sample_age seconds old until it comes to rest."""
+        speed = max(speed_mm_s, 0)
+        return speed * (sample_age + self.CONST_BRAKE_REACTION_SECONDS) + speed * speed / (2 * self.CONST_BRAKE_DECELERATION_MM_S2)
+
+    def stop_at(self, position_left, position_right):
+        """Holds both motors at the given encoder positions."""
+        self.backend.set_motor_position(self.backend.MOTOR_LEFT, position_left)
+        self.backend.set_motor_position(self.backend.MOTOR_RIGHT, position_right)
 
     def ReadBatteryVoltage(self):
-        return self.Easy_GPG.get_voltage_battery()
+        return self.backend.get_voltage_battery()
 
     def set_speed(self,speed):
-        self.SetCarStatusLED(self.RED)
-        self.Easy_GPG.set_speed(speed)
-        self.SetCarStatusLED(self.GREEN)
+        with self.batch_outputs():
+            self.SetCarStatusLED(self.RED)
+            self.backend.set_speed(speed)
+            self.SetCarStatusLED(self.GREEN)
 
     def drive_cm(self,distance):
         self.SetCarStatusLED(self.RED)
-        self.Easy_GPG.drive_cm(distance,True)
+        self.backend.drive_cm(distance,True)
         self.SetCarStatusLED(self.GREEN)
 
     def turn_degrees(self,degress):
         self.SetCarStatusLED(self.RED)
-        self.Easy_GPG.turn_degrees(degress,True)
+        self.backend.turn_degrees(degress,True)
         self.SetCarStatusLED(self.GREEN)
 
-    def drive(self,dist_requested,dist_limit):
+    def drive_wheel_degrees(self, mm):
+        """Degrees both wheels turn to drive mm forward (negative mm for backward)."""
+        return mm * 360.0 / self.backend.WHEEL_CIRCUMFERENCE
+
+    def turn_wheel_degrees(self, degrees):
+        """Degrees the left wheel turns forward and the right one backward to turn the car in place, clockwise for positive degrees."""
+        return degrees * self.backend.WHEEL_BASE_CIRCUMFERENCE / self.backend.WHEEL_CIRCUMFERENCE
+
+    def start_move(self, end_left, end_right, stop_distance=None, tolerance=DriveOperation.TARGET_TOLERANCE_DEGREES):
         """
-        Move the `GoPiGo3`_ forward / backward for ``dist`` amount of miliimeters.
+        Starts turning the wheels to the given encoder positions and returns a DriveOperation.
+        : stop_distance: stop early if an obstacle comes this close (mm), None to not look for obstacles
+        : tolerance: encoder degrees from the targets at which the operation is done
+        """
+        operation = DriveOperation(self, end_left, end_right, stop_distance, tolerance)
+        self.SetCarStatusLED(self.RED)
+        self.backend.set_motor_position(self.backend.MOTOR_LEFT, end_left)
+        self.backend.set_motor_position(self.backend.MOTOR_RIGHT, end_right)
+        # Listen only once the targets are set, so an immediate obstacle stop is not overridden by them
+        self.sensors.add_listener(operation.on_sample)
+        return operation
+
+    def start_drive(self,dist_requested,dist_limit):
+        """
+        Starts moving the `GoPiGo3`_ forward / backward for ``dist`` amount of miliimeters and returns a DriveOperation.
         | For moving the `GoPiGo3`_ robot forward, the ``dist`` parameter has to be *positive*.
         | For moving the `GoPiGo3`_ robot backward, the ``dist`` parameter has to be *negative*.
+        The car stops early if an obstacle comes within ``dist_limit`` millimeters.
         """
-
-        # Have we found any obstacles in the path
-        ObstaclesFound = False
+        dist_requested = int(dist_requested)
+        dist_limit = int(dist_limit)
 
         # the number of degrees each wheel needs to turn
-        WheelTurnDegrees = ((dist_requested / self.Easy_GPG.WHEEL_CIRCUMFERENCE) * 360)
+        WheelTurnDegrees = ((dist_requested / self.backend.WHEEL_CIRCUMFERENCE) * 360)
 
         # get the starting position of each motor
-        CurrentPositionLeft = self.Easy_GPG.get_motor_encoder(self.Easy_GPG.MOTOR_LEFT)
-        CurrentPositionRight = self.Easy_GPG.get_motor_encoder(self.Easy_GPG.MOTOR_RIGHT)
+        CurrentPositionLeft, CurrentPositionRight = self.ReadEncoders()
 
         # determine the end position of each motor
         EndPositionLeft = CurrentPositionLeft + WheelTurnDegrees
         EndPositionRight = CurrentPositionRight + WheelTurnDegrees
 
-        self.SetCarStatusLED(self.RED)
-        self.Easy_GPG.set_motor_position(self.Easy_GPG.MOTOR_LEFT, EndPositionLeft)
-        self.Easy_GPG.set_motor_position(self.Easy_GPG.MOTOR_RIGHT, EndPositionRight)
-
-        while self.Easy_GPG.target_reached(EndPositionLeft, EndPositionRight) is False:
-            # read the distance of the laser sensor
-            dist_read = self.ReadDistanceMM()
-
-            # stop car if there is an object within the limit
-            if ((dist_read is not None) and (int(dist_read) <= int(dist_limit)) and (int(dist_requested) > int(dist_limit))):
-                print("RobotDerbyCar.drive(): Obstacle Found. Stopping Car before requested distance. Object distance: " + str(dist_read))
-                ObstaclesFound = True
-                CurrentPositionLeft = self.Easy_GPG.get_motor_encoder(self.Easy_GPG.MOTOR_LEFT)
-                CurrentPositionRight = self.Easy_GPG.get_motor_encoder(self.Easy_GPG.MOTOR_RIGHT)
-                self.Easy_GPG.set_motor_position(self.Easy_GPG.MOTOR_LEFT, CurrentPositionLeft)
-                self.Easy_GPG.set_motor_position(self.Easy_GPG.MOTOR_RIGHT, CurrentPositionRight)
-                break
-
-            time.sleep(0.05)
+        # Only look for obstacles when asked to drive further than the limit, otherwise the car could never approach a ball
+        return self.start_move(EndPositionLeft, EndPositionRight, dist_limit if dist_requested > dist_limit else None)
 
+    def drive(self,dist_requested,dist_limit):
+        """
+        Move the `GoPiGo3`_ forward / backward for ``dist`` amount of miliimeters and wait until it is done.
+        Returns True if the car stopped before the requested distance because of an obstacle.
+        """
+        operation = self.start_drive(dist_requested, dist_limit)
+        ObstaclesFound = operation.wait()
         self.SetCarStatusLED(self.GREEN)
         return ObstaclesFound
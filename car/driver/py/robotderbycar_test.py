@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tests for DriveOperation finishing exactly once when the sensor sampler thread
+and a cancelling thread race for it.
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import threading
+import unittest
+
+from robotderbycar import DriveOperation
+from sensors import SensorSample
+
+
+class FakeClock(object):
+
+    def time(self):
+        return 0.0
+
+
+class FakeSensors(object):
+
+    def __init__(self):
+        self.removed = []
+
+    def remove_listener(self, listener):
+        self.removed.append(listener)
+
+
+class FakeCar(object):
+    """
+    Just what DriveOperation uses of a RobotDerbyCar. on_read_encoders is called on every encoder
+    read, so a test can run the other thread's code in the middle of a stop decision.
+    """
+
+    def __init__(self):
+        self.clock = FakeClock()
+        self.sensors = FakeSensors()
+        self.encoders = (0, 0)
+        self.stops = []
+        self.on_read_encoders = None
+
+    def ReadEncoders(self):
+        if self.on_read_encoders is not None:
+            callback, self.on_read_encoders = self.on_read_encoders, None
+            callback()
+        return self.encoders
+
+    def braking_distance_mm(self, speed_mm_s, age_seconds):
+        return 0
+
+    def stop_at(self, left, right):
+        self.stops.append((left, right))
+
+
+def obstacle_sample(distance_mm=100):
+    return SensorSample(0.0, distance_mm, 0, 0, 200)
+
+
+class DriveOperationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.car = FakeCar()
+        self.operation = DriveOperation(self.car, 1000, 1000, stop_distance=250)
+
+    def assertFinishedOnce(self):
+        self.assertTrue(self.operation.done())
+        self.assertEqual(len(self.car.stops), 1)
+        self.assertEqual(self.car.sensors.removed, [self.operation.on_sample])
+
+    def test_obstacle_stops_the_car(self):
+        self.operation.on_sample(obstacle_sample())
+        self.assertFinishedOnce()
+        self.assertTrue(self.operation.obstacle_found)
+        self.assertEqual(self.operation.obstacle_distance, 100)
+        self.assertFalse(self.operation.cancelled)
+
+    def test_reaching_the_target_finishes_without_a_stop(self):
+        self.car.encoders = (998, 1003)
+        self.operation.on_sample(obstacle_sample(1000))
+        self.assertTrue(self.operation.done())
+        self.assertEqual(self.car.stops, [])
+        self.operation.cancel()
+        self.assertFalse(self.operation.cancelled)
+        self.assertEqual(self.car.stops, [])
+
+    def test_cancel_during_obstacle_stop(self):
+        # cancel() runs while the sampler thread reads the encoders to stop for the obstacle
+        self.car.on_read_encoders = self.operation.cancel
+        self.operation.on_sample(obstacle_sample())
+        self.assertFinishedOnce()
+        self.assertFalse(self.operation.cancelled and self.operation.obstacle_found)
+
+    def test_obstacle_during_cancel(self):
+        # The sampler thread sees an obstacle while cancel() reads the encoders to stop the car
+        self.car.on_read_encoders = lambda: self.operation.on_sample(obstacle_sample())
+        self.operation.cancel()
+        self.assertFinishedOnce()
+        self.assertTrue(self.operation.cancelled)
+        self.assertFalse(self.operation.obstacle_found)
+        self.assertIsNone(self.operation.obstacle_distance)
+
+    def test_concurrent_cancel_and_obstacle(self):
+        for _ in range(200):
+            self.setUp()
+            start = threading.Event()
+
+            def sampler():
+                start.wait()
+                self.operation.on_sample(obstacle_sample())
+
+            thread = threading.Thread(target=sampler)
+            thread.start()
+            start.set()
+            self.operation.cancel()
+            thread.join()
+            self.assertFinishedOnce()
+            self.assertNotEqual(self.operation.cancelled, self.operation.obstacle_found)
+
+
+if __name__ == '__main__':
+    unittest.main()
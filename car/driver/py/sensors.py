@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Background sampling of the distance sensor and the wheel encoders. A single
+thread reads them as fast as the buses allow and publishes every reading as
+the latest sample, so obstacle checks run at the sensor rate instead of at the
+pace of a polling loop, and the sensors only ever have one reader.
+
+The sampler only needs callables for the readings, so it works the same with
+a real or a simulated GoPiGo.
+"""
+
+import collections
+import threading
+import time
+
+# One reading: clock time of the reading, distance in mm (None if the sensor failed),
+# left and right encoder positions in degrees and the forward speed in mm/s derived from the encoders
+SensorSample = collections.namedtuple('SensorSample', ['timestamp', 'distance_mm', 'left_encoder', 'right_encoder', 'speed_mm_s'])
+
+
+class SensorSampler(object):
+    """
+    Reads the distance sensor and encoders on a background thread.
+    : read_distance: callable returning the distance in mm
+    : read_encoders: callable returning (left, right) encoder positions in degrees
+    : mm_per_degree: distance the car travels per degree of wheel rotation
+    : min_interval: shortest time between two readings, to leave the buses some slack
+    : history_size: how many recent samples to keep
+    : clock: object with time() and sleep(), the time module by default; simulations may pass a faster clock
+    """
+
+    # Encoders report whole degrees, so the speed is measured over a few samples rather than between two
+    SPEED_WINDOW_SECONDS = 0.05
+
+    def __init__(self, read_distance, read_encoders, mm_per_degree, min_interval=0.005, history_size=50, clock=time):
+        self.clock = clock
+        self.read_distance = read_distance
+        self.read_encoders = read_encoders
+        self.mm_per_degree = mm_per_degree
+        self.min_interval = min_interval
+        # Assigning a new tuple is atomic, so readers never need a lock to get the latest sample
+        self.latest = None
+        self.history = collections.deque(maxlen=history_size)
+        self._listeners = ()
+        self._listeners_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+        self.samples_taken = 0
+        self.read_errors = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sensor-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_listener(self, listener):
+        """Calls listener(sample) on the sampler thread for every new sample."""
+        with self._listeners_lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        with self._listeners_lock:
+            self._listeners = tuple(l for l in self._listeners if l is not listener)
+
+    def _speed_reference(self, now):
+        """Returns the newest sample at least SPEED_WINDOW_SECONDS old, or the oldest one kept."""
+        reference = None
+        for sample in reversed(self.history):
+            reference = sample
+            if now - sample.timestamp >= self.SPEED_WINDOW_SECONDS:
+                break
+        return reference
+
+    def _read(self):
+        try:
+            left, right = self.read_encoders()
+        except Exception as e:
+            self.read_errors += 1
+            print("SensorSampler: encoder read failed: {}".format(e))
+            return None
+        try:
+            distance = self.read_distance()
+        except Exception as e:
+            self.read_errors += 1
+            print("SensorSampler: distance read failed: {}".format(e))
+            distance = None
+        now = self.clock.time()
+
+        speed = 0.0
+        previous = self._speed_reference(now)
+        if previous is not None and now > previous.timestamp:
+            moved = ((left - previous.left_encoder) + (right - previous.right_encoder)) / 2.0
+            speed = moved * self.mm_per_degree / (now - previous.timestamp)
+        return SensorSample(now, distance, left, right, speed)
+
+    def _run(self):
+        while self._running:
+            started = self.clock.time()
+            sample = self._read()
+            if sample is not None:
+                self.latest = sample
+                self.history.append(sample)
+                self.samples_taken += 1
+                for listener in self._listeners:
+                    try:
+                        listener(sample)
+                    except Exception as e:
+                        print("SensorSampler: listener failed: {}".format(e))
+            elapsed = self.clock.time() - started
+            if elapsed < self.min_interval:
+                self.clock.sleep(self.min_interval - elapsed)
+
+    def wait_for_sample(self, newer_than, timeout):
+        """Returns the first sample taken after newer_than (a clock time), None on timeout."""
+        deadline = self.clock.time() + timeout
+        while True:
+            sample = self.latest
+            if sample is not None and sample.timestamp > newer_than:
+                return sample
+            if self.clock.time() >= deadline:
+                return None
+            self.clock.sleep(self.min_interval)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Rate control for the continuous sensor message stream (sensorRate ==
+'continuous'). The frame rate goes up step by step while uploads keep up and
+the MQTT bridge acknowledges messages promptly, and is cut back as soon as
+uploads take longer than a frame interval, PUBACKs pile up or frames have to be
+dropped - additive increase, multiplicative decrease.
+"""
+
+import collections
+import threading
+import time
+
+from histogram import LatencyHistogram
+
+
+class StreamRateController(object):
+    """
+    Decides when the next streamed frame is due and keeps the stream statistics.
+    : target_fps: highest frame rate to stream at
+    : min_fps: lowest frame rate to back off to
+    : max_in_flight: published messages that may wait for a PUBACK before the stream pauses
+    : ack_timeout: seconds after which a message without PUBACK is counted as lost
+    """
+
+    INCREASE_FPS = 0.25
+    DECREASE_FACTOR = 0.7
+    # Achieved fps is measured over this many of the most recent acknowledged frames
+    FPS_WINDOW = 20
+    # PUBACKs of on-demand messages are never matched, so only the most recent unmatched ones are remembered
+    MAX_EARLY_ACKS = 50
+
+    def __init__(self, target_fps=2.0, min_fps=0.2, max_in_flight=2, ack_timeout=10.0):
+        self.target_fps = float(target_fps)
+        self.min_fps = min(float(min_fps), self.target_fps)
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.fps = self.target_fps
+        self._lock = threading.Lock()
+        self._next_frame_time = 0
+        self._last_decrease = 0
+        # mid -> (frame timestamp, publish time) of messages waiting for a PUBACK
+        self._in_flight = {}
+        # PUBACKs that arrived before publish() returned the message id
+        self._early_acks = collections.deque(maxlen=self.MAX_EARLY_ACKS)
+        self._ack_times = collections.deque(maxlen=self.FPS_WINDOW)
+
+        self.frames_streamed = 0
+        self.frames_dropped = 0
+        self.messages_acked = 0
+        self.messages_lost = 0
+        self.end_to_end_latency = LatencyHistogram("frame capture-to-PUBACK latency")
+
+    def _decrease(self, now, reason):
+        # Back off at most once per frame interval, so one slow spell does not floor the rate
+        if now - self._last_decrease < 1.0 / self.fps:
+            return
+        self._last_decrease = now
+        fps = max(self.min_fps, self.fps * self.DECREASE_FACTOR)
+        if fps < self.fps:
+            print("StreamRateController: {} - slowing down from {:.2f} to {:.2f} fps".format(reason, self.fps, fps))
+        self.fps = fps
+
+    def _expire_lost(self, now):
+        lost = [mid for mid, (_, published) in self._in_flight.items() if now - published > self.ack_timeout]
+        for mid in lost:
+            del self._in_flight[mid]
+            self.messages_lost += 1
+        if lost:
+            self._decrease(now, "{} messages without PUBACK".format(len(lost)))
+
+    def seconds_until_next_frame(self):
+        """Returns how long to wait before capturing the next frame, 0 if it is due now."""
+        now = time.time()
+        with self._lock:
+            self._expire_lost(now)
+            if len(self._in_flight) >= self.max_in_flight:
+                # The MQTT bridge is behind - check again in a moment instead of adding to the backlog
+                return min(1.0 / self.fps, 0.1)
+            return max(0, self._next_frame_time - now)
+
+    def frame_started(self):
+        """Called when a frame is handed over for upload; schedules the next one."""
+        with self._lock:
+            self.frames_streamed += 1
+            self._next_frame_time = time.time() + 1.0 / self.fps
+
+    def frame_dropped(self):
+        """Called when a queued frame was replaced by a fresher one before it could be sent."""
+        with self._lock:
+            self.frames_dropped += 1
+            self._decrease(time.time(), "frame dropped")
+
+    def message_published(self, mid, frame_timestamp, upload_seconds):
+        """
+        Called after a streamed frame was uploaded and its sensor message handed to MQTT.
+        : mid: MQTT message id returned by publish(), None if it is not known
+        : frame_timestamp: time.time() when the frame was captured
+        : upload_seconds: how long the image upload took
+        """
+        now = time.time()
+        with self._lock:
+            if upload_seconds > 1.0 / self.fps:
+                self._decrease(now, "upload took {:.2f} seconds".format(upload_seconds))
+            if mid is None:
+                return
+            if mid in self._early_acks:
+                self._early_acks.remove(mid)
+                self._acked(now, frame_timestamp)
+            else:
+                self._in_flight[mid] = (frame_timestamp, now)
+
+    def message_acked(self, mid):
+        """
+        Called from the MQTT on_publish callback when the bridge acknowledged a message.
+        Returns True if it was a streamed message that was waiting for its PUBACK.
+        """
+        now = time.time()
+        with self._lock:
+            if mid in self._in_flight:
+                frame_timestamp, _ = self._in_flight.pop(mid)
+                self._acked(now, frame_timestamp)
+                return True
+            self._early_acks.append(mid)
+            return False
+
+    def _acked(self, now, frame_timestamp):
+        self.messages_acked += 1
+        self._ack_times.append(now)
+        self.end_to_end_latency.record((now - frame_timestamp) * 1000)
+        if not self._in_flight and self.fps < self.target_fps:
+            self.fps = min(self.target_fps, self.fps + self.INCREASE_FPS)
+
+    def achieved_fps(self):
+        with self._lock:
+            if len(self._ack_times) < 2:
+                return None
+            span = self._ack_times[-1] - self._ack_times[0]
+            return (len(self._ack_times) - 1) / span if span > 0 else None
+
+    def stats(self):
+        """Returns the stream counters, current and achieved fps, and end-to-end latency percentiles in ms."""
+        achieved_fps = self.achieved_fps()
+        with self._lock:
+            return {
+                "targetFps": self.target_fps,
+                "currentFps": round(self.fps, 2),
+                "achievedFps": round(achieved_fps, 2) if achieved_fps is not None else None,
+                "framesStreamed": self.frames_streamed,
+                "framesDropped": self.frames_dropped,
+                "messagesAcked": self.messages_acked,
+                "messagesLost": self.messages_lost,
+                "inFlight": len(self._in_flight),
+                "latencyP50Ms": self.end_to_end_latency.percentile(50),
+                "latencyP95Ms": self.end_to_end_latency.percentile(95),
+            }
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Background delivery of sensor messages. The main loop captures a frame and
+hands it over together with the sensor message; a worker thread uploads the
+image to GCS and publishes the message over MQTT, so the car can go back to
+processing driving commands right away.
+
+Frames of the continuous stream are submitted as droppable: if one is still
+waiting when a newer one arrives, only the newer one is sent.
+"""
+
+import collections
+import datetime
+import threading
+import time
+
+from uploader import image_file_name_for
+from wire_format import WIRE_VERSION_JSON
+from wire_format import encode_sensor_message
+
+
+class TelemetryPublisher(object):
+    """
+    Uploads frames and publishes sensor messages on a background thread.
+    : uploader: ImageUploader (or a stand-in) with upload(image_file_name, jpeg_bytes) returning (gcs_url, public_url)
+    : publish: callable that sends the encoded payload, e.g. to the MQTT telemetry topic; may return the
+      paho MQTTMessageInfo so streamed messages can be matched with their PUBACK
+    : stream: optional StreamRateController told about dropped and published streamed frames
+    : wire_version: wire format of the published sensor messages, see wire_format.py
+    """
+
+    def __init__(self, uploader, publish, stream=None, wire_version=WIRE_VERSION_JSON):
+        self.uploader = uploader
+        self.publish = publish
+        self.stream = stream
+        self.wire_version = wire_version
+        self._queue = collections.deque()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='telemetry-publisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, jpeg_bytes, data, droppable=False, frame_timestamp=None, trace=None):
+        """
+        Queues a frame and its sensor message and returns immediately.
+        : data: the sensor message dict; the image paths are filled into data["sensors"] after upload
+        : droppable: True for streamed frames - a queued droppable frame not yet being sent is replaced by this one
+        : frame_timestamp: time.time() when the frame was captured, defaults to now
+        : trace: optional tracing.Trace of the message, gets the queue, upload, publish and total stages
+        """
+        if frame_timestamp is None:
+            frame_timestamp = time.time()
+        dropped = 0
+        with self._idle:
+            if droppable:
+                for item in [item for item in self._queue if item[3]]:
+                    self._queue.remove(item)
+                    self._pending -= 1
+                    dropped += 1
+            self._queue.append((jpeg_bytes, data, datetime.datetime.now(), droppable, frame_timestamp, trace, time.time()))
+            self._pending += 1
+            self._idle.notify_all()
+        if self.stream is not None:
+            for _ in range(dropped):
+                self.stream.frame_dropped()
+
+    def wait_until_idle(self, timeout):
+        """Waits up to timeout seconds for queued messages to be sent. Returns True if none are left."""
+        deadline = time.time() + timeout
+        with self._idle:
+            while self._pending > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    def _send(self, jpeg_bytes, data, capture_time, droppable, frame_timestamp, trace, submit_time):
+        if trace is not None:
+            trace.record("queue", (time.time() - submit_time) * 1000)
+        image_file_name = image_file_name_for(capture_time)
+        # Streamed frames are only summarized by the rate controller stats, not logged one by one
+        if not droppable:
+            print("TelemetryPublisher: uploading image " + image_file_name)
+        upload_start = time.time()
+        gcs_url, public_url = self.uploader.upload(image_file_name, jpeg_bytes, verbose=not droppable)
+        upload_seconds = time.time() - upload_start
+        if trace is not None:
+            trace.record("upload", upload_seconds * 1000)
+
+        data["sensors"]["frontCameraImagePath"] = public_url
+        data["sensors"]["frontCameraImagePathGCS"] = gcs_url
+        publish_start = time.time()
+        result = self.publish(encode_sensor_message(data, self.wire_version))
+        if trace is not None:
+            trace.record("publish", (time.time() - publish_start) * 1000)
+            # From the frame being captured to the message leaving the car
+            trace.record("total", (time.time() - frame_timestamp) * 1000)
+        if droppable and self.stream is not None:
+            self.stream.message_published(getattr(result, 'mid', None), frame_timestamp, upload_seconds)
+        if not droppable:
+            print("TelemetryPublisher: ----------------------> msg published to the cloud, image URL: " + str(public_url))
+            if trace is not None:
+                print("TelemetryPublisher: " + trace.summary())
+
+    def _run(self):
+        while True:
+            with self._idle:
+                while not self._queue:
+                    self._idle.wait()
+                item = self._queue.popleft()
+            try:
+                self._send(*item)
+            except Exception as e:
+                print("TelemetryPublisher: failed to send sensor message: {}".format(e))
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
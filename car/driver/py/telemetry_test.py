@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Runs the TelemetryPublisher offline: frames come from a StaticImageSource
+through the ContinuousCamera, are uploaded by an ImageUploader into an
+in-memory bucket and published to a list instead of MQTT.
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import threading
+import time
+import unittest
+
+from camera import ContinuousCamera
+from camera import StaticImageSource
+from telemetry import TelemetryPublisher
+from uploader import ImageUploader
+from wire_format import decode_sensor_message
+
+JPEG_BYTES = b'\xff\xd8 not really a frame \xff\xd9'
+
+
+class FakeBlob(object):
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = '/b/{}/o/{}'.format(bucket.name, name)
+        self.public_url = 'https://storage.googleapis.com/{}/{}'.format(bucket.name, name)
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.upload(self.name, data)
+
+
+class FakeBucket(object):
+    """In-memory bucket; uploads wait while `blocked` is cleared and fail while `fail` is set."""
+
+    def __init__(self, name='derby-frames'):
+        self.name = name
+        self.objects = {}
+        self.blocked = threading.Event()
+        self.blocked.set()
+        self.upload_started = threading.Event()
+        self.fail = False
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def upload(self, name, data):
+        self.upload_started.set()
+        self.blocked.wait(5)
+        if self.fail:
+            raise IOError("simulated upload failure")
+        self.objects[name] = data
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.dropped = 0
+        self.published = 0
+
+    def frame_dropped(self):
+        self.dropped += 1
+
+    def message_published(self, mid, frame_timestamp, upload_seconds):
+        self.published += 1
+
+
+def sensor_message(timestamp_ms):
+    return {"timestampMs": timestamp_ms, "carId": 1, "carState": {"color": "Red"}, "sensors": {"frontLaserDistanceMm": 300}}
+
+
+class TelemetryPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.published = []
+        self.stream = FakeStream()
+        self.publisher = TelemetryPublisher(ImageUploader(self.bucket), self.published.append, stream=self.stream)
+
+    def tearDown(self):
+        self.bucket.blocked.set()
+
+    def test_publishes_camera_frame_with_image_paths(self):
+        camera = ContinuousCamera(StaticImageSource(JPEG_BYTES), max_fps=50)
+        camera.start()
+        try:
+            frame = camera.latest_frame(timeout=2)
+        finally:
+            camera.close()
+        self.assertIsNotNone(frame)
+
+        self.publisher.submit(frame.jpeg_bytes, sensor_message(1), frame_timestamp=frame.timestamp)
+        self.assertTrue(self.publisher.wait_until_idle(5))
+
+        self.assertEqual(len(self.published), 1)
+        message = decode_sensor_message(self.published[0])[1]
+        self.assertEqual(message["timestampMs"], 1)
+        self.assertEqual(message["sensors"]["frontLaserDistanceMm"], 300)
+        name = message["sensors"]["frontCameraImagePathGCS"].split("/")[-1]
+        self.assertEqual(message["sensors"]["frontCameraImagePathGCS"], "gs://derby-frames/" + name)
+        self.assertEqual(self.bucket.objects[name], JPEG_BYTES)
+
+    def test_newer_droppable_frame_replaces_queued_one(self):
+        self.bucket.blocked.clear()
+        self.publisher.submit(JPEG_BYTES, sensor_message(1), droppable=True)
+        # Frame 1 is being uploaded, frame 2 waits in the queue until frame 3 replaces it
+        self.assertTrue(self.bucket.upload_started.wait(5))
+        self.publisher.submit(JPEG_BYTES, sensor_message(2), droppable=True)
+        self.publisher.submit(JPEG_BYTES, sensor_message(3), droppable=True)
+        self.bucket.blocked.set()
+        self.assertTrue(self.publisher.wait_until_idle(5))
+
+        self.assertEqual([decode_sensor_message(payload)[1]["timestampMs"] for payload in self.published], [1, 3])
+        self.assertEqual(self.stream.dropped, 1)
+        self.assertEqual(self.stream.published, 2)
+
+    def test_requested_frames_are_never_dropped(self):
+        self.bucket.blocked.clear()
+        for timestamp_ms in (1, 2, 3):
+            self.publisher.submit(JPEG_BYTES, sensor_message(timestamp_ms))
+        self.bucket.blocked.set()
+        self.assertTrue(self.publisher.wait_until_idle(5))
+        self.assertEqual([decode_sensor_message(payload)[1]["timestampMs"] for payload in self.published], [1, 2, 3])
+
+    def test_wait_until_idle_times_out_while_sending(self):
+        self.bucket.blocked.clear()
+        self.publisher.submit(JPEG_BYTES, sensor_message(1))
+        started = time.time()
+        self.assertFalse(self.publisher.wait_until_idle(0.2))
+        self.assertGreaterEqual(time.time() - started, 0.2)
+        self.bucket.blocked.set()
+        self.assertTrue(self.publisher.wait_until_idle(5))
+
+    def test_failed_upload_does_not_stop_the_publisher(self):
+        self.bucket.fail = True
+        self.publisher.submit(JPEG_BYTES, sensor_message(1))
+        self.assertTrue(self.publisher.wait_until_idle(5))
+        self.bucket.fail = False
+        self.publisher.submit(JPEG_BYTES, sensor_message(2))
+        self.assertTrue(self.publisher.wait_until_idle(5))
+        self.assertEqual([decode_sensor_message(payload)[1]["timestampMs"] for payload in self.published], [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Lightweight tracing of sensor messages. Every frame the car sends gets a trace
+with a correlation id, which travels in the message as sensors.traceId; the
+controller passes it on to the inference VM as the trace_id of the gcs_uri
+request, so the log lines of one frame can be found on every hop.
+
+Spans time the stages of a trace (capture, queue, upload, publish) into one
+LatencyHistogram per stage. The histograms are written to a file in the
+Prometheus text format, which node_exporter's textfile collector can pick up,
+or which can simply be looked at during an event.
+"""
+
+import contextlib
+import os
+import threading
+import time
+import uuid
+
+from histogram import LatencyHistogram
+
+# Name of the exported histogram metric, one series per stage
+METRIC_NAME = "car_stage_latency_milliseconds"
+
+
+class Trace(object):
+    """
+    Stage timings of one sensor message.
+    : tracer: Tracer to record the stage timings in
+    : trace_id: correlation id of the message
+    """
+
+    def __init__(self, tracer, trace_id):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        # (stage, milliseconds) in the order the stages finished
+        self.spans = []
+
+    def record(self, stage, latency_ms):
+        self.spans.append((stage, latency_ms))
+        self.tracer.record(stage, latency_ms)
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """Context manager timing the block as the given stage."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.time() - start) * 1000)
+
+    def summary(self):
+        return "trace {}: {}".format(self.trace_id, " ".join("{}={:.0f}ms".format(stage, ms) for stage, ms in self.spans))
+
+
+class Tracer(object):
+    """
+    Creates traces and keeps a LatencyHistogram per stage, for this process.
+    : source: prefix of the trace ids, e.g. the car id, so ids from different cars never clash
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def new_trace(self):
+        return Trace(self, "{}-{}".format(self.source, uuid.uuid4().hex[:12]))
+
+    def add_histogram(self, stage, histogram):
+        """Exports an existing LatencyHistogram as a stage, e.g. one the main loop keeps anyway."""
+        with self._lock:
+            self.histograms[stage] = histogram
+
+    def record(self, stage, latency_ms):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = LatencyHistogram("{} latency".format(stage))
+                self.histograms[stage] = histogram
+        histogram.record(latency_ms)
+
+    def prometheus_text(self):
+        """Returns the stage histograms in the Prometheus text format."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        lines = ["# HELP {} Time spent in each stage of the car's sensor messages and commands".format(METRIC_NAME),
+                 "# TYPE {} histogram".format(METRIC_NAME)]
+        for stage, histogram in histograms:
+            buckets_ms, counts, count, total_ms = histogram.snapshot()
+            cumulative = 0
+            for bucket_ms, bucket_count in zip(buckets_ms, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(METRIC_NAME, stage, bucket_ms, cumulative))
+            lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(METRIC_NAME, stage, count))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(METRIC_NAME, stage, total_ms))
+            lines.append('{}_count{{stage="{}"}} {}'.format(METRIC_NAME, stage, count))
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path):
+        """Writes the histograms to path. The file is replaced in one step, so readers never see half of it."""
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        os.rename(temporary_path, path)
+
+    def export_periodically(self, path, interval_seconds):
+        """Writes the histograms to path every interval_seconds on a background thread."""
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.write_metrics(path)
+                except (IOError, OSError) as e:
+                    print("Tracer: failed to write metrics to {}: {}".format(path, e))
+
+        self._exporter = threading.Thread(target=run, name='metrics-exporter')
+        self._exporter.daemon = True
+        self._exporter.start()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Uploads camera frames to GCS straight from memory. One uploader (and so one
+storage client with its HTTPS connection pool) is kept for the whole run.
+"""
+
+import io
+import threading
+import time
+
+import six
+
+
+def image_file_name_for(capture_time):
+    image_file_name = 'image' + str(capture_time) + '.jpg'
+    image_file_name = image_file_name.replace(":", "")  # Strip out the colon from date time.
+    image_file_name = image_file_name.replace(" ", "")  # Strip out the space from date time.
+    return image_file_name
+
+
+def shrink_jpeg(jpeg_bytes, max_size=None, quality=0):
+    """
+    Re-encodes a JPEG frame to make the upload smaller.
+    : max_size: (width, height) the frame has to fit in, None to keep its size
+    : quality: JPEG quality (1-95) to re-encode with, 0 to keep the encoder default
+    """
+    # Imported here since PIL is only needed when frames are shrunk
+    from PIL import Image
+    image = Image.open(io.BytesIO(jpeg_bytes))
+    if max_size is not None:
+        # Let the JPEG decoder scale down while decoding, then resize to the exact size
+        image.draft('RGB', max_size)
+        image.thumbnail(max_size, Image.LANCZOS)
+    output = io.BytesIO()
+    if quality > 0:
+        image.save(output, format='JPEG', quality=quality)
+    else:
+        image.save(output, format='JPEG')
+    return output.getvalue()
+
+
+class ImageUploader(object):
+    """
+    Uploads JPEG frames from memory to a GCS bucket and measures each upload.
+    : bucket: GCS bucket (or a stand-in) with a blob(name).upload_from_string() interface;
+      it should come from one long-lived storage.Client so its connections are reused
+    : max_size: optional (width, height) to shrink frames to before upload
+    : quality: optional JPEG quality to re-encode frames with, 0 uploads frames as captured
+    """
+
+    def __init__(self, bucket, max_size=None, quality=0):
+        self.bucket = bucket
+        self.max_size = max_size
+        self.quality = quality
+        self._lock = threading.Lock()
+
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.upload_seconds = 0.0
+        self.last_latency = None
+        self.last_bytes_per_second = None
+
+    def upload(self, image_file_name, jpeg_bytes, verbose=True):
+        """
+        Uploads the frame and returns (gcs_url, public_url) of the new object.
+        : verbose: False to skip the per-upload log lines, e.g. for streamed frames
+        """
+        if self.max_size is not None or self.quality > 0:
+            original_size = len(jpeg_bytes)
+            jpeg_bytes = shrink_jpeg(jpeg_bytes, self.max_size, self.quality)
+            if verbose:
+                print("ImageUploader: frame shrunk from {} to {} bytes".format(original_size, len(jpeg_bytes)))
+
+        myblob = self.bucket.blob(image_file_name)
+        start_time = time.time()
+        # Small objects go up in a single multipart request, see docs:
+        # http://google-cloud-python.readthedocs.io/en/latest/storage/blobs.html
+        myblob.upload_from_string(jpeg_bytes, content_type='image/jpeg')
+        latency = time.time() - start_time
+        bytes_per_second = len(jpeg_bytes) / latency if latency > 0 else None
+
+        with self._lock:
+            self.uploads += 1
+            self.bytes_uploaded += len(jpeg_bytes)
+            self.upload_seconds += latency
+            self.last_latency = latency
+            self.last_bytes_per_second = bytes_per_second
+        if verbose:
+            print("ImageUploader: uploaded {} bytes in {:.3f} seconds ({:.0f} bytes/s)".format(
+                len(jpeg_bytes), latency, bytes_per_second or 0))
+
+        # Process GCS URL
+        url = myblob.public_url
+        gcs_url = str(myblob.path).replace("/b/", "gs://")
+        gcs_url = gcs_url.replace("/o/", "/")
+        if isinstance(url, six.binary_type):
+            url = url.decode('utf-8')
+
+        if isinstance(gcs_url, six.binary_type):
+            gcs_url = gcs_url.decode('utf-8')
+
+        return gcs_url, url
+
+    def stats(self):
+        """Returns upload counters, the last upload's latency and throughput, and the averages."""
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "bytesUploaded": self.bytes_uploaded,
+                "lastLatency": self.last_latency,
+                "lastBytesPerSecond": self.last_bytes_per_second,
+                "meanLatency": self.upload_seconds / self.uploads if self.uploads else None,
+                "meanBytesPerSecond": self.bytes_uploaded / self.upload_seconds if self.upload_seconds > 0 else None,
+            }
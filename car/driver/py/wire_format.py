@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Wire formats of the sensor messages the car sends and the driving commands it
+receives. Must match cloud/controller/js/wire-format.js .
+
+Version 1 is the original format: a JSON object, encoded as JSON once more.
+
+Version 2 is compact: one JSON array [2, mask, value, value, ..., extras]. The
+values are the fields of a fixed schema in schema order, bit i of mask telling
+whether field i is present. Fields outside the schema go into an optional
+trailing extras object, laid out like the original message. Actions of a
+command are a flat list of action code and value pairs. The array stays plain
+text, so it passes through the Pub/Sub client of the controller, which treats
+message data as text.
+
+Decoders accept every version and report which one they found, so each side
+can answer in the format the other one used.
+"""
+
+import json
+
+import six
+
+WIRE_VERSION_JSON = 1
+WIRE_VERSION_COMPACT = 2
+WIRE_VERSIONS = (WIRE_VERSION_JSON, WIRE_VERSION_COMPACT)
+
+# Schema of the sensor message built in drive.py - append only, the position of a field is its bit in the mask
+SENSOR_FIELDS = (
+    ("timestampMs",),
+    ("carId",),
+    ("carState", "color"),
+    ("carState", "batteryLeft"),
+    ("carState", "ballsCollected"),
+    ("carState", "obstacleFound"),
+    ("sensors", "frontLaserDistanceMm"),
+    ("sensors", "frontCameraImagePath"),
+    ("sensors", "frontCameraImagePathGCS"),
+    ("sensors", "traceId"),
+)
+
+# Schema of the driving command built by the controller, see drive-message.js - append only
+COMMAND_FIELDS = (
+    ("cloudTimestampMs",),
+    ("carTimestampMs",),
+    ("mode",),
+    ("sensorRate",),
+    ("ballCaptured",),
+    ("goal",),
+    ("actions",),
+)
+
+# Action names sent as their index in this tuple - append only; other names are sent as they are
+ACTION_CODES = ("driveForwardMm", "driveBackwardMm", "turnRight", "turnLeft", "setSpeed",
+                "gripperPosition", "takePhoto", "sendSensorMessage", "setColor")
+
+_COMPACT_SEPARATORS = (',', ':')
+
+
+class _Schema(object):
+    """Fields of a message schema, prepared for packing and unpacking."""
+
+    def __init__(self, fields):
+        # (bit, key, key within the group or None) for every field
+        self.fields = [(1 << i, path[0], path[1] if len(path) == 2 else None) for i, path in enumerate(fields)]
+        self.top_level = set(path[0] for path in fields if len(path) == 1)
+        self.groups = {}
+        for path in fields:
+            if len(path) == 2:
+                self.groups.setdefault(path[0], set()).add(path[1])
+
+    def pack(self, message):
+        """Returns [mask, values..., extras] for a message dict, without extras if there are none."""
+        mask = 0
+        values = []
+        for bit, key, subkey in self.fields:
+            if subkey is None:
+                if key in message:
+                    mask |= bit
+                    values.append(message[key])
+            else:
+                group = message.get(key)
+                if isinstance(group, dict) and subkey in group:
+                    mask |= bit
+                    values.append(group[subkey])
+        extras = {}
+        for key, value in message.items():
+            if key in self.groups and isinstance(value, dict):
+                others = dict((k, v) for k, v in value.items() if k not in self.groups[key])
+                # An empty group is kept, the decoder only recreates groups that hold schema fields
+                if others or not value:
+                    extras[key] = others
+            elif key not in self.top_level:
+                extras[key] = value
+        packed = [mask] + values
+        if extras:
+            packed.append(extras)
+        return packed
+
+    def unpack(self, packed):
+        """Returns the message dict of [mask, values..., extras]. Raises ValueError if they do not fit together."""
+        mask = packed[0]
+        if not isinstance(mask, six.integer_types) or isinstance(mask, bool) or mask < 0:
+            raise ValueError("Invalid field mask: {!r}".format(mask))
+        if mask >> len(self.fields):
+            raise ValueError("Field mask {} has bits outside the schema".format(mask))
+        message = {}
+        position = 1
+        for bit, key, subkey in self.fields:
+            if mask & bit:
+                if position >= len(packed):
+                    raise ValueError("Field mask {} needs more values than the {} given".format(mask, len(packed) - 1))
+                if subkey is None:
+                    message[key] = packed[position]
+                else:
+                    message.setdefault(key, {})[subkey] = packed[position]
+                position += 1
+        if position < len(packed):
+            if position + 1 < len(packed) or not isinstance(packed[position], dict):
+                raise ValueError("Unexpected values after the fields of mask {}: {!r}".format(mask, packed[position:]))
+            for key, value in packed[position].items():
+                if isinstance(value, dict) and isinstance(message.get(key), dict):
+                    message[key].update(value)
+                else:
+                    message[key] = value
+        return message
+
+
+_SENSOR_SCHEMA = _Schema(SENSOR_FIELDS)
+_COMMAND_SCHEMA = _Schema(COMMAND_FIELDS)
+
+
+def _pack_actions(actions):
+    flat = []
+    for action in actions:
+        for name, value in action.items():
+            flat.append(ACTION_CODES.index(name) if name in ACTION_CODES else name)
+            flat.append(value)
+    return flat
+
+
+def _unpack_actions(flat):
+    if not isinstance(flat, list) or len(flat) % 2:
+        raise ValueError("Actions are not a list of code and value pairs: {!r}".format(flat))
+    actions = []
+    for i in range(0, len(flat), 2):
+        code = flat[i]
+        if isinstance(code, six.string_types):
+            name = code
+        elif isinstance(code, six.integer_types) and not isinstance(code, bool) and 0 <= code < len(ACTION_CODES):
+            name = ACTION_CODES[code]
+        else:
+            raise ValueError("Unknown action code: {!r}".format(code))
+        actions.append({name: flat[i + 1]})
+    return actions
+
+
+def _loads(payload):
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf8')
+    value = json.loads(payload)
+    # JSON text may arrive encoded as a JSON string once more
+    if isinstance(value, six.string_types):
+        value = json.loads(value)
+    return value
+
+
+def _decode(payload, schema):
+    """Returns (version, message dict) of a payload in any supported version."""
+    value = _loads(payload)
+    if isinstance(value, dict):
+        return WIRE_VERSION_JSON, value
+    if isinstance(value, list) and len(value) >= 2:
+        if value[0] == WIRE_VERSION_COMPACT:
+            return WIRE_VERSION_COMPACT, schema.unpack(value[1:])
+        raise ValueError("Unsupported wire format version: {}".format(value[0]))
+    raise ValueError("Not a message in any known wire format")
+
+
+def encode_sensor_message(data, version=WIRE_VERSION_JSON):
+    """Returns the MQTT payload for a sensor message dict."""
+    if version == WIRE_VERSION_COMPACT:
+        return json.dumps([WIRE_VERSION_COMPACT] + _SENSOR_SCHEMA.pack(data), separators=_COMPACT_SEPARATORS).encode('utf8')
+    # The cloud side expects the JSON document itself to be JSON encoded once more
+    envelope = json.dumps(data)
+    return json.dumps(envelope).encode('utf8')
+
+
+def decode_sensor_message(payload):
+    """Returns (version, sensor message dict). Raises ValueError for payloads in no known format."""
+    return _decode(payload, _SENSOR_SCHEMA)
+
+
+def encode_command(command, version=WIRE_VERSION_JSON):
+    """Returns the Pub/Sub data of a driving command as the car receives it from the controller."""
+    if version == WIRE_VERSION_COMPACT:
+        command = dict(command)
+        if "actions" in command:
+            command["actions"] = _pack_actions(command["actions"])
+        text = json.dumps([WIRE_VERSION_COMPACT] + _COMMAND_SCHEMA.pack(command), separators=_COMPACT_SEPARATORS)
+    else:
+        text = json.dumps(command)
+    # The controller's Pub/Sub client JSON encodes the text it is given once more
+    return json.dumps(text).encode('utf8')
+
+
+def decode_command(payload):
+    """Returns (version, driving command dict). Raises ValueError for payloads in no known format."""
+    version, command = _decode(payload, _COMMAND_SCHEMA)
+    if version == WIRE_VERSION_COMPACT and "actions" in command:
+        command["actions"] = _unpack_actions(command["actions"])
+    # The car iterates over the actions and their names, so the shape is checked for every version
+    actions = command.get("actions", [])
+    if not isinstance(actions, list) or not all(isinstance(action, dict) for action in actions):
+        raise ValueError("Actions are not a list of objects: {!r}".format(actions))
+    return version, command
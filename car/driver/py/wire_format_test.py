@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tests for wire_format.py. The controller side is tested in
+cloud/controller/js/tests/wire_format_tests.js .
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import json
+import unittest
+
+from wire_format import WIRE_VERSION_COMPACT
+from wire_format import WIRE_VERSION_JSON
+from wire_format import decode_command
+from wire_format import decode_sensor_message
+from wire_format import encode_command
+from wire_format import encode_sensor_message
+
+# Same message as in wire_format_tests.js, including a field outside the schema
+SENSOR_MESSAGE = {
+    "timestampMs": 1519509836918,
+    "carId": "1",
+    "carState": {"color": "Red", "batteryLeft": 9.61, "ballsCollected": 2},
+    "sensors": {
+        "frontLaserDistanceMm": None,
+        "frontCameraImagePath": "https://storage.googleapis.com/robot-derby-camera-1/image8.jpg",
+        "frontCameraImagePathGCS": "gs://robot-derby-camera-1/image8.jpg",
+        "traceId": "1-3f9c0a7be214"
+    },
+    "streamStats": {"fps": 1.75}
+}
+
+COMMAND = {
+    "cloudTimestampMs": 1792199293942,
+    "mode": "automatic",
+    "sensorRate": "onDemand",
+    "actions": [{"turnRight": 22}, {"driveForwardMm": 450}, {"gripperPosition": "close"}, {"sendSensorMessage": "true"}],
+    "ballCaptured": 1
+}
+
+# COMMAND as encoded by wire-format.js and sent through the controller's Pub/Sub client
+COMPACT_COMMAND_FROM_CONTROLLER = json.dumps('[2,93,1792199293942,"automatic","onDemand",1,[2,22,0,450,5,"close",7,"true"]]')
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def test_sensor_message_round_trip(self):
+        for version in (WIRE_VERSION_JSON, WIRE_VERSION_COMPACT):
+            self.assertEqual(decode_sensor_message(encode_sensor_message(SENSOR_MESSAGE, version)), (version, SENSOR_MESSAGE))
+
+    def test_command_round_trip(self):
+        for version in (WIRE_VERSION_JSON, WIRE_VERSION_COMPACT):
+            self.assertEqual(decode_command(encode_command(COMMAND, version)), (version, COMMAND))
+
+    def test_compact_is_smaller(self):
+        self.assertLess(len(encode_sensor_message(SENSOR_MESSAGE, WIRE_VERSION_COMPACT)),
+                        len(encode_sensor_message(SENSOR_MESSAGE, WIRE_VERSION_JSON)))
+        self.assertLess(len(encode_command(COMMAND, WIRE_VERSION_COMPACT)), len(encode_command(COMMAND, WIRE_VERSION_JSON)))
+
+    def test_decodes_controller_encoding(self):
+        self.assertEqual(decode_command(COMPACT_COMMAND_FROM_CONTROLLER), (WIRE_VERSION_COMPACT, COMMAND))
+        self.assertEqual(encode_command(COMMAND, WIRE_VERSION_COMPACT), COMPACT_COMMAND_FROM_CONTROLLER.encode('utf8'))
+
+    def test_empty_groups_survive(self):
+        message = {"timestampMs": 1, "carState": {}, "sensors": {"traceId": "x"}}
+        self.assertEqual(decode_sensor_message(encode_sensor_message(message, WIRE_VERSION_COMPACT))[1], message)
+
+    def test_malformed_payloads_raise_value_error(self):
+        malformed = [
+            b'\xff\xfe',                # not UTF-8
+            '{"cloudTimestampMs": 1',   # not JSON
+            '"[2,1"',                   # not JSON inside the JSON string
+            '5', 'null', '[2]',         # no message
+            '[7,1,2]',                  # unknown version
+            '[2,1]',                    # mask needs more values than there are
+            '[2,"1",5]', '[2,true,5]', '[2,-1,5]',  # invalid masks
+            '[2,1048576,5]',            # bits outside the schema
+            '[2,1,0,[99,5]]',           # extras that are not an object
+            '[2,1,0,{},{}]',            # values after the extras
+            '[2,64,[99,5]]',            # unknown action code
+            '[2,64,[true,5]]',
+            '[2,64,[0]]',               # action code without value
+            '[2,64,5]',                 # actions not a list
+            '{"actions": 5}',           # version 1 actions not a list
+            '{"actions": [5]}',         # version 1 action not an object
+        ]
+        for payload in malformed:
+            self.assertRaises(ValueError, decode_command, payload)
+        for payload in ('[2,1]', '[2,1,0,[99,5]]', '[2,2048,1]'):
+            self.assertRaises(ValueError, decode_sensor_message, payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
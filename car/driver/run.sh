@@ -40,6 +40,37 @@ export CAR_CAMERA_NORMAL="0"
 ### What color ball this car will be playing (default value)
 export CAR_COLOR="red"
 
+### Shrinking of camera frames before upload to keep payloads small over venue Wi-Fi
+### JPEG quality to re-encode with (1-95); 0 uploads frames as the camera produced them
+export IMAGE_UPLOAD_QUALITY="0"
+### Scale relative to HORIZONTAL_RESOLUTION_PIXELS x VERTICAL_RESOLUTION_PIXELS; 1.0 keeps the full resolution
+export IMAGE_UPLOAD_SCALE="1.0"
+
+### Continuous streaming of sensor messages (sensorRate 'continuous')
+### The frame rate backs off from STREAM_TARGET_FPS down to STREAM_MIN_FPS while uploads or MQTT PUBACKs fall behind
+export STREAM_TARGET_FPS="2"
+export STREAM_MIN_FPS="0.2"
+### Published messages that may wait for a PUBACK before the stream pauses
+export STREAM_MAX_IN_FLIGHT="2"
+
+### Car hardware: "gopigo3" for the real car, "simulated" to run the driver headless with a simulated car and camera
+export CAR_HARDWARE="gopigo3"
+### How much faster than real time the simulated car runs
+export CAR_SIMULATION_SPEEDUP="1.0"
+
+### Consecutive drive and turn actions of a command run as one motion plan; the next move takes over this many
+### encoder degrees before the current one ends (0 lets every move come to a stop first). Blending saves little time
+### and ends moves a few cm off (see motion_plan.py), try 10 for smoother driving
+export MOTION_BLEND_DEGREES="0"
+
+### Wire format of sensor messages: 1 is double-encoded JSON, 2 is the compact format (needs a controller that knows it)
+### The controller answers with commands in the format the car used
+export WIRE_FORMAT_VERSION="1"
+
+### Per-stage latency histograms (capture, upload, publish, command to motion, ...) in the Prometheus text format,
+### rewritten every 10 seconds; empty to not write them
+export TRACE_METRICS_FILE="/tmp/cloud-derby-car-metrics.prom"
+
 ###############################################
 # This is run once after creating new environment
 ###############################################
@@ -0,0 +1,56 @@
+#!/bin/bash
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+###############################################
+# Fleet load generator
+#
+# Replays recorded camera frames from many simulated cars against the Inference VM
+# and reports throughput, latency percentiles and error rates per number of cars.
+# Frames are served from a local GCS stand-in - start the inference app with
+# STORAGE_EMULATOR_HOST=http://<this machine>:$LOADGEN_GCS_PORT so it reads them from here.
+#
+# Usage: ./loadgen.sh [extra loadgen.py options, e.g. --real-gcs]
+###############################################
+
+set -u # This prevents running the script if any of the variables have not been set
+set -e # Exit if error is detected during pipeline execution
+
+source ../../setenv-global.sh
+print_header "Fleet load generator"
+
+# Address of the Inference VM, e.g. as reserved in cloud/ml/inference
+export INFERENCE_IP=${INFERENCE_IP:-localhost}
+# Numbers of simultaneous cars to test, one run each
+LOADGEN_CARS="1,5,10,20"
+# Highest frame rate of each simulated car
+LOADGEN_FPS="1"
+# Seconds to run each number of cars
+LOADGEN_DURATION_SEC="30"
+# Recorded camera frames to replay
+LOADGEN_FRAMES=$(pwd)/js/simulation-images
+LOADGEN_GCS_PORT="9023"
+
+mkdir -p tmp
+export GOOGLE_APPLICATION_CREDENTIALS=${SERVICE_ACCOUNT_SECRET}
+
+cd py
+./loadgen.py --inference-host http://$INFERENCE_IP:$HTTP_PORT --cars $LOADGEN_CARS --fps $LOADGEN_FPS \
+    --duration $LOADGEN_DURATION_SEC --frames $LOADGEN_FRAMES --gcs-port $LOADGEN_GCS_PORT \
+    --output ../tmp/loadgen-results.json "$@"
+
+print_footer "Fleet load generator has completed. Results are in tmp/loadgen-results.json"
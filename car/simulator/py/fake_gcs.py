@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Local stand-in for Google Cloud Storage, for load tests that should not touch
+a real bucket. It keeps objects in memory and serves the small part of the GCS
+JSON API the Cloud Derby components use: media uploads and object downloads.
+Point the inference app at it with STORAGE_EMULATOR_HOST=http://<host>:<port>.
+"""
+
+import json
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import quote
+from six.moves.urllib.parse import unquote
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import Request
+from six.moves.urllib.request import urlopen
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _GcsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        # One line per request would drown the load test report
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self):
+        self._reply(404, json.dumps({"error": {"code": 404, "message": "No such object"}}).encode('utf8'))
+
+    def _object_path(self, path):
+        """Returns (bucket, object name) for /[download/]storage/v1/b/<bucket>/o/<name>, None otherwise."""
+        parts = path.split('/')
+        if parts[1:2] == ['download']:
+            parts = parts[1:]
+        if len(parts) < 7 or parts[1:4] != ['storage', 'v1', 'b'] or parts[5] != 'o':
+            return None
+        return parts[4], unquote('/'.join(parts[6:]))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = url.path.split('/')
+        query = parse_qs(url.query)
+        # /upload/storage/v1/b/<bucket>/o?uploadType=media&name=<name>
+        if len(parts) != 7 or parts[1:5] != ['upload', 'storage', 'v1', 'b'] or parts[6] != 'o' or 'name' not in query:
+            self._reply(400, json.dumps({"error": {"code": 400, "message": "Only media uploads are supported"}}).encode('utf8'))
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        bucket, name = parts[5], query['name'][0]
+        self.server.store.put(bucket, name, body)
+        self._reply(200, json.dumps({"bucket": bucket, "name": name, "size": str(len(body))}).encode('utf8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        object_path = self._object_path(url.path)
+        if object_path is None:
+            self._not_found()
+            return
+        body = self.server.store.get(*object_path)
+        if body is None:
+            self._not_found()
+        elif url.path.startswith('/download/') or 'media' in parse_qs(url.query).get('alt', []):
+            self._reply(200, body, 'application/octet-stream')
+        else:
+            bucket, name = object_path
+            self._reply(200, json.dumps({"bucket": bucket, "name": name, "size": str(len(body))}).encode('utf8'))
+
+
+class ObjectStore(object):
+    """In-memory objects, keyed by (bucket, name)."""
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.downloads = 0
+
+    def put(self, bucket, name, body):
+        with self._lock:
+            self._objects[(bucket, name)] = body
+            self.uploads += 1
+
+    def get(self, bucket, name):
+        with self._lock:
+            body = self._objects.get((bucket, name))
+            if body is not None:
+                self.downloads += 1
+            return body
+
+
+class LocalGcsServer(object):
+    """
+    Serves an ObjectStore over HTTP on a background thread.
+    : host, port: where to listen; port 0 picks a free port
+    """
+
+    def __init__(self, host='0.0.0.0', port=0):
+        self.store = ObjectStore()
+        self._server = _ThreadingHTTPServer((host, port), _GcsRequestHandler)
+        self._server.store = self.store
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='local-gcs')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalGcsBlob(object):
+    """Blob on a LocalGcsServer with the parts of google.cloud.storage.Blob that ImageUploader uses."""
+
+    def __init__(self, endpoint, bucket_name, name):
+        self.endpoint = endpoint
+        self.bucket_name = bucket_name
+        self.name = name
+        self.path = '/b/{}/o/{}'.format(bucket_name, name)
+        self.public_url = '{}/download/storage/v1/b/{}/o/{}?alt=media'.format(endpoint, bucket_name, quote(name, safe=''))
+
+    def upload_from_string(self, data, content_type='application/octet-stream'):
+        url = '{}/upload/storage/v1/b/{}/o?uploadType=media&name={}'.format(self.endpoint, self.bucket_name, quote(self.name, safe=''))
+        request = Request(url, data=data, headers={'Content-Type': content_type})
+        urlopen(request).read()
+
+
+class LocalGcsBucket(object):
+    """
+    Bucket on a LocalGcsServer, a stand-in for google.cloud.storage.Bucket in ImageUploader.
+    : endpoint: base URL of the server, e.g. http://localhost:9023
+    """
+
+    def __init__(self, endpoint, bucket_name):
+        self.endpoint = endpoint.rstrip('/')
+        self.name = bucket_name
+
+    def blob(self, name):
+        return LocalGcsBlob(self.endpoint, self.name, name)
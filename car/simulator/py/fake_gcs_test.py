@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Checks the local GCS stand-in against the calls made to the real service: the
+car's ImageUploader uploading through LocalGcsBucket, and downloads the way the
+google-cloud-storage client makes them for the inference app. When that client
+is installed, it is also run against the stand-in via STORAGE_EMULATOR_HOST.
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import json
+import os
+import sys
+import unittest
+
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import Request
+from six.moves.urllib.request import urlopen
+
+from fake_gcs import LocalGcsBucket
+from fake_gcs import LocalGcsServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'driver', 'py'))
+from uploader import ImageUploader
+
+try:
+    from google.cloud import storage
+except ImportError:
+    storage = None
+
+JPEG_BYTES = b'\xff\xd8 not really a frame \xff\xd9'
+
+
+class LocalGcsServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalGcsServer(host='127.0.0.1')
+        self.server.start()
+        self.endpoint = 'http://127.0.0.1:{}'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_image_uploader_round_trip(self):
+        uploader = ImageUploader(LocalGcsBucket(self.endpoint, 'derby-frames'))
+        gcs_url, public_url = uploader.upload('image2018-10-17 101010.jpg', JPEG_BYTES, verbose=False)
+
+        self.assertEqual(gcs_url, 'gs://derby-frames/image2018-10-17 101010.jpg')
+        self.assertEqual(self.server.store.get('derby-frames', 'image2018-10-17 101010.jpg'), JPEG_BYTES)
+        self.assertEqual(urlopen(public_url).read(), JPEG_BYTES)
+        self.assertEqual(uploader.stats()["uploads"], 1)
+
+    def test_downloads_like_the_storage_client(self):
+        self.server.store.put('derby-frames', 'car1/image 1.jpg', JPEG_BYTES)
+        # Media downloads, with and without the /download prefix, and metadata requests
+        media = urlopen(self.endpoint + '/download/storage/v1/b/derby-frames/o/car1%2Fimage%201.jpg?alt=media').read()
+        self.assertEqual(media, JPEG_BYTES)
+        media = urlopen(self.endpoint + '/storage/v1/b/derby-frames/o/car1%2Fimage%201.jpg?alt=media').read()
+        self.assertEqual(media, JPEG_BYTES)
+        metadata = json.loads(urlopen(self.endpoint + '/storage/v1/b/derby-frames/o/car1%2Fimage%201.jpg').read().decode('utf8'))
+        self.assertEqual(metadata, {"bucket": "derby-frames", "name": "car1/image 1.jpg", "size": str(len(JPEG_BYTES))})
+
+    def test_missing_object_is_404(self):
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(self.endpoint + '/download/storage/v1/b/derby-frames/o/missing.jpg?alt=media')
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_unsupported_upload_is_400(self):
+        request = Request(self.endpoint + '/upload/storage/v1/b/derby-frames/o?uploadType=resumable', data=JPEG_BYTES)
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(request)
+        self.assertEqual(raised.exception.code, 400)
+
+    @unittest.skipIf(storage is None, "google-cloud-storage is not installed")
+    def test_storage_client_download(self):
+        # The inference app's GcsImageFetcher: bucket(name).blob(path).download_as_string()
+        self.server.store.put('derby-frames', 'car1/image1.jpg', JPEG_BYTES)
+        previous_host = os.environ.get('STORAGE_EMULATOR_HOST')
+        os.environ['STORAGE_EMULATOR_HOST'] = self.endpoint
+        try:
+            client = storage.Client.create_anonymous_client()
+            self.assertEqual(client.bucket('derby-frames').blob('car1/image1.jpg').download_as_string(), JPEG_BYTES)
+        finally:
+            if previous_host is None:
+                del os.environ['STORAGE_EMULATOR_HOST']
+            else:
+                os.environ['STORAGE_EMULATOR_HOST'] = previous_host
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Fleet load generator for the inference VM. Simulated cars replay recorded
+camera frames the way drive.py sends them: each frame is uploaded to storage,
+a sensor message with the carState and sensors dictionaries is published, and
+the image is then sent to the inference app the way the driving controller
+does (GET INFERENCE_URL?gcs_uri=...).
+
+Storage is a local GCS stand-in (start the inference app with
+STORAGE_EMULATOR_HOST pointing at it) or a real bucket; MQTT is an in-process
+stand-in. Each concurrency level runs for a fixed time and reports throughput,
+p50/p95/p99 latency and error rates.
+"""
+
+import argparse
+import base64
+import glob
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.parse import quote
+from six.moves.urllib.request import Request
+from six.moves.urllib.request import urlopen
+
+from fake_gcs import LocalGcsBucket
+from fake_gcs import LocalGcsServer
+
+# The sensor message format and the uploader are shared with the car driver
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'driver', 'py'))
+from uploader import ImageUploader
+from uploader import image_file_name_for
+from wire_format import decode_sensor_message
+from wire_format import encode_sensor_message
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile (0-100) of an ascending list, None if it is empty."""
+    if not sorted_values:
+        return None
+    rank = int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+
+class LocalMqttBroker(object):
+    """In-process stand-in for the IoT Core MQTT bridge - keeps count of what the cars publish."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+
+    def publish(self, topic, payload):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(payload)
+        # Decoded like the driving controller does once it receives the payload through Pub/Sub
+        return decode_sensor_message(payload)[1]
+
+
+class InferenceClient(object):
+    """
+    Calls the inference app like the driving controller does, see vision.js .
+    : base_url: e.g. http://10.0.0.2:8082
+    """
+
+    def __init__(self, base_url, inference_url, user, password, timeout=60):
+        self.url = base_url.rstrip('/') + inference_url
+        credentials = '{}:{}'.format(user, password).encode('utf8')
+        self.auth_header = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+        self.timeout = timeout
+
+    def detect(self, gcs_uri):
+        """Returns the HTTP status code, 0 if the request failed without a response."""
+        request = Request(self.url + '?gcs_uri=' + quote(gcs_uri, safe=''), headers={'Authorization': self.auth_header})
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            json.loads(response.read().decode('utf8'))
+            return response.getcode()
+        except HTTPError as e:
+            return e.code
+        except (IOError, socket.timeout, ValueError):
+            return 0
+
+
+class LevelStats(object):
+    """Results of one concurrency level, shared by its cars."""
+
+    def __init__(self, cars):
+        self.cars = cars
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.end_to_end = []
+        self.statuses = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, status, inference_seconds, end_to_end_seconds):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(inference_seconds)
+                self.end_to_end.append(end_to_end_seconds)
+
+    def summary(self):
+        requests = sum(self.statuses.values())
+        ok = self.statuses.get(200, 0)
+        rejected = self.statuses.get(503, 0)
+        elapsed = self.finished - self.started
+        latencies = sorted(self.latencies)
+        end_to_end = sorted(self.end_to_end)
+
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "cars": self.cars,
+            "requests": requests,
+            "throughput": round(ok / elapsed, 2) if elapsed > 0 else None,
+            "p50Ms": ms(percentile(latencies, 50)),
+            "p95Ms": ms(percentile(latencies, 95)),
+            "p99Ms": ms(percentile(latencies, 99)),
+            "endToEndP95Ms": ms(percentile(end_to_end, 95)),
+            "errorRate": round(float(requests - ok) / requests, 4) if requests else None,
+            "rejectedRate": round(float(rejected) / requests, 4) if requests else None,
+            "statuses": dict((str(k), v) for k, v in self.statuses.items()),
+        }
+
+
+class SimulatedCar(object):
+    """
+    Replays frames like a car with sensorRate 'onDemand' that is sent a driving command for every frame:
+    the next frame is sent once the previous one got its inference result, but no faster than fps.
+    """
+
+    def __init__(self, car_id, frames, fps, uploader, broker, inference, stats, wire_version, name_prefix):
+        self.car_id = car_id
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self.uploader = uploader
+        self.broker = broker
+        self.inference = inference
+        self.stats = stats
+        self.wire_version = wire_version
+        # Object names start with this, e.g. 'loadgen/<run id>/cars10/'
+        self.name_prefix = name_prefix
+        self.balls_collected = 0
+
+    def _sensor_message(self):
+        # Same layout as the message built in drive.py
+        carState = {}
+        carState["color"] = "Red"
+        carState["batteryLeft"] = 9.6
+        carState["ballsCollected"] = self.balls_collected
+        sensors = {}
+        sensors["frontLaserDistanceMm"] = 1000
+        data = {}
+        data["timestampMs"] = int(time.time() * 1000)
+        data["carId"] = self.car_id
+        data["carState"] = carState
+        data["sensors"] = sensors
+        return data
+
+    def run(self, deadline):
+        sequence = 0
+        next_frame = time.time()
+        while time.time() < deadline:
+            wait = next_frame - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            next_frame = time.time() + self.interval
+            jpeg_bytes = self.frames[sequence % len(self.frames)]
+            sequence += 1
+
+            captured = time.time()
+            data = self._sensor_message()
+            # Names unique to the run, the level and the car, so the inference app's result cache never answers for a replayed frame
+            image_file_name = "{}car{}-{}".format(self.name_prefix, self.car_id, image_file_name_for(sequence))
+            try:
+                gcs_url, public_url = self.uploader.upload(image_file_name, jpeg_bytes, verbose=False)
+            except Exception as e:
+                print("SimulatedCar {}: upload failed: {}".format(self.car_id, e))
+                self.stats.record('upload', None, None)
+                continue
+            data["sensors"]["frontCameraImagePath"] = public_url
+            data["sensors"]["frontCameraImagePathGCS"] = gcs_url
+            message = self.broker.publish('/devices/car{}/events/sensor'.format(self.car_id), encode_sensor_message(data, self.wire_version))
+
+            request_start = time.time()
+            status = self.inference.detect(message["sensors"]["frontCameraImagePathGCS"])
+            done = time.time()
+            self.stats.record(status, done - request_start, done - captured)
+
+
+def load_frames(frames_dir):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(frames_dir, '*.jpg'))):
+        with open(path, 'rb') as image_file:
+            frames.append(image_file.read())
+    return frames
+
+
+def run_level(cars, duration, fps, frames, uploader, broker, inference, wire_version, run_id):
+    stats = LevelStats(cars)
+    name_prefix = "loadgen/{}/cars{}/".format(run_id, cars)
+    car_threads = []
+    stats.started = time.time()
+    deadline = stats.started + duration
+    for car_id in range(1, cars + 1):
+        car = SimulatedCar(car_id, frames, fps, uploader, broker, inference, stats, wire_version, name_prefix)
+        thread = threading.Thread(target=car.run, args=(deadline,), name='car-{}'.format(car_id))
+        thread.daemon = True
+        thread.start()
+        car_threads.append(thread)
+    for thread in car_threads:
+        thread.join()
+    stats.finished = time.time()
+    return stats.summary()
+
+
+def print_report(results):
+    print("")
+    print("{:>5} {:>9} {:>10} {:>9} {:>9} {:>9} {:>12} {:>8} {:>9}".format(
+        "cars", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "e2e p95 ms", "errors", "rejected"))
+    for result in results:
+        print("{:>5} {:>9} {:>10} {:>9} {:>9} {:>9} {:>12} {:>7.1%} {:>8.1%}".format(
+            result["cars"], result["requests"], result["throughput"], result["p50Ms"], result["p95Ms"], result["p99Ms"],
+            result["endToEndP95Ms"], result["errorRate"] or 0, result["rejectedRate"] or 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inference-host', required=True, help='http://<inference VM IP>:<HTTP_PORT>')
+    parser.add_argument('--inference-url', default=os.environ.get('INFERENCE_URL', '/v1/objectInference'))
+    parser.add_argument('--user', default=os.environ.get('INFERENCE_USER_NAME'))
+    parser.add_argument('--password', default=os.environ.get('INFERENCE_PASSWORD'))
+    parser.add_argument('--frames', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'js', 'simulation-images'),
+                        help='directory with recorded *.jpg camera frames')
+    parser.add_argument('--cars', default='1,5,10,20', help='comma separated numbers of simultaneous cars, one level each')
+    parser.add_argument('--fps', type=float, default=1.0, help='highest frame rate of each car')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run each level')
+    parser.add_argument('--bucket', default='cloud-derby-loadgen', help='bucket name to upload frames to')
+    parser.add_argument('--real-gcs', action='store_true', help='upload frames to the real GCS bucket instead of the local stand-in')
+    parser.add_argument('--gcs-port', type=int, default=9023, help='port of the local GCS stand-in')
+    parser.add_argument('--gcs-advertised-host', default='localhost',
+                        help='host name of this machine as seen by the inference VM, for STORAGE_EMULATOR_HOST')
+    parser.add_argument('--wire-version', type=int, default=1, help='wire format of the sensor messages, see wire_format.py')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    if not frames:
+        print("No *.jpg frames found in '{}'".format(args.frames))
+        sys.exit(1)
+    print("Loaded {} frames from '{}'".format(len(frames), args.frames))
+
+    gcs_server = None
+    if args.real_gcs:
+        # Imported here so the local stand-in works without the Cloud client libraries
+        from google.cloud import storage
+        bucket = storage.Client().bucket(args.bucket)
+    else:
+        gcs_server = LocalGcsServer(port=args.gcs_port)
+        gcs_server.start()
+        bucket = LocalGcsBucket('http://localhost:{}'.format(gcs_server.port), args.bucket)
+        print("Local GCS stand-in listening - the inference app needs STORAGE_EMULATOR_HOST=http://{}:{}".format(
+            args.gcs_advertised_host, gcs_server.port))
+
+    uploader = ImageUploader(bucket)
+    broker = LocalMqttBroker()
+    inference = InferenceClient(args.inference_host, args.inference_url, args.user, args.password)
+
+    # Every run uploads under its own prefix - names repeated from an earlier run or level would be answered from the
+    # inference app's result cache without a GCS download or a model run
+    run_id = "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:6])
+    results = []
+    for cars in [int(level) for level in args.cars.split(',')]:
+        print("Running {} cars at up to {} fps for {} seconds...".format(cars, args.fps, args.duration))
+        result = run_level(cars, args.duration, args.fps, frames, uploader, broker, inference, args.wire_version, run_id)
+        print(json.dumps(result, sort_keys=True))
+        results.append(result)
+
+    print_report(results)
+    print("Uploads: {}  MQTT messages: {}  bytes per message: {:.0f}".format(
+        uploader.stats()["uploads"], broker.messages, float(broker.bytes) / max(broker.messages, 1)))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    if gcs_server is not None:
+        gcs_server.stop()
@@ -36,6 +36,7 @@ const DEBUG_MODE = require('./drive-message').DEBUG_MODE;
 
 // Import the validation functions for the API
 const validate = require('./validate');
+const wireFormat = require('./wire-format');
 const DRIVING_MESSAGE_PARAMS = require('./validate').DRIVING_MESSAGE_PARAMS;
 const BALL_COLORS = require('./validate').BALL_COLORS;
 const DRIVING_MODES = require('./validate').DRIVING_MODES;
@@ -98,6 +99,8 @@ const MAX_OUTBOUND_HISTORY = 60 * 60;
 let nextDrivingCommand;
 // Current driving mode of the car
 let currentDrivingMode = MANUAL_MODE;
+// Wire format of the most recent message from the car - commands are sent in the same format
+let carWireVersion = wireFormat.WIRE_VERSION_JSON;
 // Initialize Navigation logic
 let navigation = new Navigation(outboundMsgHistory);
 
@@ -118,7 +121,19 @@ const inboundMessageHandler = function (message) {
   totalMessagesReceived++;
   console.log("inboundMessageHandler(carId=" + carId + "): <<<--------------- Received " + totalMessagesReceived + " messages");
   
-  let data = JSON.parse(message.data);
+  let data;
+  try {
+    let decoded = wireFormat.decodeSensorMessage(message.data);
+    data = decoded.message;
+    carWireVersion = decoded.version;
+  } catch (error) {
+    totalErrors++;
+    rejectedFormatMessages++;
+    console.error("ERROR: inboundMessageHandler(): Skipping this message since it could not be decoded: " + error);
+    return;
+  }
+  // Message history pages read the sensor data as JSON text, whatever wire format the car used
+  message.data = JSON.stringify(data);
   // Ignore invalid messages
   if (!isMessageValid(data)) {
     totalErrors++;
@@ -157,7 +172,7 @@ function publishCommand(command) {
     console.log("publishCommand(): Command is not defined - ignoring");
     return;
   }
-  let txtMessage = JSON.stringify(command);
+  let txtMessage = wireFormat.encodeCommand(command, carWireVersion);
   // Only send a message when it is not empty
   if (txtMessage.length > 0) {
     command_topic.publish(txtMessage, (err) => {
@@ -0,0 +1,76 @@
+/**
+ * Copyright 2018, Google, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+var chai = require('chai');
+
+const wireFormat = require('../wire-format');
+const DriveMessage = require('../drive-message').DriveMessage;
+
+var expect = chai.expect;
+
+const SENSOR_MESSAGE = {
+  "timestampMs": 1519509836918,
+  "carId": "1",
+  "carState": {"color": "Red", "batteryLeft": 9.61, "ballsCollected": 2},
+  "sensors": {
+    "frontLaserDistanceMm": null,
+    "frontCameraImagePath": "https://storage.googleapis.com/robot-derby-camera-1/image8.jpg",
+    "frontCameraImagePathGCS": "gs://robot-derby-camera-1/image8.jpg",
+    "traceId": "1-3f9c0a7be214"
+  },
+  "streamStats": {"fps": 1.75}
+};
+
+describe('Wire format', function() {
+
+  it('decodes double-encoded JSON sensor messages as version 1', function() {
+    var decoded = wireFormat.decodeSensorMessage(wireFormat.encodeSensorMessage(SENSOR_MESSAGE, wireFormat.WIRE_VERSION_JSON));
+    expect(decoded.version).to.be.equal(wireFormat.WIRE_VERSION_JSON);
+    expect(decoded.message).to.deep.equal(SENSOR_MESSAGE);
+  });
+
+  it('decodes compact sensor messages from a Buffer, a string or parsed JSON', function() {
+    var text = wireFormat.encodeSensorMessage(SENSOR_MESSAGE, wireFormat.WIRE_VERSION_COMPACT);
+    [Buffer.from(text), text, JSON.parse(text)].forEach(function(data) {
+      var decoded = wireFormat.decodeSensorMessage(data);
+      expect(decoded.version).to.be.equal(wireFormat.WIRE_VERSION_COMPACT);
+      expect(decoded.message).to.deep.equal(SENSOR_MESSAGE);
+    });
+  });
+
+  it('encodes commands in the compact format smaller and without losing fields', function() {
+    var command = new DriveMessage();
+    command.setModeAutomatic();
+    command.turnRight(22);
+    command.driveForward(450);
+    command.gripperClose();
+    command.sendSensorMessage();
+    command.addBallCount();
+    var json = wireFormat.encodeCommand(command, wireFormat.WIRE_VERSION_JSON);
+    var compact = wireFormat.encodeCommand(command, wireFormat.WIRE_VERSION_COMPACT);
+    expect(json).to.be.equal(JSON.stringify(command));
+    expect(compact.length).to.be.below(json.length);
+    var decoded = wireFormat.decodeCommand(compact);
+    expect(decoded.version).to.be.equal(wireFormat.WIRE_VERSION_COMPACT);
+    expect(decoded.message).to.deep.equal(JSON.parse(json));
+  });
+
+  it('rejects unknown versions', function() {
+    expect(function() {
+      wireFormat.decodeSensorMessage("[7,1,2]");
+    }).to.throw('Unsupported wire format version');
+  });
+});
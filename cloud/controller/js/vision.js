@@ -120,7 +120,12 @@ module.exports = class Vision {
         
       } else {
         // Example request for the inference VM: http://xx.xx.xx.xx:8082/v1/objectInference?gcs_uri=gs%3A%2F%2Fcamera-9-roman-test-oct9%2Fimage1.jpg
-        const apiUrl = OBJECT_INFERENCE_API_URL + "?gcs_uri=" + encodeURIComponent(gcsURI);
+        let apiUrl = OBJECT_INFERENCE_API_URL + "?gcs_uri=" + encodeURIComponent(gcsURI);
+        // Correlation id of the frame, so the inference VM logs can be matched with the car's
+        const traceId = sensorMessage.sensors.traceId;
+        if (traceId) {
+          apiUrl += "&trace_id=" + encodeURIComponent(traceId);
+        }
         console.log("Vision API URL: " + apiUrl);
         // var visionResponse = new VisionResponse();
         const auth = {user: INFERENCE_USER_NAME, pass: INFERENCE_PASSWORD};
@@ -133,7 +138,7 @@ module.exports = class Vision {
             console.log("!!! ERROR !!! calling remote ML API: " + err + ". Please verify that your Inference VM and the App are up and running and proper HTTP port is open in the firewall.");
             reject(err);
           } else {
-            console.log("Vision API call took " + (Date.now() - startTime) + " ms. Result: " + body);
+            console.log("Vision API call" + (traceId ? " for trace " + traceId : "") + " took " + (Date.now() - startTime) + " ms. Result: " + body);
             if (response.statusCode != 200) {
               reject("Error: Received  " + response.statusCode + " from API");
               
@@ -0,0 +1,231 @@
+/**
+ * Copyright 2018, Google, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+'use strict';
+
+/**************************************************************************
+ Wire formats of the sensor messages sent by the car and the driving commands sent to it.
+ Must match car/driver/py/wire_format.py
+ - Version 1 is a JSON object (the car encodes it as JSON once more)
+ - Version 2 is a compact JSON array [2, mask, value, value, ..., extras] - the values are the
+   fields of a fixed schema in schema order, bit i of mask telling whether field i is present;
+   fields outside the schema go into an optional trailing extras object. Actions of a command
+   are a flat list of action code and value pairs.
+ Decoders accept every version and report which one they found, so we can answer the car in the
+ format it used.
+ **************************************************************************/
+const WIRE_VERSION_JSON = 1;
+const WIRE_VERSION_COMPACT = 2;
+
+// Schema of the sensor message sent by the car - append only, the position of a field is its bit in the mask
+const SENSOR_FIELDS = [
+  ["timestampMs"],
+  ["carId"],
+  ["carState", "color"],
+  ["carState", "batteryLeft"],
+  ["carState", "ballsCollected"],
+  ["carState", "obstacleFound"],
+  ["sensors", "frontLaserDistanceMm"],
+  ["sensors", "frontCameraImagePath"],
+  ["sensors", "frontCameraImagePathGCS"],
+  ["sensors", "traceId"]
+];
+
+// Schema of the driving command, see drive-message.js - append only
+const COMMAND_FIELDS = [
+  ["cloudTimestampMs"],
+  ["carTimestampMs"],
+  ["mode"],
+  ["sensorRate"],
+  ["ballCaptured"],
+  ["goal"],
+  ["actions"]
+];
+
+// Action names sent as their index in this list - append only; other names are sent as they are
+const ACTION_CODES = ["driveForwardMm", "driveBackwardMm", "turnRight", "turnLeft", "setSpeed",
+  "gripperPosition", "takePhoto", "sendSensorMessage", "setColor"];
+
+function isObject(value) {
+  return value !== null && typeof value === 'object' && !Array.isArray(value);
+}
+
+/************************************************************
+ Pack message fields into [mask, values..., extras] (extras only if there are any)
+ ************************************************************/
+function pack(fields, message) {
+  let mask = 0;
+  let values = [];
+  let groups = {};
+  let topLevel = {};
+  fields.forEach((path, i) => {
+    let parent = path.length == 2 ? message[path[0]] : message;
+    let key = path[path.length - 1];
+    if (path.length == 2) {
+      groups[path[0]] = groups[path[0]] || {};
+      groups[path[0]][key] = true;
+    } else {
+      topLevel[key] = true;
+    }
+    // Undefined fields are left out, the same as JSON.stringify() does
+    if (isObject(parent) && parent[key] !== undefined) {
+      mask |= 1 << i;
+      values.push(parent[key]);
+    }
+  });
+  let extras = {};
+  for (let key of Object.keys(message)) {
+    let value = message[key];
+    if (value === undefined || topLevel[key]) {
+      continue;
+    }
+    if (groups[key] && isObject(value)) {
+      let others = {};
+      for (let subkey of Object.keys(value)) {
+        if (!groups[key][subkey] && value[subkey] !== undefined) {
+          others[subkey] = value[subkey];
+        }
+      }
+      // An empty group is kept, the decoder only recreates groups that hold schema fields
+      if (Object.keys(others).length > 0 || Object.keys(value).length == 0) {
+        extras[key] = others;
+      }
+    } else {
+      extras[key] = value;
+    }
+  }
+  let packed = [mask].concat(values);
+  if (Object.keys(extras).length > 0) {
+    packed.push(extras);
+  }
+  return packed;
+}
+
+function unpack(fields, packed) {
+  let mask = packed[0];
+  let message = {};
+  let position = 1;
+  fields.forEach((path, i) => {
+    if (mask & (1 << i)) {
+      if (path.length == 2) {
+        message[path[0]] = message[path[0]] || {};
+        message[path[0]][path[1]] = packed[position];
+      } else {
+        message[path[0]] = packed[position];
+      }
+      position++;
+    }
+  });
+  if (position < packed.length) {
+    let extras = packed[position];
+    for (let key of Object.keys(extras)) {
+      if (isObject(extras[key]) && isObject(message[key])) {
+        Object.assign(message[key], extras[key]);
+      } else {
+        message[key] = extras[key];
+      }
+    }
+  }
+  return message;
+}
+
+/************************************************************
+ Decode message data in any known format. Depending on the Pub/Sub client the data may be a Buffer,
+ a string or JSON already parsed by the client, and JSON text may be encoded as a JSON string once more.
+ Output:
+ - {version, message}, throws an Error for data in no known format
+ ************************************************************/
+function decode(fields, data) {
+  let value = data;
+  if (Buffer.isBuffer(value)) {
+    value = value.toString('utf8');
+  }
+  for (let i = 0; i < 2 && typeof value === 'string'; i++) {
+    value = JSON.parse(value);
+  }
+  if (isObject(value)) {
+    return {version: WIRE_VERSION_JSON, message: value};
+  }
+  if (Array.isArray(value) && value.length >= 2) {
+    if (value[0] == WIRE_VERSION_COMPACT) {
+      return {version: WIRE_VERSION_COMPACT, message: unpack(fields, value.slice(1))};
+    }
+    throw new Error("Unsupported wire format version: " + value[0]);
+  }
+  throw new Error("Not a message in any known wire format");
+}
+
+function decodeSensorMessage(data) {
+  return decode(SENSOR_FIELDS, data);
+}
+
+/************************************************************
+ Encode a driving command in the given wire format version
+ Output:
+ - text to publish to the command topic
+ ************************************************************/
+function encodeCommand(command, version) {
+  if (version != WIRE_VERSION_COMPACT) {
+    return JSON.stringify(command);
+  }
+  let compact = Object.assign({}, command);
+  if (compact.actions !== undefined) {
+    let flat = [];
+    for (let action of compact.actions) {
+      for (let name of Object.keys(action)) {
+        let code = ACTION_CODES.indexOf(name);
+        flat.push(code >= 0 ? code : name, action[name]);
+      }
+    }
+    compact.actions = flat;
+  }
+  return JSON.stringify([WIRE_VERSION_COMPACT].concat(pack(COMMAND_FIELDS, compact)));
+}
+
+/************************************************************
+ Used by tests and tools to produce messages the way the car does
+ ************************************************************/
+function encodeSensorMessage(message, version) {
+  if (version != WIRE_VERSION_COMPACT) {
+    return JSON.stringify(JSON.stringify(message));
+  }
+  return JSON.stringify([WIRE_VERSION_COMPACT].concat(pack(SENSOR_FIELDS, message)));
+}
+
+function decodeCommand(data) {
+  let decoded = decode(COMMAND_FIELDS, data);
+  if (decoded.version == WIRE_VERSION_COMPACT && decoded.message.actions !== undefined) {
+    let flat = decoded.message.actions;
+    let actions = [];
+    for (let i = 0; i + 1 < flat.length; i += 2) {
+      let action = {};
+      action[typeof flat[i] === 'number' ? ACTION_CODES[flat[i]] : flat[i]] = flat[i + 1];
+      actions.push(action);
+    }
+    decoded.message.actions = actions;
+  }
+  return decoded;
+}
+
+/**************************************************************************
+ Module exports
+ **************************************************************************/
+module.exports.WIRE_VERSION_JSON = WIRE_VERSION_JSON;
+module.exports.WIRE_VERSION_COMPACT = WIRE_VERSION_COMPACT;
+module.exports.decodeSensorMessage = decodeSensorMessage;
+module.exports.encodeSensorMessage = encodeSensorMessage;
+module.exports.encodeCommand = encodeCommand;
+module.exports.decodeCommand = decodeCommand;
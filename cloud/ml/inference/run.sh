@@ -32,6 +32,16 @@ source ../setenv-ml.sh
 export PATH_TO_LABELS=$MODEL_BASE/object_detection/data/$LABEL_MAP
 export PATH_TO_CKPT=$PROJECT_DIR/checkpoint_graph_def
 
+### "production" serves the app with gunicorn: one worker process that loads the model once and
+### INFERENCE_SERVER_THREADS request threads sharing its session. "dev" runs the Flask dev server
+export INFERENCE_SERVING_MODE="production"
+export INFERENCE_SERVER_THREADS="16"
+### Requests a worker holds at once before answering 503 - check /metrics to size this and the VM.
+### Kept below the thread count, so spare threads are left to answer the 503s and /health and /metrics
+export MAX_CONCURRENT_REQUESTS="$(( INFERENCE_SERVER_THREADS - 4 ))"
+### Connections waiting for a thread are invisible to /metrics - keep that queue short, so overload shows up as 503s
+export INFERENCE_LISTEN_BACKLOG="16"
+
 ##################################################
 # This changes TF inference model to be used for web app
 ##################################################
@@ -59,6 +69,24 @@ set_inference_model() {
     echo_my "Frozen inference graph is setup at '$DESTINATION_GRAPH'"
 }
 
+##################################################
+# Wait until the app has loaded and warmed up the model and answers health checks
+##################################################
+wait_for_inference_ready() {
+    local MAX_WAIT_SEC=300
+    local HEALTH_URL="http://localhost:$HTTP_PORT/health"
+    echo_my "Waiting up to $MAX_WAIT_SEC seconds for the model warm-up at '$HEALTH_URL'..."
+    for (( i=0; i<$MAX_WAIT_SEC; i++ )); do
+        if HEALTH=$(curl -sf -u $INFERENCE_USER_NAME:$INFERENCE_PASSWORD $HEALTH_URL); then
+            echo_my "Inference app is ready: $HEALTH"
+            return 0
+        fi
+        sleep 1
+    done
+    echo_my "Inference app did not become ready in $MAX_WAIT_SEC seconds, see python/nohup.out"
+    return 1
+}
+
 ###############################################
 # MAIN
 ###############################################
@@ -77,6 +105,11 @@ else
     touch $INSTALL_FLAG
 fi
 
+if [ "$INFERENCE_SERVING_MODE" == "production" ] && ! which gunicorn ; then
+    echo_my "Installing gunicorn for the production serving mode..."
+    sudo pip install gunicorn==19.9.0 futures
+fi
+
 set_python_path
 cd $CWD/python
 
@@ -91,7 +124,18 @@ fi
 
 echo_my "Running webapp: Change USERNAME and PASSWORD in decorator.py..."
 # -u disables line buffering in python and shows everything in the nohup.out
-nohup python -u ./app.py &
+if [ "$INFERENCE_SERVING_MODE" == "production" ] ; then
+    # A single worker keeps one copy of the model in memory - concurrency comes from the threads.
+    # The timeout also covers loading and warming up the model when the worker boots.
+    # The worker accepts no more connections than it has threads, the rest wait in the short listen backlog
+    nohup gunicorn --bind 0.0.0.0:$HTTP_PORT --workers 1 --worker-class gthread --threads $INFERENCE_SERVER_THREADS \
+        --worker-connections $INFERENCE_SERVER_THREADS --backlog $INFERENCE_LISTEN_BACKLOG \
+        --timeout 300 --access-logfile - app:app &
+else
+    nohup python -u ./app.py &
+fi
+
+wait_for_inference_ready || true
 
 tail -f nohup.out
 
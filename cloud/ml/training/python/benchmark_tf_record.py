@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+r"""Compares the ways create_cloud_derby_tf_record.py can build examples.
+
+'full' parses the whole annotation into a dict and opens every image with PIL,
+'lean' streams only the needed annotation fields and checks the JPEG header.
+Each mode runs in its own process over the same examples, reporting the time
+per image and how much the peak resident memory of the process grew.
+
+Example usage:
+    python benchmark_tf_record.py \
+        --data_dir=/home/user/cloud_derby \
+        --label_map_path=/home/user/cloud_derby/annotations/cloud_derby_label_map.pbtxt
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+from object_detection.utils import dataset_util
+from object_detection.utils import label_map_util
+
+import create_cloud_derby_tf_record
+
+MODES = ('full', 'lean')
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_mode(mode, examples, label_map_dict, annotations_dir, image_dir,
+             results):
+  """Builds all examples in this process and puts the measurements on results."""
+  rss_before = peak_rss_mb()
+  durations = []
+  written = 0
+  for example in examples:
+    start = time.time()
+    serialized = create_cloud_derby_tf_record.build_tf_example(
+        example, label_map_dict, annotations_dir, image_dir,
+        lean=mode == 'lean')
+    durations.append(time.time() - start)
+    if serialized is not None:
+      written += 1
+  durations.sort()
+  results.put({
+      'mode': mode,
+      'images': len(durations),
+      'written': written,
+      'mean_ms': 1000 * sum(durations) / max(len(durations), 1),
+      'p95_ms': 1000 * durations[int(0.95 * (len(durations) - 1))] if durations else 0,
+      'peak_rss_mb': peak_rss_mb(),
+      'rss_growth_mb': peak_rss_mb() - rss_before,
+  })
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--data_dir', required=True,
+                      help='Root directory to raw Cloud Derby dataset.')
+  parser.add_argument('--label_map_path', required=True,
+                      help='Path to label map proto')
+  parser.add_argument('--num_examples', type=int, default=500,
+                      help='How many examples to build, 0 for all of them.')
+  args = parser.parse_args()
+
+  image_dir = os.path.join(args.data_dir, 'images')
+  annotations_dir = os.path.join(args.data_dir, 'annotations')
+  examples = dataset_util.read_examples_list(
+      os.path.join(annotations_dir, 'trainval.txt'))
+  if args.num_examples > 0:
+    examples = examples[:args.num_examples]
+  label_map_dict = label_map_util.get_label_map_dict(args.label_map_path)
+
+  results = multiprocessing.Queue()
+  measurements = []
+  for mode in MODES:
+    process = multiprocessing.Process(
+        target=run_mode,
+        args=(mode, examples, label_map_dict, annotations_dir, image_dir,
+              results))
+    process.start()
+    measurements.append(results.get())
+    process.join()
+
+  print('%-6s %8s %8s %10s %10s %14s %16s' % (
+      'mode', 'images', 'written', 'mean ms', 'p95 ms', 'peak RSS MB',
+      'RSS growth MB'))
+  for m in measurements:
+    print('%-6s %8d %8d %10.2f %10.2f %14.1f %16.1f' % (
+        m['mode'], m['images'], m['written'], m['mean_ms'], m['p95_ms'],
+        m['peak_rss_mb'], m['rss_growth_mb']))
+
+
+if __name__ == '__main__':
+  main()
@@ -186,12 +186,16 @@ setup_object_detection() {
   local LABEL_MAP_FILE=$(pwd)/annotations/cloud_derby_label_map.pbtxt
   generate_pbtxt_file $LABEL_MAP_FILE
 
-  echo_my "Convert training data to TFRecords..."
+  echo_my "Convert training data to TFRecords, encoding only images changed since the last run..."
   cd $CWD
+  # Kept between runs together with the manifest of what they contain
+  local RECORDS_DIR=$TMP/tf_records
+  mkdir -p $RECORDS_DIR
   python ${MODEL_CONFIG_PATH}/python/create_cloud_derby_tf_record.py \
       --label_map_path=$LABEL_MAP_FILE \
       --data_dir=$CWD \
-      --output_dir=$CWD
+      --output_dir=$RECORDS_DIR \
+      --num_shards=$TF_RECORD_SHARDS
 
   echo_my "Removing existing objects and bucket '$GCS_ML_BUCKET' from GCS..."
   gsutil -m rm -r $GCS_ML_BUCKET/* | true
@@ -199,8 +203,7 @@ setup_object_detection() {
 
   echo_my "Upload dataset to GCS..."
   gsutil mb -l $REGION -c regional $GCS_ML_BUCKET
-  gsutil cp cloud_derby_train.record $GCS_ML_BUCKET/data/cloud_derby_train.record
-  gsutil cp cloud_derby_val.record $GCS_ML_BUCKET/data/cloud_derby_val.record
+  gsutil -m cp $RECORDS_DIR/cloud_derby_train.record* $RECORDS_DIR/cloud_derby_val.record* $GCS_ML_BUCKET/data/
   gsutil cp $LABEL_MAP_FILE $GCS_ML_BUCKET/data/cloud_derby_label_map.pbtxt
 
   echo_my "Upload pretrained COCO Model for Transfer Learning..."
@@ -383,7 +386,7 @@ train_config: {
 }
 train_input_reader: {
   tf_record_input_reader {
-    input_path: "${GCS_ML_BUCKET}/data/cloud_derby_train.record"
+    input_path: "${GCS_ML_BUCKET}/data/cloud_derby_train.record*"
   }
   label_map_path: "${GCS_ML_BUCKET}/data/cloud_derby_label_map.pbtxt"
 }
@@ -395,7 +398,7 @@ eval_config: {
 }
 eval_input_reader: {
   tf_record_input_reader {
-    input_path: "${GCS_ML_BUCKET}/data/cloud_derby_val.record"
+    input_path: "${GCS_ML_BUCKET}/data/cloud_derby_val.record*"
   }
   label_map_path: "${GCS_ML_BUCKET}/data/cloud_derby_label_map.pbtxt"
   shuffle: false
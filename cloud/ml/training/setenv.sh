@@ -41,4 +41,7 @@ MODEL_CONFIG=${MODEL}-cloud-derby.config
 ### Which dataset to use
 MODEL_CONFIG_PATH=$(pwd)
 
+### How many files to split the train and val TFRecords into - the records are built by one process per CPU
+TF_RECORD_SHARDS=10
+
 export TF_HTTP_PORT=8081
\ No newline at end of file
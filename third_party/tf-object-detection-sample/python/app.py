@@ -25,9 +25,20 @@ import sys
 import tempfile
 import os
 import json
+import logging
 import time
+from functools import wraps
 
+from batcher import InferenceBatcher
 from decorator import requires_auth
+import detection_utils
+import image_utils
+from metrics import ServingStats
+from metrics import format_prometheus
+from storage_utils import GcsImageFetcher
+from storage_utils import LRUCache
+from tracing import StageLatencies
+from tracing import Trace
 from flask import Flask
 from flask import redirect
 from flask import render_template
@@ -35,6 +46,7 @@ from flask import request
 from flask import url_for
 from flask_wtf.file import FileField
 from flask import jsonify
+from flask import Response
 import numpy as np
 from PIL import Image
 from PIL import ImageDraw
@@ -47,6 +59,11 @@ from google.cloud import storage
 from google.cloud.exceptions import NotFound
 from urllib2 import unquote
 
+# Per-detection output is logged at DEBUG, so a busy inference VM can run at INFO or WARNING
+LOG_LEVEL = os.environ.get('INFERENCE_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger('inference')
+
 app = Flask(__name__)
 
 @app.before_request
@@ -64,6 +81,9 @@ PROBABILITY_TRESHOLD = 0.05
 # Considering that the final game will allow for 4 balls overall, chances are those balls are pretty far apart from each other
 PROXIMITY_THRESHOLD = 0.04
 
+# Keep at most this many detections of each class (highest scores first); 0 means no limit
+MAX_DETECTIONS_PER_CLASS = int(os.environ.get('MAX_DETECTIONS_PER_CLASS', '0'))
+
 PATH_TO_CKPT = os.environ['PATH_TO_CKPT'] + '/frozen_inference_graph.pb'
 MODEL_BASE = os.environ['MODEL_BASE']
 PATH_TO_LABELS = os.environ['PATH_TO_LABELS']
@@ -74,6 +94,28 @@ VM_NAME = os.environ['VM_NAME']
 PORT = int(os.environ['HTTP_PORT'])
 INFERENCE_URL = os.environ['INFERENCE_URL']
 
+# Concurrent inference requests are collected for up to INFERENCE_BATCH_WAIT_MS
+# and run through the model together, up to INFERENCE_MAX_BATCH_SIZE images at a time
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', '8'))
+INFERENCE_BATCH_WAIT_MS = float(os.environ.get('INFERENCE_BATCH_WAIT_MS', '5'))
+
+# Optional 'WIDTHxHEIGHT' hint to let the JPEG decoder scale camera frames down while decoding
+INFERENCE_DECODE_SIZE = image_utils.parse_decode_size(os.environ.get('INFERENCE_DECODE_SIZE', ''))
+
+# How many recent inference results to keep by gcs_uri, so a retried frame is not downloaded and inferred twice
+INFERENCE_CACHE_SIZE = int(os.environ.get('INFERENCE_CACHE_SIZE', '64'))
+
+# Synthetic frames run through the model at startup so the first car does not pay for
+# graph optimization and memory allocation; 0 disables the warm-up
+INFERENCE_WARMUP_FRAMES = int(os.environ.get('INFERENCE_WARMUP_FRAMES', '3'))
+CAMERA_WIDTH = int(os.environ.get('HORIZONTAL_RESOLUTION_PIXELS', '1024'))
+CAMERA_HEIGHT = int(os.environ.get('VERTICAL_RESOLUTION_PIXELS', '576'))
+
+# Inference requests a worker will hold at once (waiting for GCS or the model); more are
+# rejected with 503 so cars retry instead of piling up behind a slow VM. 0 means no limit.
+# Only effective below the number of server threads, see run.sh
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '12'))
+
 content_types = {'jpg': 'image/jpeg',
                  'jpeg': 'image/jpeg',
                  'png': 'image/png'}
@@ -81,7 +123,13 @@ content_types = {'jpg': 'image/jpeg',
 extensions = sorted(content_types.keys())
 label_map = { "1":"BlueBall", "2":"RedBall", "3":"YellowBall", "4":"GreenBall", "5":"BlueHome", "6":"RedHome", "7":"YellowHome", "8":"GreenHome" }
 
-storage_client = storage.Client()
+# The storage client is created on the first download, so the module also loads offline, e.g. in benchmark_inference.py
+image_fetcher = GcsImageFetcher(create_client=storage.Client)
+inference_cache = LRUCache(INFERENCE_CACHE_SIZE)
+serving_stats = ServingStats(MAX_CONCURRENT_REQUESTS)
+# Where the time of inference requests goes, exported on /metrics; requests carry the car's trace id for the logs
+stage_latencies = StageLatencies('inference_stage_latency_milliseconds',
+                                 'Time spent in each stage of inference requests (gcs_fetch, decode, queue, model, response, total)')
 
 def is_image():
   def _is_image(form, field):
@@ -104,6 +152,14 @@ class ObjectDetector(object):
   def __init__(self):
     self.detection_graph = self._build_graph()
     self.sess = tf.Session(graph=self.detection_graph)
+    # Tensor handles never change once the graph is loaded
+    graph = self.detection_graph
+    self.image_tensor = graph.get_tensor_by_name('image_tensor:0')
+    self.output_tensors = [graph.get_tensor_by_name('detection_boxes:0'),
+                           graph.get_tensor_by_name('detection_scores:0'),
+                           graph.get_tensor_by_name('detection_classes:0'),
+                           graph.get_tensor_by_name('num_detections:0')]
+    self.warmup_seconds = None
 
     label_map = label_map_util.load_labelmap(PATH_TO_LABELS)
     categories = label_map_util.convert_label_map_to_categories(
@@ -122,29 +178,38 @@ class ObjectDetector(object):
     return detection_graph
 
   def _load_image_into_numpy_array(self, image):
-    (im_width, im_height) = image.size
-    return np.array(image.getdata()).reshape(
-        (im_height, im_width, 3)).astype(np.uint8)
+    return image_utils.load_image_into_numpy_array(image)
 
   def detect(self, image):
-    image_np = self._load_image_into_numpy_array(image)
-    image_np_expanded = np.expand_dims(image_np, axis=0)
+    return self.detect_batch([self._load_image_into_numpy_array(image)])[0]
 
-    graph = self.detection_graph
-    image_tensor = graph.get_tensor_by_name('image_tensor:0')
-    boxes = graph.get_tensor_by_name('detection_boxes:0')
-    scores = graph.get_tensor_by_name('detection_scores:0')
-    classes = graph.get_tensor_by_name('detection_classes:0')
-    num_detections = graph.get_tensor_by_name('num_detections:0')
+  def detect_batch(self, images_np):
+    """Runs the model once over a list of same-sized images.
+
+    Returns a list with a (boxes, scores, classes, num_detections) tuple per image.
+    """
+    images_np_stacked = np.stack(images_np)
 
     (boxes, scores, classes, num_detections) = self.sess.run(
-        [boxes, scores, classes, num_detections],
-        feed_dict={image_tensor: image_np_expanded})
+        self.output_tensors, feed_dict={self.image_tensor: images_np_stacked})
 
-    boxes, scores, classes, num_detections = map(
-        np.squeeze, [boxes, scores, classes, num_detections])
+    return [(boxes[i], scores[i], classes[i].astype(int), int(num_detections[i]))
+            for i in range(len(images_np))]
 
-    return boxes, scores, classes.astype(int), num_detections
+  def warm_up(self, width, height, frames, batch_size=1):
+    """Runs synthetic frames through the model and returns how many seconds it took.
+
+    Batches of one and of batch_size are both run, since each batch shape is
+    optimized separately on its first run.
+    """
+    start_time = time.time()
+    frame = np.random.RandomState(0).randint(0, 256, (height, width, 3)).astype(np.uint8)
+    for _ in range(frames):
+      self.detect_batch([frame])
+    if batch_size > 1 and frames > 0:
+      self.detect_batch([frame] * batch_size)
+    self.warmup_seconds = time.time() - start_time
+    return self.warmup_seconds
 
 
 def draw_bounding_box_on_image(image, box, color='red', thickness=4):
@@ -166,7 +231,7 @@ def encode_image(image):
 
 
 def detect_objects(image_path):
-  image = Image.open(image_path).convert('RGB')
+  image = image_utils.open_image(image_path)
   boxes, scores, classes, num_detections = client.detect(image)
   image.thumbnail((480, 480), Image.ANTIALIAS)
 
@@ -190,81 +255,81 @@ def detect_objects(image_path):
   return result
 
 
-def detect_object_bounding_boxes(image_path):
-  image = Image.open(image_path).convert('RGB')
-  im_width, im_height = image.size
-  boxes, scores, classes, num_detections = client.detect(image)
-  response_msg = build_json_response(boxes, scores, classes, num_detections, image)
-  return response_msg
+def submit_for_detection(image_file, trace):
+  """Decodes the image and queues it for the model. Returns (image, PendingDetection)."""
+  with trace.span('decode'):
+    image = image_utils.open_image(image_file, INFERENCE_DECODE_SIZE)
+    # The batcher decodes the pixels on this thread before queueing them
+    return image, batcher.submit(image)
+
+
+def wait_for_response(image, detection, trace):
+  """Waits for the model and builds the JSON response, recording the queue, model and response stages."""
+  start_time = time.time()
+  boxes, scores, classes, num_detections = detection.wait()
+  model_ms = detection.run_seconds * 1000
+  trace.record('queue', max(0.0, (time.time() - start_time) * 1000 - model_ms))
+  trace.record('model', model_ms)
+  with trace.span('response'):
+    return build_json_response(boxes, scores, classes, num_detections, image)
+
+
+def detect_object_bounding_boxes(image_file, trace):
+  image, detection = submit_for_detection(image_file, trace)
+  return wait_for_response(image, detection, trace)
 
 
 def build_json_response(boxes, scores, classes, num_detections, image):
   response_msg = {}
   im_width, im_height = image.size
-  print "DEBUG: image width:",im_width,"image height:",im_height,"num_detections:",num_detections,"PROBABILITY_TRESHOLD:",PROBABILITY_TRESHOLD,"PROXIMITY_THRESHOLD:",PROXIMITY_THRESHOLD
-  for i in range(num_detections):
-    if scores[i] > PROBABILITY_TRESHOLD:
-      ymin, xmin, ymax, xmax = boxes[i]
-      (left, right, bottom, top) = (xmin, xmax, ymin, ymax)
-      width = right-left
-      height = top - bottom
-      label = label_map[str(classes[i])] + str(i)
-      response_msg[label] = []
-      response_msg[label].append({"x":str(left), "y":str(bottom), "w":str(width), "h":str(height), "score":str(scores[i])})
-      print "label:",label_map[str(classes[i])],", score:", scores[i]," x:",left," y:",bottom," h:",height," w:",width
-    else:
-      label = label_map[str(classes[i])]
-  return check_for_ball_proximity(response_msg)
-  
-
-def check_for_ball_proximity(response_msg):
-  responses_to_remove = [] 
-  for k,v in response_msg.iteritems():
-    if k not in responses_to_remove:
-      # Since we are using relative coordinates 0 to 1 - using float
-      x1 = float(response_msg[k][0]["x"])
-      y1 = float(response_msg[k][0]["y"])
-      width1 = float(response_msg[k][0]["w"])
-      height1 = float(response_msg[k][0]["h"])
-
-      for key,val in response_msg.iteritems():
-        if key != k and key not in responses_to_remove:
-          x_diff = abs(x1 - float(response_msg[key][0]["x"]))
-          y_diff = abs(y1 - float(response_msg[key][0]["y"]))
-          w_threshold = width1 * PROXIMITY_THRESHOLD
-          h_threshold = height1 * PROXIMITY_THRESHOLD
-
-          if x_diff <= w_threshold and  y_diff <= h_threshold: 
-            if float(response_msg[k][0]["score"]) >= float(response_msg[key][0]["score"]):
-              print "Removing ",key," because it is in close proximity to k: ",k
-              responses_to_remove.append(key)
-            else:
-              if k not in responses_to_remove:
-                print "Removing ",k," because it is in close proximity to key: ",key
-                responses_to_remove.append(k)
-
-  for dkey in responses_to_remove:
-    del response_msg[dkey]
-  
+  logger.debug("image width: %s image height: %s num_detections: %s PROBABILITY_TRESHOLD: %s PROXIMITY_THRESHOLD: %s",
+               im_width, im_height, num_detections, PROBABILITY_TRESHOLD, PROXIMITY_THRESHOLD)
+  candidates = select_detections(scores, classes, num_detections)
+  for i in check_for_ball_proximity(boxes, scores, candidates):
+    ymin, xmin, ymax, xmax = boxes[i]
+    (left, right, bottom, top) = (xmin, xmax, ymin, ymax)
+    width = right-left
+    height = top - bottom
+    label = label_map[str(classes[i])] + str(i)
+    response_msg[label] = []
+    response_msg[label].append({"x":str(left), "y":str(bottom), "w":str(width), "h":str(height), "score":str(scores[i])})
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("label: %s, score: %s x: %s y: %s h: %s w: %s", label_map[str(classes[i])], scores[i], left, bottom, height, width)
   return response_msg
 
+
+def select_detections(scores, classes, num_detections):
+  return detection_utils.select_detections(scores, classes, num_detections, PROBABILITY_TRESHOLD, MAX_DETECTIONS_PER_CLASS)
+
+
+def check_for_ball_proximity(boxes, scores, indices):
+  return detection_utils.check_for_ball_proximity(boxes, scores, indices, PROXIMITY_THRESHOLD)
+
+
 # See details here: https://cloud.google.com/storage/docs/downloading-objects#storage-download-object-python
 def get_image_from_GCS(gcs_uri):
+  """Returns the image as an in-memory file object, or None if it can not be read."""
   try:
-    uri_split = gcs_uri.split("/");
-    bucket_name = uri_split[2];
-    bucket = storage_client.get_bucket(bucket_name)
-    file_and_path = "/".join(uri_split[3:])
-    blob = bucket.get_blob(file_and_path)
-    file_name = uri_split[-1]
-    blob.download_to_filename(file_name)
-    return file_name
+    return cStringIO.StringIO(image_fetcher.fetch(gcs_uri))
   except Exception as e:
-    print "Error: get_image_from_GCS: while obtaining file from GCS"
-    print e.message
+    logger.error("get_image_from_GCS: while obtaining file '%s' from GCS: %s", gcs_uri, e)
     return None
 
 
+def limit_concurrency(f):
+  @wraps(f)
+  def decorated(*args, **kwargs):
+    if not serving_stats.try_acquire():
+      error_msg = {"Error" : "Inference VM {vm} is at its limit of {limit} concurrent requests".format(vm=VM_NAME, limit=MAX_CONCURRENT_REQUESTS) }
+      logger.warning("%s", error_msg)
+      return jsonify(error_msg), 503
+    try:
+      return f(*args, **kwargs)
+    finally:
+      serving_stats.release()
+  return decorated
+
+
 @app.route('/')
 def upload():
   photo_form = PhotoForm(request.form)
@@ -280,7 +345,7 @@ def post():
       temp.flush()
       start_time = time.time()
       result = detect_objects(temp.name)
-      print("--- post() inference took %s seconds" % (time.time() - start_time))
+      logger.info("--- post() inference took %s seconds", time.time() - start_time)
 
     photo_form = PhotoForm(request.form)
     return render_template('upload.html',
@@ -290,24 +355,93 @@ def post():
 
 
 @app.route(INFERENCE_URL,methods=['GET'])
+@limit_concurrency
 def object_inference():
     gcs_uri = unquote(request.args.get('gcs_uri'))
-    print("")
-    print("-------------------------- object_inference() on file '%s'" % gcs_uri)
-    file_name = get_image_from_GCS(gcs_uri)
-    if file_name != None:
-      print("Starting inference on file '%s'..." % file_name)
-      start_time = time.time()
-      response_from_ml = detect_object_bounding_boxes(file_name)
-      print("--- rest() inference took %s seconds" % (time.time() - start_time))
-      print response_from_ml
+    trace = Trace(request.args.get('trace_id'), stage_latencies)
+    logger.info("-------------------------- object_inference() on file '%s' trace %s", gcs_uri, trace.trace_id)
+    response_from_ml = inference_cache.get(gcs_uri)
+    if response_from_ml != None:
+      logger.info("Returning cached inference result for '%s'", gcs_uri)
+      return jsonify(response_from_ml)
+
+    with trace.span('gcs_fetch'):
+      image_file = get_image_from_GCS(gcs_uri)
+    if image_file != None:
+      logger.debug("Starting inference on file '%s'...", gcs_uri)
+      response_from_ml = detect_object_bounding_boxes(image_file, trace)
+      trace.finish()
+      logger.info("--- rest() inference %s", trace.summary())
+      logger.debug("%s", response_from_ml)
+      inference_cache.put(gcs_uri, response_from_ml)
       return jsonify(response_from_ml)
     else:
       error_msg = {"Error" : "GCS file {file} not found or access is denied.".format(file=gcs_uri) }
-      print error_msg
+      logger.error("%s", error_msg)
       return jsonify(error_msg), 404
       
 
+@app.route(INFERENCE_URL + '/batch',methods=['POST'])
+@limit_concurrency
+def object_inference_batch():
+    request_json = request.get_json(silent=True) or {}
+    gcs_uris = request_json.get('gcs_uris')
+    if not isinstance(gcs_uris, list) or not all(isinstance(gcs_uri, basestring) for gcs_uri in gcs_uris):
+      error_msg = {"Error" : "Request body must be a JSON object with a 'gcs_uris' list of strings"}
+      logger.error("%s", error_msg)
+      return jsonify(error_msg), 400
+    # The whole batch holds one concurrency slot and its images are fetched one after another,
+    # so it is limited to what the model runs at once
+    if len(gcs_uris) > INFERENCE_MAX_BATCH_SIZE:
+      error_msg = {"Error" : "At most {limit} gcs_uris per request, got {count}".format(limit=INFERENCE_MAX_BATCH_SIZE, count=len(gcs_uris)) }
+      logger.error("%s", error_msg)
+      return jsonify(error_msg), 400
+
+    trace = Trace(request_json.get('trace_id'), stage_latencies)
+    logger.info("-------------------------- object_inference_batch() on %d files trace %s", len(gcs_uris), trace.trace_id)
+    start_time = time.time()
+    # Submit every image before waiting on any, so they all land in the same model batch
+    pending = {}
+    response_msg = {}
+    for gcs_uri in gcs_uris:
+      cached_response = inference_cache.get(gcs_uri)
+      if cached_response != None:
+        response_msg[gcs_uri] = cached_response
+        continue
+      with trace.span('gcs_fetch'):
+        image_file = get_image_from_GCS(gcs_uri)
+      if image_file != None:
+        pending[gcs_uri] = submit_for_detection(image_file, trace)
+      else:
+        response_msg[gcs_uri] = {"Error" : "GCS file {file} not found or access is denied.".format(file=gcs_uri) }
+
+    for gcs_uri, (image, detection) in pending.iteritems():
+      response_msg[gcs_uri] = wait_for_response(image, detection, trace)
+      inference_cache.put(gcs_uri, response_msg[gcs_uri])
+    trace.finish()
+    logger.info("--- batch inference of %d files took %s seconds, trace %s", len(gcs_uris), time.time() - start_time, trace.trace_id)
+    return jsonify(response_msg)
+
+
+@app.route('/health',methods=['GET'])
+def health():
+    return jsonify({"status": "ready", "vm": VM_NAME, "warmupSeconds": client.warmup_seconds})
+
+
+@app.route('/metrics',methods=['GET'])
+def metrics():
+    samples = [
+      ('inference_requests_in_flight', 'gauge', 'Inference requests being served by this worker', serving_stats.in_flight),
+      ('inference_max_concurrent_requests', 'gauge', 'Concurrency limit of this worker (0 is unlimited)', serving_stats.max_in_flight),
+      ('inference_requests_total', 'counter', 'Inference requests accepted', serving_stats.requests_total),
+      ('inference_requests_rejected_total', 'counter', 'Inference requests rejected at the concurrency limit', serving_stats.rejected_total),
+      ('inference_queue_depth', 'gauge', 'Images waiting for the model', batcher.queue_depth()),
+      ('inference_batches_total', 'counter', 'Model runs', batcher.batches_total),
+      ('inference_images_total', 'counter', 'Images run through the model', batcher.images_total),
+    ]
+    return Response(format_prometheus(samples) + stage_latencies.format_prometheus(), mimetype='text/plain')
+
+
 @app.route('/v1/objectInferenceDummyData',methods=['GET'])
 def object_inference_dummy_Data():
 
@@ -321,7 +455,15 @@ def object_inference_dummy_Data():
     return jsonify(response_msg)
 
 client = ObjectDetector()
+if INFERENCE_WARMUP_FRAMES > 0:
+  logger.info("Warming up the model with %d synthetic %dx%d frames...", INFERENCE_WARMUP_FRAMES, CAMERA_WIDTH, CAMERA_HEIGHT)
+  client.warm_up(CAMERA_WIDTH, CAMERA_HEIGHT, INFERENCE_WARMUP_FRAMES, batch_size=INFERENCE_MAX_BATCH_SIZE)
+  logger.info("Model warm-up took %s seconds", client.warmup_seconds)
+batcher = InferenceBatcher(client, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_BATCH_WAIT_MS)
 
 
+# In production run.sh serves this module through gunicorn: one worker process holding the
+# model and session created above, with a pool of request threads in front of it
 if __name__ == '__main__':
-  app.run(host='0.0.0.0', port=PORT, debug=False)
+  # Requests need to be served concurrently for the batcher to group them
+  app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
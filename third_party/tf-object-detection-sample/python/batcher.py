@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import Queue
+import threading
+import time
+
+
+class PendingDetection(object):
+  """Result slot for a single image submitted to the InferenceBatcher."""
+
+  def __init__(self, image_np):
+    self.image_np = image_np
+    self._done = threading.Event()
+    self._result = None
+    self._error = None
+    # Seconds the model took for the batch this image ran in, and how many images the batch had
+    self.run_seconds = None
+    self.batch_size = None
+
+  def set_result(self, result):
+    self._result = result
+    self._done.set()
+
+  def set_error(self, error):
+    self._error = error
+    self._done.set()
+
+  def wait(self):
+    self._done.wait()
+    if self._error is not None:
+      raise self._error
+    return self._result
+
+
+class InferenceBatcher(object):
+  """Collects concurrent detection requests and runs them as one batch.
+
+  Requests arriving within max_wait_ms of the first one in a batch (up to
+  max_batch_size of them) are stacked into a single tensor and sent to the
+  detector with one sess.run. Images can only be stacked when their sizes
+  match, so a batch with mixed sizes is split into one run per size.
+  """
+
+  def __init__(self, detector, max_batch_size=8, max_wait_ms=5):
+    self.detector = detector
+    self.max_batch_size = max(1, max_batch_size)
+    self.max_wait = max_wait_ms / 1000.0
+    self._queue = Queue.Queue()
+    self.batches_total = 0
+    self.images_total = 0
+    self._thread = threading.Thread(target=self._run, name='inference-batcher')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, image):
+    # Decoding happens on the caller's thread so requests decode in parallel
+    pending = PendingDetection(self.detector._load_image_into_numpy_array(image))
+    self._queue.put(pending)
+    return pending
+
+  def detect(self, image):
+    return self.submit(image).wait()
+
+  def queue_depth(self):
+    """Number of images waiting for the model, not counting the batch being run."""
+    return self._queue.qsize()
+
+  def _next_batch(self):
+    batch = [self._queue.get()]
+    deadline = time.time() + self.max_wait
+    while len(batch) < self.max_batch_size:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(self._queue.get(timeout=remaining))
+      except Queue.Empty:
+        break
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      by_shape = {}
+      for pending in batch:
+        by_shape.setdefault(pending.image_np.shape, []).append(pending)
+
+      for group in by_shape.values():
+        self.batches_total += 1
+        self.images_total += len(group)
+        start_time = time.time()
+        try:
+          results = self.detector.detect_batch([p.image_np for p in group])
+        except Exception as e:
+          for pending in group:
+            pending.set_error(e)
+          continue
+        run_seconds = time.time() - start_time
+        for pending, result in zip(group, results):
+          pending.run_seconds = run_seconds
+          pending.batch_size = len(group)
+          pending.set_result(result)
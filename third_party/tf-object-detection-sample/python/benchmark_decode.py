@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of image decoding into the model input array.
+
+Compares the original getdata() based conversion with the buffer based one
+and with JPEG draft-mode decoding. Run it on the inference VM:
+
+    python benchmark_decode.py [--image frame.jpg] [--decode-size 640x480]
+
+Without --image a synthetic 1280x960 JPEG frame is used.
+"""
+
+import argparse
+import cStringIO
+import time
+
+import numpy as np
+from PIL import Image
+
+import image_utils
+
+
+def synthetic_jpeg(width, height):
+  pixels = np.random.RandomState(42).randint(0, 256, (height, width, 3)).astype(np.uint8)
+  buf = cStringIO.StringIO()
+  Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+  return buf.getvalue()
+
+
+def time_it(func, iterations):
+  func()  # warm-up
+  start_time = time.time()
+  for _ in range(iterations):
+    func()
+  return (time.time() - start_time) / iterations * 1000
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--image', help='JPEG file to decode (default: synthetic 1280x960 frame)')
+  parser.add_argument('--decode-size', default='640x480', help='Size hint for draft mode decoding')
+  parser.add_argument('--iterations', type=int, default=20)
+  args = parser.parse_args()
+
+  if args.image:
+    with open(args.image, 'rb') as f:
+      jpeg_bytes = f.read()
+  else:
+    jpeg_bytes = synthetic_jpeg(1280, 960)
+  decode_size = image_utils.parse_decode_size(args.decode_size)
+
+  def legacy():
+    image = image_utils.open_image(cStringIO.StringIO(jpeg_bytes))
+    return image_utils.legacy_load_image_into_numpy_array(image)
+
+  def buffer_copy():
+    image = image_utils.open_image(cStringIO.StringIO(jpeg_bytes))
+    return image_utils.load_image_into_numpy_array(image)
+
+  def draft():
+    image = image_utils.open_image(cStringIO.StringIO(jpeg_bytes), decode_size)
+    return image_utils.load_image_into_numpy_array(image)
+
+  if not np.array_equal(legacy(), buffer_copy()):
+    raise SystemExit('Error: buffer based decode does not match the original conversion')
+
+  print("Frame: %s, %d bytes" % ('x'.join(map(str, Image.open(cStringIO.StringIO(jpeg_bytes)).size)), len(jpeg_bytes)))
+  for name, func in (('legacy getdata()', legacy),
+                     ('buffer np.asarray()', buffer_copy),
+                     ('draft %s + np.asarray()' % args.decode_size, draft)):
+    ms = time_it(func, args.iterations)
+    shape = func().shape
+    print("%-32s %8.2f ms/frame  output %s" % (name, ms, shape))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Offline benchmark of the inference hot path in app.py.
+
+Runs recorded arena frames through each stage of a request - decoding,
+ObjectDetector.detect, select_detections + check_for_ball_proximity,
+build_json_response and encode_image - and reports per-stage latency,
+throughput and peak RSS. Needs no GCS access and no GPU: by default the model
+is a small stand-in frozen graph with the same inputs and outputs as the
+object detection API, generated from a fixed seed. Its model stage reflects
+session overhead and a few convolutions, not the real detector; pass --graph
+to time a real frozen_inference_graph.pb.
+
+    python benchmark_inference.py --save-baseline baseline.json
+    ... change something ...
+    python benchmark_inference.py --baseline baseline.json
+
+With --baseline, stages whose median latency (or the peak RSS) grew by more
+than --tolerance are flagged and the exit status is 1. Compare runs on the
+same machine, with the same frames and graph.
+"""
+
+import argparse
+import cStringIO
+import glob
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+# Frames recorded in the arena for the car simulator
+DEFAULT_FRAMES = os.path.join(HERE, '..', '..', '..', 'car', 'simulator', 'js', 'simulation-images', '*.jpg')
+
+BASELINE_VERSION = 1
+
+# Labels of app.label_map, for the stand-in label map file
+LABELS = ["BlueBall", "RedBall", "YellowBall", "GreenBall", "BlueHome", "RedHome", "YellowHome", "GreenHome"]
+
+# Median latency differences below this are noise, even when they are a large fraction of a tiny stage
+MIN_REGRESSION_MS = 0.05
+
+
+def build_stand_in_graph(path, max_detections=100, seed=0):
+  """Writes a frozen graph with the object detection API's tensors to path.
+
+  image_tensor (uint8, [batch, height, width, 3]) is downscaled to 300x300 and
+  run through three small convolutions; the pooled features score a fixed set
+  of boxes and classes. Detections come out sorted by score like the real
+  model's, and are spread and overlapping enough to exercise the proximity check.
+  """
+  import tensorflow as tf
+
+  rng = np.random.RandomState(seed)
+  graph = tf.Graph()
+  with graph.as_default():
+    image_tensor = tf.placeholder(tf.uint8, [None, None, None, 3], name='image_tensor')
+    net = tf.image.resize_bilinear(tf.cast(image_tensor, tf.float32) / 255.0, [300, 300])
+    for depth in (16, 32, 64):
+      weights = rng.normal(0, 0.1, (3, 3, int(net.shape[-1]), depth)).astype(np.float32)
+      net = tf.nn.relu(tf.nn.conv2d(net, tf.constant(weights), strides=[1, 2, 2, 1], padding='SAME'))
+    features = tf.reduce_mean(net, axis=[1, 2])
+
+    corners = rng.uniform(0, 0.85, (max_detections, 2))
+    sizes = rng.uniform(0.02, 0.15, (max_detections, 2))
+    boxes = np.concatenate([corners, corners + sizes], axis=1).astype(np.float32)
+    classes = rng.randint(1, len(LABELS) + 1, max_detections).astype(np.float32)
+    score_weights = rng.normal(0, 1, (int(features.shape[-1]), max_detections)).astype(np.float32)
+    score_bias = rng.normal(-2, 1.5, max_detections).astype(np.float32)
+
+    scores = tf.sigmoid(tf.matmul(features, tf.constant(score_weights)) + tf.constant(score_bias))
+    top_scores, order = tf.nn.top_k(scores, k=max_detections)
+    tf.identity(tf.gather(tf.constant(boxes), order), name='detection_boxes')
+    tf.identity(top_scores, name='detection_scores')
+    tf.identity(tf.gather(tf.constant(classes), order), name='detection_classes')
+    tf.identity(tf.fill([tf.shape(image_tensor)[0]], float(max_detections)), name='num_detections')
+
+  with open(path, 'wb') as f:
+    f.write(graph.as_graph_def().SerializeToString())
+
+
+def write_label_map(path):
+  with open(path, 'w') as f:
+    for i, name in enumerate(LABELS):
+      f.write("item {\n  id: %d\n  name: '%s'\n}\n" % (i + 1, name))
+
+
+def load_app(graph_path, labels_path):
+  """Imports app.py with the given model and no GCS, authentication or warm-up."""
+  os.environ['PATH_TO_CKPT'] = os.path.dirname(graph_path)
+  os.environ['PATH_TO_LABELS'] = labels_path
+  for name, value in (('MODEL_BASE', ''), ('VM_NAME', 'benchmark'), ('HTTP_PORT', '0'),
+                      ('INFERENCE_URL', '/v1/objectInference'), ('INFERENCE_USER_NAME', 'benchmark'),
+                      ('INFERENCE_PASSWORD', 'benchmark'), ('INFERENCE_LOG_LEVEL', 'WARNING')):
+    os.environ.setdefault(name, value)
+  # The benchmark warms up every stage itself
+  os.environ['INFERENCE_WARMUP_FRAMES'] = '0'
+  sys.path.insert(0, HERE)
+  import app
+  return app
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def time_stage(func, inputs, iterations):
+  """Calls func on every input once to warm up, then iterations times over all inputs. Returns latencies in ms."""
+  for args in inputs:
+    func(*args)
+  latencies = []
+  for _ in range(iterations):
+    for args in inputs:
+      start_time = time.time()
+      func(*args)
+      latencies.append((time.time() - start_time) * 1000)
+  return latencies
+
+
+def run_stages(app, frames, iterations):
+  """Returns an ordered list of (stage, latencies in ms, peak RSS in MB after the stage)."""
+  def decode(jpeg_bytes):
+    image = app.image_utils.open_image(cStringIO.StringIO(jpeg_bytes), app.INFERENCE_DECODE_SIZE)
+    return image, app.image_utils.load_image_into_numpy_array(image)
+
+  images = [decode(jpeg_bytes)[0] for jpeg_bytes in frames]
+  detections = [app.client.detect(image) for image in images]
+
+  def proximity(boxes, scores, classes, num_detections):
+    return app.check_for_ball_proximity(boxes, scores, app.select_detections(scores, classes, num_detections))
+
+  def encode(image):
+    # As detect_objects() does for the upload page
+    thumbnail = image.copy()
+    thumbnail.thumbnail((480, 480), app.Image.ANTIALIAS)
+    return app.encode_image(thumbnail)
+
+  stages = (
+      ('decode', decode, [(jpeg_bytes,) for jpeg_bytes in frames]),
+      ('detect', app.client.detect, [(image,) for image in images]),
+      ('proximity', proximity, detections),
+      ('build_json_response', app.build_json_response, [d + (image,) for d, image in zip(detections, images)]),
+      ('encode_image', encode, [(image,) for image in images]),
+  )
+  results = []
+  for name, func, inputs in stages:
+    latencies = time_stage(func, inputs, iterations)
+    results.append((name, latencies, peak_rss_mb()))
+  return results
+
+
+def summarize(results):
+  stages = {}
+  for name, latencies, rss_mb in results:
+    latencies = np.asarray(latencies)
+    stages[name] = {
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'per_second': float(1000.0 / latencies.mean()) if latencies.mean() > 0 else None,
+        'peak_rss_mb': rss_mb,
+    }
+  return stages
+
+
+def compare(current, baseline, tolerance):
+  """Prints the change against the baseline and returns the list of regressions."""
+  regressions = []
+  if (current['graph'], current['frames_sha256']) != (baseline['graph'], baseline['frames_sha256']):
+    print("Warning: the baseline was taken with a different graph or different frames, the comparison may not mean much")
+  print("\n%-22s %12s %12s %9s" % ('vs baseline', 'base p50 ms', 'p50 ms', 'change'))
+  for name, stats in sorted(current['stages'].items()):
+    base = baseline['stages'].get(name)
+    if base is None:
+      print("%-22s %12s %12.3f %9s" % (name, '-', stats['p50_ms'], 'new'))
+      continue
+    change = stats['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] > 0 else 0.0
+    regressed = change > tolerance and stats['p50_ms'] - base['p50_ms'] > MIN_REGRESSION_MS
+    print("%-22s %12.3f %12.3f %+8.0f%%%s" % (name, base['p50_ms'], stats['p50_ms'], change * 100,
+                                            '  REGRESSION' if regressed else ''))
+    if regressed:
+      regressions.append(name)
+  rss_change = current['peak_rss_mb'] / baseline['peak_rss_mb'] - 1
+  regressed = rss_change > tolerance
+  print("%-22s %12.1f %12.1f %+8.0f%%%s" % ('peak RSS MB', baseline['peak_rss_mb'], current['peak_rss_mb'], rss_change * 100,
+                                          '  REGRESSION' if regressed else ''))
+  if regressed:
+    regressions.append('peak_rss')
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--frames', default=DEFAULT_FRAMES, help='glob of JPEG frames to run (default: the simulator arena frames)')
+  parser.add_argument('--graph', help='frozen_inference_graph.pb to use instead of the stand-in graph')
+  parser.add_argument('--labels', help='label map for --graph (default: a stand-in with the Cloud Derby labels)')
+  parser.add_argument('--iterations', type=int, default=20, help='passes over all frames per stage')
+  parser.add_argument('--baseline', help='baseline JSON to compare against')
+  parser.add_argument('--save-baseline', help='write the results as a baseline JSON to this file')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown flagged as a regression')
+  args = parser.parse_args()
+
+  frame_paths = sorted(glob.glob(args.frames))
+  if not frame_paths:
+    raise SystemExit("Error: no frames match '%s'" % args.frames)
+  frames = []
+  frames_hash = hashlib.sha256()
+  for path in frame_paths:
+    with open(path, 'rb') as f:
+      frames.append(f.read())
+    frames_hash.update(frames[-1])
+
+  temp_dir = tempfile.mkdtemp(prefix='benchmark_inference_')
+  try:
+    labels_path = args.labels
+    if labels_path is None:
+      labels_path = os.path.join(temp_dir, 'label_map.pbtxt')
+      write_label_map(labels_path)
+    # app.py loads frozen_inference_graph.pb from the PATH_TO_CKPT directory
+    graph_path = os.path.join(temp_dir, 'frozen_inference_graph.pb')
+    if args.graph:
+      shutil.copyfile(args.graph, graph_path)
+    else:
+      build_stand_in_graph(graph_path)
+    rss_before_model = peak_rss_mb()
+    app = load_app(graph_path, labels_path)
+    results = run_stages(app, frames, args.iterations)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  current = {
+      'version': BASELINE_VERSION,
+      'graph': os.path.basename(args.graph) if args.graph else 'stand-in',
+      'frames_sha256': frames_hash.hexdigest(),
+      'frames': len(frames),
+      'iterations': args.iterations,
+      'machine': '%s %s, Python %s' % (platform.node(), platform.machine(), platform.python_version()),
+      'stages': summarize(results),
+      'peak_rss_mb': peak_rss_mb(),
+  }
+
+  print("%d frames x %d iterations, graph: %s, peak RSS before loading the model: %.1f MB" % (
+      len(frames), args.iterations, current['graph'], rss_before_model))
+  print("%-22s %10s %10s %10s %10s %14s" % ('stage', 'mean ms', 'p50 ms', 'p95 ms', 'per second', 'peak RSS MB'))
+  for name, _, _ in results:
+    stats = current['stages'][name]
+    print("%-22s %10.3f %10.3f %10.3f %10.1f %14.1f" % (
+        name, stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['per_second'] or 0, stats['peak_rss_mb']))
+
+  if args.save_baseline:
+    with open(args.save_baseline, 'w') as f:
+      json.dump(current, f, indent=2, sort_keys=True)
+    print("Baseline saved to %s" % args.save_baseline)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline.get('version') != BASELINE_VERSION:
+      raise SystemExit("Error: baseline '%s' has version %s, expected %d" % (args.baseline, baseline.get('version'), BASELINE_VERSION))
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+      print("Regressions over %.0f%%: %s" % (args.tolerance * 100, ', '.join(regressions)))
+      sys.exit(1)
+    print("No regressions over %.0f%%" % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+  main()
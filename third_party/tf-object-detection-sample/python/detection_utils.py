@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('inference')
+
+
+def select_detections(scores, classes, num_detections, probability_threshold, max_per_class=0):
+  """Returns the indices of the detections worth building a response for.
+
+  Keeps detections scoring above probability_threshold and, when max_per_class
+  is set, only that many of the highest scoring ones per class. Indices are
+  returned in ascending order.
+  """
+  candidates = np.flatnonzero(scores[:num_detections] > probability_threshold)
+  if max_per_class <= 0 or candidates.size <= max_per_class:
+    return candidates
+
+  # Sort by class, then by descending score, and keep the first few of each class
+  order = candidates[np.lexsort((-scores[candidates], classes[candidates]))]
+  ordered_classes = classes[order]
+  class_starts = np.flatnonzero(np.r_[True, ordered_classes[1:] != ordered_classes[:-1]])
+  rank_in_class = np.arange(order.size) - np.repeat(class_starts, np.diff(np.r_[class_starts, order.size]))
+  return np.sort(order[rank_in_class < max_per_class])
+
+
+def check_for_ball_proximity(boxes, scores, indices, proximity_threshold):
+  """Drops detections that are within proximity_threshold of each other, keeping the higher score.
+
+  Works on the raw model output: indices selects the detections to consider and
+  the indices that survive are returned in ascending order. A detection is close
+  to another one when their top-left corners are within proximity_threshold of
+  the visited detection's width and height.
+
+  Detections are visited from the highest score down, ties by ascending index.
+  The result depends on that order because the thresholds are relative to the
+  visited box. The original string based version walked a plain dict keyed by
+  label, so its order, and which detections survived, followed the hash order of
+  the labels; this order is new and deterministic.
+  """
+  indices = np.asarray(indices, dtype=int)
+  if indices.size < 2:
+    return np.sort(indices)
+
+  order = indices[np.lexsort((indices, -scores[indices]))]
+  ordered_scores = scores[order]
+  # Since we are using relative coordinates 0 to 1 - boxes are [ymin, xmin, ymax, xmax]
+  y = boxes[order, 0]
+  x = boxes[order, 1]
+  h_threshold = (boxes[order, 2] - y) * proximity_threshold
+  w_threshold = (boxes[order, 3] - x) * proximity_threshold
+  close = ((np.abs(x[:, np.newaxis] - x[np.newaxis, :]) <= w_threshold[:, np.newaxis]) &
+           (np.abs(y[:, np.newaxis] - y[np.newaxis, :]) <= h_threshold[:, np.newaxis]))
+  np.fill_diagonal(close, False)
+
+  keep = np.ones(order.size, dtype=bool)
+  for i in range(order.size):
+    if not keep[i]:
+      continue
+    neighbours = close[i] & keep
+    if not neighbours.any():
+      continue
+    # Thresholds are relative to the visited box, so a neighbour that did not
+    # see this box as close can still remove it here
+    lower = neighbours & (ordered_scores <= ordered_scores[i])
+    if lower.any():
+      logger.debug("Removing detections %s because they are in close proximity to detection %s", order[lower], order[i])
+      keep &= ~lower
+    if (neighbours & ~lower).any():
+      logger.debug("Removing detection %s because it is in close proximity to a higher scoring detection", order[i])
+      keep[i] = False
+
+  return np.sort(order[keep])
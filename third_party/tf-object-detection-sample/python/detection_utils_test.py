@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for detection_utils.py:
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import re
+import unittest
+
+import numpy as np
+
+from detection_utils import check_for_ball_proximity
+from detection_utils import select_detections
+
+PROBABILITY_TRESHOLD = 0.05
+PROXIMITY_THRESHOLD = 0.04
+
+# label_map of app.py
+label_map = { "1":"BlueBall", "2":"RedBall", "3":"YellowBall", "4":"GreenBall", "5":"BlueHome", "6":"RedHome", "7":"YellowHome", "8":"GreenHome" }
+
+
+def baseline_build_json_response(boxes, scores, classes, num_detections):
+  """build_json_response() and check_for_ball_proximity() of app.py before they were vectorized, without their prints.
+
+  Returns the surviving detection indices. response_msg is a plain dict keyed by
+  label, so detections are visited in the hash order of the labels.
+  """
+  response_msg = {}
+  for i in range(num_detections):
+    if scores[i] > PROBABILITY_TRESHOLD:
+      ymin, xmin, ymax, xmax = boxes[i]
+      (left, right, bottom, top) = (xmin, xmax, ymin, ymax)
+      width = right-left
+      height = top - bottom
+      label = label_map[str(classes[i])] + str(i)
+      response_msg[label] = []
+      response_msg[label].append({"x":str(left), "y":str(bottom), "w":str(width), "h":str(height), "score":str(scores[i])})
+
+  responses_to_remove = []
+  for k,v in response_msg.iteritems():
+    if k not in responses_to_remove:
+      # Since we are using relative coordinates 0 to 1 - using float
+      x1 = float(response_msg[k][0]["x"])
+      y1 = float(response_msg[k][0]["y"])
+      width1 = float(response_msg[k][0]["w"])
+      height1 = float(response_msg[k][0]["h"])
+
+      for key,val in response_msg.iteritems():
+        if key != k and key not in responses_to_remove:
+          x_diff = abs(x1 - float(response_msg[key][0]["x"]))
+          y_diff = abs(y1 - float(response_msg[key][0]["y"]))
+          w_threshold = width1 * PROXIMITY_THRESHOLD
+          h_threshold = height1 * PROXIMITY_THRESHOLD
+
+          if x_diff <= w_threshold and  y_diff <= h_threshold:
+            if float(response_msg[k][0]["score"]) >= float(response_msg[key][0]["score"]):
+              responses_to_remove.append(key)
+            else:
+              if k not in responses_to_remove:
+                responses_to_remove.append(k)
+
+  for dkey in responses_to_remove:
+    del response_msg[dkey]
+
+  return sorted(int(re.search(r"\d+$", label).group()) for label in response_msg)
+
+
+def random_frame(rng, centers, sizes, num_detections=100):
+  """Detections with top-left corners scattered around the centers, distinct scores sorted descending like the model's.
+
+  Values are rounded so their string form, which the baseline parsed back, is exact.
+  """
+  corners = centers[rng.randint(0, len(centers), num_detections)] + rng.normal(0, 0.003, (num_detections, 2))
+  boxes = np.round(np.concatenate([corners, corners + sizes], axis=1), 4)
+  scores = np.sort(rng.choice(np.arange(1, 1000), num_detections, replace=False))[::-1] / 1000.0
+  classes = rng.randint(1, 9, num_detections)
+  return boxes, scores, classes
+
+
+def vectorized(boxes, scores, classes, num_detections):
+  candidates = select_detections(scores, classes, num_detections, PROBABILITY_TRESHOLD)
+  return check_for_ball_proximity(boxes, scores, candidates, PROXIMITY_THRESHOLD).tolist()
+
+
+def close_pairs(boxes, survivors):
+  """Pairs of survivors where one's top-left corner is within the proximity threshold of the other's."""
+  pairs = []
+  for a in survivors:
+    for b in survivors:
+      if a != b and (abs(boxes[a, 1] - boxes[b, 1]) <= (boxes[a, 3] - boxes[a, 1]) * PROXIMITY_THRESHOLD and
+                     abs(boxes[a, 0] - boxes[b, 0]) <= (boxes[a, 2] - boxes[a, 0]) * PROXIMITY_THRESHOLD):
+        pairs.append((a, b))
+  return pairs
+
+
+class CheckForBallProximityTest(unittest.TestCase):
+
+  def check(self, boxes, scores, expected):
+    boxes = np.array(boxes)
+    scores = np.array(scores)
+    self.assertEqual(check_for_ball_proximity(boxes, scores, range(len(scores)), PROXIMITY_THRESHOLD).tolist(), expected)
+
+  def test_close_pair_keeps_higher_score(self):
+    self.check([[0.5, 0.5, 0.6, 0.6], [0.502, 0.502, 0.602, 0.602]], [0.6, 0.9], [1])
+
+  def test_separate_clusters_keep_their_best(self):
+    self.check([[0.1, 0.1, 0.2, 0.2], [0.101, 0.101, 0.201, 0.201], [0.102, 0.1, 0.202, 0.2],
+                [0.7, 0.7, 0.8, 0.8], [0.701, 0.699, 0.801, 0.799]],
+               [0.5, 0.7, 0.6, 0.3, 0.4], [1, 4])
+
+  def test_chain_keeps_both_ends(self):
+    # 0 and 1 are close, 1 and 2 are close, 0 and 2 are not: 0 removes 1 first, so 2 has nothing left to be close to
+    self.check([[0.5, 0.5, 0.6, 0.6], [0.5, 0.503, 0.6, 0.603], [0.5, 0.506, 0.6, 0.606]], [0.9, 0.8, 0.7], [0, 2])
+
+  def test_thresholds_are_relative_to_the_visited_box(self):
+    # The large box 1 sees 0 as close but not 2, the small box 0 sees 2. Box 1 is visited first and removes 0,
+    # which leaves 2 standing
+    self.check([[0.51, 0.51, 0.53, 0.53], [0.5, 0.5, 0.755, 0.755], [0.5105, 0.5105, 0.7105, 0.7105]],
+               [0.8, 0.9, 0.7], [1, 2])
+
+  def test_tied_scores_keep_the_lower_index(self):
+    self.check([[0.5, 0.5, 0.6, 0.6], [0.501, 0.501, 0.601, 0.601]], [0.7, 0.7], [0])
+
+  def test_single_detection_is_kept(self):
+    self.check([[0.1, 0.1, 0.2, 0.2]], [0.9], [0])
+
+  def test_survivors_are_not_close_to_each_other(self):
+    # Holds for any visiting order, so for the baseline as well
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+      boxes, scores, classes = random_frame(rng, rng.uniform(0.1, 0.8, (6, 2)), rng.uniform(0.05, 0.2, (100, 2)))
+      for survivors in (vectorized(boxes, scores, classes, 100), baseline_build_json_response(boxes, scores, classes, 100)):
+        self.assertEqual(close_pairs(boxes, survivors), [])
+
+  def test_matches_baseline_when_order_does_not_matter(self):
+    # With at most two detections near each other and no tied scores the visiting order makes no difference.
+    # In denser clusters the baseline's result depends on the labels' hash order, and it differs from this
+    # version on most frames
+    rng = np.random.RandomState(1)
+    for _ in range(100):
+      centers = np.array([(0.05 + 0.18 * i, 0.05 + 0.18 * j) for i in range(5) for j in range(5)])
+      boxes, scores, classes = random_frame(rng, centers, rng.uniform(0.05, 0.1, (50, 2)), num_detections=50)
+      # Keep the first two detections at each center, drop the rest below the probability threshold
+      seen = {}
+      for i in range(50):
+        center = tuple(np.round(boxes[i, :2] / 0.18).astype(int))
+        seen[center] = seen.get(center, 0) + 1
+        if seen[center] > 2:
+          scores[i] = 0
+      self.assertEqual(vectorized(boxes, scores, classes, 50), baseline_build_json_response(boxes, scores, classes, 50))
+
+
+class SelectDetectionsTest(unittest.TestCase):
+
+  def test_keeps_scores_above_threshold(self):
+    scores = np.array([0.9, 0.01, 0.5, 0.05, 0.7])
+    classes = np.array([1, 1, 2, 2, 3])
+    self.assertEqual(select_detections(scores, classes, 5, PROBABILITY_TRESHOLD).tolist(), [0, 2, 4])
+    self.assertEqual(select_detections(scores, classes, 3, PROBABILITY_TRESHOLD).tolist(), [0, 2])
+
+  def test_limits_detections_per_class(self):
+    scores = np.array([0.2, 0.9, 0.5, 0.8, 0.7, 0.6])
+    classes = np.array([1, 1, 1, 2, 2, 1])
+    self.assertEqual(select_detections(scores, classes, 6, PROBABILITY_TRESHOLD, max_per_class=2).tolist(), [1, 3, 4, 5])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+from PIL import Image
+
+
+def parse_decode_size(value):
+  """Parses a 'WIDTHxHEIGHT' string such as '640x360'. Empty means full size."""
+  if not value:
+    return None
+  width, height = value.lower().split('x')
+  return (int(width), int(height))
+
+
+def open_image(image_file, decode_size=None):
+  """Opens an image file (path or file object) as an RGB PIL image.
+
+  When decode_size is given and the file is a JPEG, the decoder is asked to
+  scale down by 1/2, 1/4 or 1/8 while decoding, never going below decode_size.
+  Detection boxes are relative, so a smaller decode does not change their meaning.
+  """
+  image = Image.open(image_file)
+  if decode_size is not None:
+    image.draft('RGB', decode_size)
+  if image.mode != 'RGB':
+    image = image.convert('RGB')
+  return image
+
+
+def load_image_into_numpy_array(image):
+  """Returns a (height, width, 3) uint8 array straight from the PIL buffer."""
+  if image.mode != 'RGB':
+    image = image.convert('RGB')
+  return np.asarray(image, dtype=np.uint8)
+
+
+def legacy_load_image_into_numpy_array(image):
+  """Original per-pixel conversion, kept as the reference for benchmark_decode.py."""
+  (im_width, im_height) = image.size
+  return np.array(image.getdata()).reshape(
+      (im_height, im_width, 3)).astype(np.uint8)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+
+
+class ServingStats(object):
+  """Tracks in-flight inference requests and enforces the per-worker concurrency limit."""
+
+  def __init__(self, max_in_flight):
+    # 0 or less means no limit
+    self.max_in_flight = max_in_flight
+    self.in_flight = 0
+    self.requests_total = 0
+    self.rejected_total = 0
+    self._lock = threading.Lock()
+
+  def try_acquire(self):
+    with self._lock:
+      if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+        self.rejected_total += 1
+        return False
+      self.in_flight += 1
+      self.requests_total += 1
+      return True
+
+  def release(self):
+    with self._lock:
+      self.in_flight -= 1
+
+
+def format_prometheus(samples):
+  """Renders (name, type, help, value) tuples in the Prometheus text format."""
+  lines = []
+  for name, metric_type, help_text, value in samples:
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, metric_type))
+    lines.append('%s %s' % (name, value))
+  return '\n'.join(lines) + '\n'
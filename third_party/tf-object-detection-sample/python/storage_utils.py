@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+from collections import OrderedDict
+
+
+def split_gcs_uri(gcs_uri):
+  """Splits 'gs://bucket/path/to/file.jpg' into ('bucket', 'path/to/file.jpg')."""
+  uri_split = gcs_uri.split("/")
+  if len(uri_split) < 4 or uri_split[0] != "gs:" or not uri_split[2]:
+    raise ValueError("Not a valid GCS URI: '%s'" % gcs_uri)
+  return uri_split[2], "/".join(uri_split[3:])
+
+
+class GcsImageFetcher(object):
+  """Downloads GCS objects into memory, reusing one client and its bucket handles.
+
+  storage_client can be anything with a google.cloud.storage.Client style
+  bucket(name).blob(path).download_as_string() interface. Instead of a client,
+  create_client can be given to make one on the first fetch, so nothing needs
+  GCS credentials until an image is actually downloaded.
+  """
+
+  def __init__(self, storage_client=None, create_client=None):
+    self.storage_client = storage_client
+    self.create_client = create_client
+    self._buckets = {}
+    self._lock = threading.Lock()
+
+  def _bucket(self, bucket_name):
+    with self._lock:
+      if self.storage_client is None:
+        self.storage_client = self.create_client()
+      bucket = self._buckets.get(bucket_name)
+      if bucket is None:
+        # Unlike get_bucket() this does not make a metadata request
+        bucket = self.storage_client.bucket(bucket_name)
+        self._buckets[bucket_name] = bucket
+      return bucket
+
+  def fetch(self, gcs_uri):
+    bucket_name, file_and_path = split_gcs_uri(gcs_uri)
+    return self._bucket(bucket_name).blob(file_and_path).download_as_string()
+
+
+class LRUCache(object):
+  """Thread-safe cache holding at most max_size of the most recently used entries."""
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      if key not in self._entries:
+        return None
+      value = self._entries.pop(key)
+      self._entries[key] = value
+      return value
+
+  def put(self, key, value):
+    if self.max_size <= 0:
+      return
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = value
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def __len__(self):
+    with self._lock:
+      return len(self._entries)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for storage_utils.py, against a local fake of the GCS client:
+
+    python -m unittest discover -p '*_test.py'
+"""
+
+import unittest
+
+from storage_utils import GcsImageFetcher
+from storage_utils import LRUCache
+from storage_utils import split_gcs_uri
+
+
+class FakeNotFound(Exception):
+  pass
+
+
+class FakeBlob(object):
+
+  def __init__(self, client, bucket_name, path):
+    self.client = client
+    self.bucket_name = bucket_name
+    self.path = path
+
+  def download_as_string(self):
+    self.client.downloads.append((self.bucket_name, self.path))
+    try:
+      return self.client.objects[(self.bucket_name, self.path)]
+    except KeyError:
+      raise FakeNotFound("No such object: %s/%s" % (self.bucket_name, self.path))
+
+
+class FakeBucket(object):
+
+  def __init__(self, client, name):
+    self.client = client
+    self.name = name
+
+  def blob(self, path):
+    return FakeBlob(self.client, self.name, path)
+
+
+class FakeStorageClient(object):
+  """Serves objects from a dict and records the calls made to it."""
+
+  def __init__(self, objects):
+    self.objects = objects
+    self.buckets_created = []
+    self.downloads = []
+
+  def bucket(self, name):
+    self.buckets_created.append(name)
+    return FakeBucket(self, name)
+
+
+class SplitGcsUriTest(unittest.TestCase):
+
+  def test_splits_bucket_and_path(self):
+    self.assertEqual(split_gcs_uri('gs://bucket/path/to/file.jpg'), ('bucket', 'path/to/file.jpg'))
+
+  def test_rejects_other_uris(self):
+    for uri in ('bucket/file.jpg', 'http://bucket/file.jpg', 'gs:///file.jpg', 'gs://bucket'):
+      self.assertRaises(ValueError, split_gcs_uri, uri)
+
+
+class GcsImageFetcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self.client = FakeStorageClient({('derby', 'car1/image1.jpg'): 'jpeg 1',
+                                     ('derby', 'car1/image2.jpg'): 'jpeg 2'})
+
+  def test_fetches_object_contents(self):
+    fetcher = GcsImageFetcher(self.client)
+    self.assertEqual(fetcher.fetch('gs://derby/car1/image1.jpg'), 'jpeg 1')
+    self.assertEqual(fetcher.fetch('gs://derby/car1/image2.jpg'), 'jpeg 2')
+
+  def test_reuses_bucket_handles(self):
+    fetcher = GcsImageFetcher(self.client)
+    fetcher.fetch('gs://derby/car1/image1.jpg')
+    fetcher.fetch('gs://derby/car1/image2.jpg')
+    self.assertEqual(self.client.buckets_created, ['derby'])
+
+  def test_creates_client_on_first_fetch_only(self):
+    created = []
+
+    def create_client():
+      created.append(self.client)
+      return self.client
+
+    fetcher = GcsImageFetcher(create_client=create_client)
+    self.assertEqual(created, [])
+    fetcher.fetch('gs://derby/car1/image1.jpg')
+    fetcher.fetch('gs://derby/car1/image2.jpg')
+    self.assertEqual(len(created), 1)
+
+  def test_missing_object_raises_and_fetcher_keeps_working(self):
+    fetcher = GcsImageFetcher(self.client)
+    self.assertRaises(FakeNotFound, fetcher.fetch, 'gs://derby/car1/missing.jpg')
+    self.assertEqual(fetcher.fetch('gs://derby/car1/image1.jpg'), 'jpeg 1')
+
+  def test_invalid_uri_raises_without_download(self):
+    fetcher = GcsImageFetcher(self.client)
+    self.assertRaises(ValueError, fetcher.fetch, 'derby/car1/image1.jpg')
+    self.assertEqual(self.client.downloads, [])
+
+  def test_client_creation_failure_is_retried_on_next_fetch(self):
+    attempts = []
+
+    def create_client():
+      attempts.append(None)
+      if len(attempts) == 1:
+        raise RuntimeError("no credentials")
+      return self.client
+
+    fetcher = GcsImageFetcher(create_client=create_client)
+    self.assertRaises(RuntimeError, fetcher.fetch, 'gs://derby/car1/image1.jpg')
+    self.assertEqual(fetcher.fetch('gs://derby/car1/image1.jpg'), 'jpeg 1')
+    self.assertEqual(len(attempts), 2)
+
+
+class LRUCacheTest(unittest.TestCase):
+
+  def test_hit_and_miss(self):
+    cache = LRUCache(2)
+    cache.put('gs://derby/a.jpg', {'BlueBall1': []})
+    self.assertEqual(cache.get('gs://derby/a.jpg'), {'BlueBall1': []})
+    self.assertIsNone(cache.get('gs://derby/b.jpg'))
+
+  def test_evicts_least_recently_used(self):
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # Reading 'a' makes 'b' the least recently used entry
+    cache.get('a')
+    cache.put('c', 3)
+    self.assertEqual(len(cache), 2)
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.get('c'), 3)
+
+  def test_put_replaces_existing_entry(self):
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('a', 2)
+    self.assertEqual(len(cache), 1)
+    self.assertEqual(cache.get('a'), 2)
+
+  def test_zero_size_disables_cache(self):
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    self.assertEqual(len(cache), 0)
+    self.assertIsNone(cache.get('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
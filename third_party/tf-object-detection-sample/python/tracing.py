@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageLatencies(object):
+  """Thread-safe latency histogram per request stage, in milliseconds.
+
+  Rendered as one Prometheus histogram with a 'stage' label, so the stages of
+  a request can be compared on one dashboard.
+  """
+
+  DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+  def __init__(self, name, help_text, buckets_ms=DEFAULT_BUCKETS_MS):
+    self.name = name
+    self.help_text = help_text
+    self.buckets_ms = tuple(buckets_ms)
+    # stage -> [counts per bucket with the overflow bucket last, count, sum of milliseconds]
+    self._stages = {}
+    self._lock = threading.Lock()
+
+  def record(self, stage, latency_ms):
+    with self._lock:
+      entry = self._stages.get(stage)
+      if entry is None:
+        entry = [[0] * (len(self.buckets_ms) + 1), 0, 0.0]
+        self._stages[stage] = entry
+      entry[0][bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+      entry[1] += 1
+      entry[2] += latency_ms
+
+  def format_prometheus(self):
+    """Renders the histograms in the Prometheus text format."""
+    with self._lock:
+      stages = sorted((stage, list(counts), count, total) for stage, (counts, count, total) in self._stages.items())
+    lines = ['# HELP %s %s' % (self.name, self.help_text),
+             '# TYPE %s histogram' % self.name]
+    for stage, counts, count, total in stages:
+      cumulative = 0
+      for bucket_ms, bucket_count in zip(self.buckets_ms, counts):
+        cumulative += bucket_count
+        lines.append('%s_bucket{stage="%s",le="%s"} %d' % (self.name, stage, bucket_ms, cumulative))
+      lines.append('%s_bucket{stage="%s",le="+Inf"} %d' % (self.name, stage, count))
+      lines.append('%s_sum{stage="%s"} %s' % (self.name, stage, total))
+      lines.append('%s_count{stage="%s"} %d' % (self.name, stage, count))
+    return '\n'.join(lines) + '\n'
+
+
+class Trace(object):
+  """Stage timings of one request, under the correlation id the car gave its frame.
+
+  Spans are recorded into a StageLatencies as they finish; summary() gives a
+  single log line with all of them.
+  """
+
+  def __init__(self, trace_id, latencies):
+    self.trace_id = trace_id or '-'
+    self.latencies = latencies
+    self.start_time = time.time()
+    # (stage, milliseconds) in the order the stages finished
+    self.spans = []
+
+  def record(self, stage, latency_ms):
+    self.spans.append((stage, latency_ms))
+    self.latencies.record(stage, latency_ms)
+
+  @contextmanager
+  def span(self, stage):
+    """Times the block as the given stage."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.record(stage, (time.time() - start_time) * 1000)
+
+  def finish(self):
+    """Records the time since the trace was created as the 'total' stage."""
+    self.record('total', (time.time() - self.start_time) * 1000)
+
+  def summary(self):
+    return 'trace %s: %s' % (self.trace_id, ' '.join('%s=%.1fms' % (stage, ms) for stage, ms in self.spans))